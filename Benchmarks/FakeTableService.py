@@ -0,0 +1,170 @@
+import asyncio
+import datetime
+import itertools
+import re
+from typing import Any, AsyncIterator, Dict, Iterator, List, Mapping, Optional, Tuple
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.data.tables import TableEntity
+from Utils import CacheSnapshot, StorageSession, AzureTableBackend
+
+# Matches the "<column> <op> @<parameter>" clauses TableCache builds
+FILTER_CLAUSE = re.compile(r"(\w+)\s+(eq|ne|gt|ge|lt|le)\s+@(\w+)")
+FILTER_OPS = {
+    'eq': lambda a, b: a == b,
+    'ne': lambda a, b: a != b,
+    'gt': lambda a, b: a > b,
+    'ge': lambda a, b: a >= b,
+    'lt': lambda a, b: a < b,
+    'le': lambda a, b: a <= b,
+}
+
+
+class FakeTableClient:
+    tableName: str
+    rows: Dict[Tuple[str, str], Dict[str, Any]]
+    etags: Dict[Tuple[str, str], str]
+    versions: Iterator[int]
+    created: bool
+    latency: float
+    callCounts: Dict[str, int]
+
+    def __init__(self, tableName: str, latency: float = 0.0, callCounts: Optional[Dict[str, int]] = None):
+        self.tableName = tableName
+        self.rows = {}
+        self.etags = {}
+        self.versions = itertools.count(1)
+        self.created = False
+        self.latency = latency
+        self.callCounts = callCounts if callCounts is not None else {}
+
+    async def simulate_call(self, operation: str):
+        self.callCounts[operation] = self.callCounts.get(operation, 0) + 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+    async def get_entity(self, partition_key: str, row_key: str, **kwargs) -> Dict[str, Any]:
+        await self.simulate_call('get_entity')
+        row = self.rows.get((partition_key, row_key))
+        if row is None:
+            raise ResourceNotFoundError(f'Row [{row_key}] not found.')
+        return self.project(row, kwargs.get('select'))
+
+    async def upsert_entity(self, entity: Mapping[str, Any], **kwargs) -> Dict[str, Any]:
+        await self.simulate_call('upsert_entity')
+        return self.write_row(entity)
+
+    async def create_entity(self, entity: Mapping[str, Any], **kwargs) -> Dict[str, Any]:
+        await self.simulate_call('create_entity')
+        if (entity['PartitionKey'], entity['RowKey']) in self.rows:
+            raise ResourceExistsError(f'Row [{entity["RowKey"]}] already exists.')
+        return self.write_row(entity)
+
+    async def update_entity(self, entity: Mapping[str, Any], etag: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        await self.simulate_call('update_entity')
+        key = (entity['PartitionKey'], entity['RowKey'])
+        if key not in self.rows:
+            raise ResourceNotFoundError(f'Row [{entity["RowKey"]}] not found.')
+        if etag is not None and self.etags[key] != etag:
+            raise ResourceModifiedError(f'Row [{entity["RowKey"]}] changed since it was read.')
+        return self.write_row(entity)
+
+    async def submit_transaction(self, operations: List[Tuple], **kwargs) -> List[Dict[str, Any]]:
+        await self.simulate_call('submit_transaction')
+        if len(operations) > 100:
+            raise ValueError('Transactions are limited to 100 operations.')
+        # Checked up front, so a conflicting batch writes nothing
+        for operation in operations:
+            key = (operation[1]['PartitionKey'], operation[1]['RowKey'])
+            if operation[0] == 'create' and key in self.rows:
+                raise ResourceExistsError(f'Row [{key[1]}] already exists.')
+            etag = operation[2].get('etag') if len(operation) > 2 else None
+            if operation[0] == 'update' and etag is not None and self.etags.get(key) != etag:
+                raise ResourceModifiedError(f'Row [{key[1]}] changed since it was read.')
+        return [self.write_row(operation[1]) for operation in operations]
+
+    def query_entities(self, query_filter: str, parameters: Optional[Dict[str, Any]] = None,
+                       **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        clauses = [(column, FILTER_OPS[op], (parameters or {})[name])
+                   for column, op, name in FILTER_CLAUSE.findall(query_filter)]
+        select = kwargs.get('select')
+
+        async def pages():
+            await self.simulate_call('query_entities')
+            for row in list(self.rows.values()):
+                if all(column in row and matches(row[column], value) for column, matches, value in clauses):
+                    yield self.project(row, select)
+
+        return pages()
+
+    async def close(self):
+        pass
+
+    async def create_table(self, **kwargs):
+        await self.simulate_call('create_table')
+        if self.created:
+            raise ResourceExistsError(f'Table [{self.tableName}] already exists.')
+        self.created = True
+
+    def write_row(self, entity: Mapping[str, Any]) -> Dict[str, Any]:
+        key = (entity['PartitionKey'], entity['RowKey'])
+        # Upserts default to merge, so columns missing from the update are kept
+        row = self.rows.setdefault(key, {})
+        row.update(entity)
+        row['Timestamp'] = datetime.datetime.now(datetime.timezone.utc)
+        self.etags[key] = f'W/"{next(self.versions)}"'
+        return {"etag": self.etags[key], "timestamp": row['Timestamp']}
+
+    def project(self, row: Dict[str, Any], select: Optional[List[str]]) -> TableEntity:
+        if select is None:
+            entity = TableEntity(row)
+        else:
+            entity = TableEntity({column: row[column] for column in ['PartitionKey', 'RowKey', *select] if column in row})
+        # Like the real client, the ETag is only exposed through the metadata
+        entity._metadata = {"etag": self.etags.get((row['PartitionKey'], row['RowKey'])), "timestamp": row.get('Timestamp')}
+        return entity
+
+
+class FakeTableServiceClient:
+    tables: Dict[str, FakeTableClient]
+    latency: float
+    callCounts: Dict[str, int]
+
+    def __init__(self, latency: float = 0.0):
+        self.tables = {}
+        self.latency = latency
+        self.callCounts = {}
+
+    async def create_table(self, table_name: str, **kwargs) -> FakeTableClient:
+        tableClient = self.get_table_client(table_name)
+        await tableClient.create_table()
+        return tableClient
+
+    def get_table_client(self, table_name: str, **kwargs) -> FakeTableClient:
+        tableClient = self.tables.get(table_name)
+        if tableClient is None:
+            tableClient = FakeTableClient(table_name, self.latency, self.callCounts)
+            self.tables[table_name] = tableClient
+        return tableClient
+
+    async def close(self):
+        pass
+
+
+class FakeTableSession(StorageSession):
+    tableServiceClient: FakeTableServiceClient
+
+    def __init__(self, latency: float = 0.0, snapshotPath: Optional[str] = None):
+        self.tableServiceClient = FakeTableServiceClient(latency)
+        self.cacheSnapshot = CacheSnapshot(snapshotPath) if snapshotPath else None
+
+    async def open(self):
+        if self.cacheSnapshot is not None:
+            await self.cacheSnapshot.open()
+
+    async def close(self):
+        if self.cacheSnapshot is not None:
+            await self.cacheSnapshot.close()
+
+    def get_table(self, tableName: str) -> AzureTableBackend:
+        # The fake mimics the Azure client, so it runs behind the real Azure backend
+        return AzureTableBackend(tableName, self.tableServiceClient.get_table_client(table_name=tableName))
@@ -0,0 +1,40 @@
+import datetime
+import time
+from typing import Any, Dict, Optional
+from graphql import DocumentNode
+
+
+class StubLeetQuery:
+    async def daily_question(self) -> Dict[str, Any]:
+        return {
+            'activeDailyCodingChallengeQuestion': {
+                'date': datetime.datetime.now(datetime.timezone.utc).date().isoformat(),
+                'link': '/problems/two-sum/',
+                'question': {
+                    'acRate': 51.7,
+                    'difficulty': 'Easy',
+                    'frontendQuestionId': '1',
+                    'paidOnly': False,
+                    'title': 'Two Sum',
+                    'titleSlug': 'two-sum'
+                }
+            }
+        }
+
+    async def close(self):
+        pass
+
+
+class StubTransport:
+    # Stands in for LeetQuery.execute_once, every user in a batch solved two-sum just now
+    calls: int
+
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self, query: DocumentNode, queryName: str,
+                       variables: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        self.calls += 1
+        timestamp = str(int(time.time()))
+        return {alias: [{'titleSlug': 'two-sum', 'timestamp': timestamp}]
+                for alias in (variables or {}) if alias != 'limit'}
@@ -0,0 +1,2 @@
+from .FakeTableService import FakeTableSession, FakeTableServiceClient, FakeTableClient
+from .StubLeetQuery import StubLeetQuery
@@ -0,0 +1,248 @@
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import discord
+from discord.ext import commands
+from Entities import UserEntity, ReleaseClock
+from LCBot import DailyLC, StatsLC
+from Utils import TableCache, LeetQuery, StatsSnapshot
+from Benchmarks.FakeTableService import FakeTableSession
+from Benchmarks.StubLeetQuery import StubLeetQuery, StubTransport
+
+# Number of timed repeats per benchmark; the median repeat is reported
+REPEATS = 5
+
+
+def summarize(name: str, iterations: int, repeatTimes: List[float]) -> Dict[str, Any]:
+    perOp = [elapsed / iterations * 1e9 for elapsed in repeatTimes]
+    return {
+        "name": name,
+        "iterations": iterations,
+        "repeats": len(repeatTimes),
+        "medianNs": round(statistics.median(perOp), 1),
+        "minNs": round(min(perOp), 1),
+        "maxNs": round(max(perOp), 1),
+    }
+
+
+def bench_sync(name: str, iterations: int, func: Callable[[], Any],
+               setup: Optional[Callable[[], Any]] = None) -> Dict[str, Any]:
+    repeatTimes = []
+    for _ in range(REPEATS):
+        elapsed = 0.0
+        for _ in range(iterations):
+            if setup is not None:
+                setup()
+            startTime = time.perf_counter()
+            func()
+            elapsed += time.perf_counter() - startTime
+        repeatTimes.append(elapsed)
+    return summarize(name, iterations, repeatTimes)
+
+
+async def bench_async(name: str, iterations: int, func: Callable[[], Awaitable[Any]],
+                      setup: Optional[Callable[[], Any]] = None) -> Dict[str, Any]:
+    repeatTimes = []
+    for _ in range(REPEATS):
+        elapsed = 0.0
+        for _ in range(iterations):
+            if setup is not None:
+                setup()
+            startTime = time.perf_counter()
+            await func()
+            elapsed += time.perf_counter() - startTime
+        repeatTimes.append(elapsed)
+    return summarize(name, iterations, repeatTimes)
+
+
+def make_user(userId: int) -> UserEntity:
+    releaseDate = ReleaseClock.latest_release_date()
+    userEntity = UserEntity(str(userId))
+    userEntity.numEasy = 12
+    userEntity.numMedium = 30
+    userEntity.numHard = 4
+    for days in range(5, -1, -1):
+        userEntity.complete(releaseDate - datetime.timedelta(days=days))
+    return userEntity
+
+
+async def table_cache_benchmarks(session: FakeTableSession) -> List[Dict[str, Any]]:
+    results = []
+    tableCache = TableCache(UserEntity)
+    await tableCache.initialize_table(session)
+
+    userEntity = make_user(1)
+    await tableCache.save_entity(userEntity)
+    rowKey = str(userEntity.RowKey)
+
+    results.append(await bench_async("table_cache.load_entity.hit", 20000,
+                                     lambda: tableCache.load_entity(rowKey)))
+    results.append(await bench_async("table_cache.load_entity.miss", 5000,
+                                     lambda: tableCache.load_entity(rowKey),
+                                     setup=lambda: tableCache.localCache.invalidate(rowKey)))
+
+    def expire():
+        tableCache.localCache.entries[rowKey] = (userEntity, 0.0)
+    results.append(await bench_async("table_cache.load_entity.expired", 5000,
+                                     lambda: tableCache.load_entity(rowKey), setup=expire))
+
+    await tableCache.load_entity("missing")
+    results.append(await bench_async("table_cache.load_entity.negative_hit", 20000,
+                                     lambda: tableCache.load_entity("missing")))
+    results.append(await bench_async("table_cache.save_entity", 5000,
+                                     lambda: tableCache.save_entity(userEntity)))
+    await tableCache.close()
+
+    writeBehindCache = TableCache(UserEntity, writeBehind=True)
+    await writeBehindCache.initialize_table(session)
+    results.append(await bench_async("table_cache.save_entity.write_behind", 20000,
+                                     lambda: writeBehindCache.save_entity(userEntity)))
+    await writeBehindCache.close()
+
+    return results
+
+
+def entity_benchmarks() -> List[Dict[str, Any]]:
+    results = []
+    userEntity = make_user(1)
+    entity = userEntity.to_entity()
+
+    datetimeEntity = dict(entity, currStreakStartDate=f'{entity["currStreakStartDate"]}T00:00:00')
+    invalidEntity = dict(entity, currStreakStartDate='not-a-date')
+    legacyEntity = {key: value for key, value in entity.items() if key not in ('lastCompletedDate', 'SchemaVersion')}
+    legacyEntity['completedToday'] = True
+
+    results.append(bench_sync("user_entity.to_entity", 50000, userEntity.to_entity))
+    results.append(bench_sync("user_entity.from_entity", 50000, lambda: UserEntity.from_entity(entity)))
+    results.append(bench_sync("user_entity.from_entity.datetime_fallback", 50000,
+                              lambda: UserEntity.from_entity(datetimeEntity)))
+    results.append(bench_sync("user_entity.from_entity.invalid_fallback", 50000,
+                              lambda: UserEntity.from_entity(invalidEntity)))
+    results.append(bench_sync("user_entity.from_entity.legacy", 50000,
+                              lambda: UserEntity.from_entity(legacyEntity)))
+    results.append(bench_sync("user_entity.get_current_streak", 100000, userEntity.get_current_streak))
+
+    statsSnapshot = StatsSnapshot.from_entities(make_user(userId) for userId in range(1, 20001))
+    memberIds = list(range(1, 20001, 2))
+    results.append(bench_sync("stats_snapshot.server_stats.10000_members", 200,
+                              lambda: statsSnapshot.server_stats(memberIds, ReleaseClock.latest_release_date())))
+    return results
+
+
+async def cog_benchmarks(session: FakeTableSession) -> List[Dict[str, Any]]:
+    results = []
+    bot = commands.Bot(command_prefix='?', intents=discord.Intents.none())
+
+    statsLC = StatsLC(bot, session)
+    await statsLC.cog_load()
+    userEntity = make_user(1)
+    results.append(bench_sync("stats_lc.format_user_stats_embed", 20000,
+                              lambda: statsLC.format_user_stats_embed("grinder", userEntity)))
+    await statsLC.cog_unload()
+
+    dailyLC = DailyLC(bot, session)
+    dailyLC.leetQuery = StubLeetQuery()
+    await dailyLC.cog_load()
+    results.append(await bench_async("daily_lc.get_daily_question_message.warm", 20000,
+                                     dailyLC.get_daily_question_message))
+    results.append(await bench_async("daily_lc.get_daily_question_message.cold", 5000,
+                                     dailyLC.get_daily_question_message,
+                                     setup=dailyLC.questionCache.localCache.clear))
+    await dailyLC.cog_unload()
+
+    return results
+
+
+async def leet_query_benchmarks() -> List[Dict[str, Any]]:
+    results = []
+    leetQuery = LeetQuery()
+    leetQuery.execute_once = StubTransport()
+    usernames = [f'grinder{index}' for index in range(1000)]
+    since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=1)
+
+    results.append(await bench_async("leet_query.verify_completions.1000_users", 20,
+                                     lambda: leetQuery.verify_completions(usernames, 'two-sum', since),
+                                     setup=leetQuery.resultCache.clear))
+    results.append(await bench_async("leet_query.verify_completions.1000_users.cached", 200,
+                                     lambda: leetQuery.verify_completions(usernames, 'two-sum', since)))
+    await leetQuery.close()
+
+    return results
+
+
+async def run_benchmarks() -> List[Dict[str, Any]]:
+    session = FakeTableSession()
+    results = []
+    results.extend(await table_cache_benchmarks(session))
+    results.extend(entity_benchmarks())
+    results.extend(await cog_benchmarks(session))
+    results.extend(await leet_query_benchmarks())
+    return results
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    baselineResults = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        previous = baselineResults.get(result["name"])
+        if previous is None:
+            continue
+
+        change = result["medianNs"] / previous["medianNs"] - 1
+        result["baselineMedianNs"] = previous["medianNs"]
+        result["change"] = round(change, 3)
+        if change > threshold:
+            regressions.append(f'{result["name"]}: {previous["medianNs"]}ns -> {result["medianNs"]}ns ({change:+.0%})')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run LC bot hot path microbenchmarks.")
+    parser.add_argument("--output", help="Write results as JSON to this file instead of stdout.")
+    parser.add_argument("--baseline", help="JSON results from a previous run to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.3,
+                        help="Fail when a median slows down by more than this fraction of the baseline.")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmarks())
+    report = {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "results": results,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        report["regressions"] = regressions
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    for regression in regressions:
+        print(f'Regression: {regression}', file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,68 @@
-from azure.data.tables import TableEntity
 from abc import ABC, abstractmethod
-from typing import Type
+from typing import Any, ClassVar, Dict, FrozenSet, Optional, Tuple, Type, TypeVar
+from .EntitySchema import Field, VERSION_COLUMN, compile_codec
+
+T = TypeVar('T', bound='BaseEntity')
 
 
 class BaseEntity(ABC):
+    # Subclasses list every attribute in __slots__, which keeps millions of cached rows small
+    __slots__ = ('PartitionKey', 'RowKey', 'etag', 'selectedColumns')
+
+    # Declaring FIELDS generates to_entity and from_entity for the subclass.
+    # KEY_FIELD is the attribute decoded from the RowKey, if any. Subclasses assign both without re-annotating them
+    KEY_FIELD: ClassVar[Optional[Field]] = None
+    FIELDS: ClassVar[Optional[Tuple[Field, ...]]] = None
+    SCHEMA_VERSION: ClassVar[int] = 1
+    # Columns that are not fields but that upgrade() reads from older rows
+    UPGRADE_COLUMNS: ClassVar[Tuple[str, ...]] = ()
+
     PartitionKey: str
     RowKey: str
+    # ETag of the stored row this object was read from or last written as, None for rows not stored yet
+    etag: Optional[str]
+    # Columns the row was read with when loaded with a projection, None for full rows
+    selectedColumns: Optional[FrozenSet[str]]
 
     def __init__(self, partitionKey: str, rowKey: str):
         self.PartitionKey = partitionKey
         self.RowKey = rowKey
+        self.etag = None
+        self.selectedColumns = None
 
-    @abstractmethod
-    def to_entity(self) -> dict:
-        pass
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.FIELDS is None or 'FIELDS' not in cls.__dict__:
+            return
+
+        slots = {slot for klass in cls.__mro__ for slot in klass.__dict__.get('__slots__', ())}
+        missing = [field.name for field in (cls.KEY_FIELD, *cls.FIELDS) if field is not None and field.name not in slots]
+        if missing:
+            raise TypeError(f'{cls.__name__} fields {missing} are missing from __slots__.')
+
+        toEntity, fromEntity = compile_codec(cls, cls.KEY_FIELD, cls.FIELDS, cls.SCHEMA_VERSION)
+        setattr(cls, 'to_entity', toEntity)
+        setattr(cls, 'from_entity', classmethod(fromEntity))
 
     @classmethod
-    @abstractmethod
-    def from_entity(cls: Type['BaseEntity'], entity: TableEntity) -> 'BaseEntity':
+    def get_columns(cls, *names: str) -> FrozenSet[str]:
+        # Storage columns holding the given attributes, for projected reads
+        columns = {field.columnName for field in cls.FIELDS or () if field.name in names}
+        return frozenset(columns | {'PartitionKey', 'RowKey', VERSION_COLUMN, *cls.UPGRADE_COLUMNS})
+
+    def upgrade(self, entity: Dict[str, Any], version: int):
+        # Called by the generated decoder, so rows written by older schema versions can be converted
         pass
 
+    # Not abstract, since entities declaring FIELDS only get them once the class is created.
+    # Entities without FIELDS, like LeaderboardEntity, implement both
+    def to_entity(self) -> Dict[str, Any]:
+        raise NotImplementedError(f'{type(self).__name__} declares no FIELDS and does not implement to_entity.')
+
+    @classmethod
+    def from_entity(cls: Type[T], entity: Dict[str, Any]) -> T:
+        raise NotImplementedError(f'{cls.__name__} declares no FIELDS and does not implement from_entity.')
+
     @classmethod
     @abstractmethod
     def get_partition_key(cls) -> str:
@@ -0,0 +1,40 @@
+import datetime
+from typing import ClassVar
+from .BaseEntity import BaseEntity
+from .EntitySchema import Field, ID, STR, REQUIRED_DATE
+
+
+class DailyMessageEntity(BaseEntity):
+    __slots__ = ('messageId', 'guildId', 'channelId', 'releaseDate', 'difficulty', 'titleSlug')
+
+    PARTITION_KEY: ClassVar[str] = "DailyMessageCache"
+    KEY_FIELD = Field('messageId', ID)
+    FIELDS = (
+        Field('guildId', ID, 0),
+        Field('channelId', ID, 0),
+        Field('releaseDate', REQUIRED_DATE),
+        Field('difficulty', STR, ""),
+        # Checked against the user's accepted submissions when completions are verified
+        Field('titleSlug', STR, ""),
+    )
+
+    messageId: int
+    guildId: int
+    channelId: int
+    releaseDate: datetime.date
+    difficulty: str
+    titleSlug: str
+
+    def __init__(self, messageId: int, guildId: int, channelId: int, releaseDate: datetime.date, difficulty: str,
+                 titleSlug: str = ""):
+        super().__init__(self.PARTITION_KEY, str(messageId))
+        self.messageId = messageId
+        self.guildId = guildId
+        self.channelId = channelId
+        self.releaseDate = releaseDate
+        self.difficulty = difficulty
+        self.titleSlug = titleSlug
+
+    @classmethod
+    def get_partition_key(cls) -> str:
+        return cls.PARTITION_KEY
@@ -0,0 +1,109 @@
+import datetime
+from typing import Any, Callable, Dict, NamedTuple, Optional, Sequence, Tuple
+
+# Column stamped on every row with the schema version it was written with
+VERSION_COLUMN = "SchemaVersion"
+# Version assumed for rows written before versions were stored
+UNVERSIONED = 1
+
+
+class FieldType(NamedTuple):
+    # None stores the value as is, which lets the generated encoder skip the call
+    encode: Optional[Callable[[Any], Any]]
+    decode: Callable[[Any], Any]
+
+
+def encode_date(value: Optional[datetime.date]) -> str:
+    return value.isoformat() if value is not None else "None"
+
+
+def decode_date(data: str) -> Optional[datetime.date]:
+    if data == "None":
+        return None
+    # Dates are written as YYYY-MM-DD, anything longer is a legacy datetime
+    if len(data) == 10:
+        try:
+            return datetime.date.fromisoformat(data)
+        except ValueError:
+            pass
+    try:
+        return datetime.datetime.fromisoformat(data).date()
+    except ValueError:
+        return datetime.datetime.now().date()
+
+
+def encode_time(value: Optional[datetime.time]) -> str:
+    # Times are UTC, stored to the minute
+    return value.strftime("%H:%M") if value is not None else "None"
+
+
+def decode_time(data: str) -> Optional[datetime.time]:
+    if data == "None":
+        return None
+    return datetime.time.fromisoformat(data).replace(tzinfo=datetime.timezone.utc)
+
+
+INT = FieldType(None, int)
+FLOAT = FieldType(None, float)
+BOOL = FieldType(None, bool)
+STR = FieldType(None, str)
+# Discord snowflakes are stored as strings
+ID = FieldType(str, int)
+DATE = FieldType(encode_date, decode_date)
+TIME = FieldType(encode_time, decode_time)
+# Always set, so the "None" marker never appears in storage
+REQUIRED_DATE = FieldType(datetime.date.isoformat, datetime.date.fromisoformat)
+
+
+class Field(NamedTuple):
+    name: str
+    type: FieldType
+    default: Any = None
+    # Column name in storage, defaults to the attribute name
+    column: Optional[str] = None
+
+    @property
+    def columnName(self) -> str:
+        return self.column or self.name
+
+
+def compile_codec(cls: type, keyField: Optional[Field], fields: Sequence[Field],
+                  version: int) -> Tuple[Callable[[Any], Dict[str, Any]], Callable[[type, Dict[str, Any]], Any]]:
+    # Builds straight-line encode and decode functions once per entity type, like dataclasses does for __init__
+    namespace: Dict[str, Any] = {"VERSION_COLUMN": VERSION_COLUMN, "UNVERSIONED": UNVERSIONED, "version": version}
+
+    encodeLines = ["def to_entity(self):",
+                   "    entity = {",
+                   "        'PartitionKey': self.PartitionKey,",
+                   "        'RowKey': self.RowKey,",
+                   "        VERSION_COLUMN: version,"]
+    decodeLines = ["def from_entity(cls, entity):",
+                   "    obj = cls.__new__(cls)",
+                   "    obj.PartitionKey = cls.PARTITION_KEY",
+                   "    obj.RowKey = rowKey = str(entity['RowKey'])",
+                   "    obj.etag = None",
+                   "    obj.selectedColumns = None"]
+    if keyField is not None:
+        namespace["decode_key"] = keyField.type.decode
+        decodeLines.append(f"    obj.{keyField.name} = decode_key(rowKey)")
+
+    for index, field in enumerate(fields):
+        namespace[f"encode_{index}"] = field.type.encode
+        namespace[f"decode_{index}"] = field.type.decode
+        namespace[f"default_{index}"] = field.default
+
+        value = f"self.{field.name}" if field.type.encode is None else f"encode_{index}(self.{field.name})"
+        encodeLines.append(f"        {field.columnName!r}: {value},")
+        decodeLines.append(f"    value = entity.get({field.columnName!r})")
+        decodeLines.append(f"    obj.{field.name} = default_{index} if value is None else decode_{index}(value)")
+
+    encodeLines.append("    }")
+    # Rows read with a projection only write back the columns they were read with
+    encodeLines.append("    if self.selectedColumns is not None:")
+    encodeLines.append("        return {column: value for column, value in entity.items() if column in self.selectedColumns}")
+    encodeLines.append("    return entity")
+    decodeLines.append("    obj.upgrade(entity, entity.get(VERSION_COLUMN) or UNVERSIONED)")
+    decodeLines.append("    return obj")
+
+    exec(compile("\n".join(encodeLines + decodeLines), f"<{cls.__name__} codec>", "exec"), namespace)
+    return namespace["to_entity"], namespace["from_entity"]
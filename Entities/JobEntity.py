@@ -0,0 +1,67 @@
+import datetime
+from typing import ClassVar
+from .BaseEntity import BaseEntity
+from .EntitySchema import Field, INT, FLOAT, STR, REQUIRED_DATE
+
+
+class JobEntity(BaseEntity):
+    __slots__ = ('jobName', 'releaseDate', 'scope', 'status', 'cursor', 'processed', 'owner', 'leaseUntil',
+                 'completedAt')
+
+    PARTITION_KEY: ClassVar[str] = "JobCache"
+    PENDING: ClassVar[str] = "pending"
+    RUNNING: ClassVar[str] = "running"
+    DONE: ClassVar[str] = "done"
+    FIELDS = (
+        Field('jobName', STR, ""),
+        Field('releaseDate', REQUIRED_DATE),
+        Field('scope', STR, ""),
+        Field('status', STR, PENDING),
+        # Key of the last item whose chunk was processed, items are handled in key order
+        Field('cursor', STR, ""),
+        Field('processed', INT, 0),
+        Field('owner', STR, ""),
+        # Unix time until which the owner holds the run, so a crashed owner's run can be taken over
+        Field('leaseUntil', FLOAT, 0.0),
+        Field('completedAt', STR, ""),
+    )
+
+    jobName: str
+    releaseDate: datetime.date
+    scope: str
+    status: str
+    cursor: str
+    processed: int
+    owner: str
+    leaseUntil: float
+    completedAt: str
+
+    def __init__(self, jobName: str, releaseDate: datetime.date, scope: str = ""):
+        super().__init__(self.PARTITION_KEY, self.make_row_key(jobName, releaseDate, scope))
+        self.jobName = jobName
+        self.releaseDate = releaseDate
+        self.scope = scope
+        self.status = self.PENDING
+        self.cursor = ""
+        self.processed = 0
+        self.owner = ""
+        self.leaseUntil = 0.0
+        self.completedAt = ""
+
+    @staticmethod
+    def make_row_key(jobName: str, releaseDate: datetime.date, scope: str = "") -> str:
+        # One row per run, shard processes each run their own slice of a job
+        rowKey = f'{jobName}_{releaseDate.isoformat()}'
+        return f'{rowKey}_{scope}' if scope else rowKey
+
+    @property
+    def done(self) -> bool:
+        return self.status == self.DONE
+
+    def is_leased(self, owner: str, now: float) -> bool:
+        # True when another live owner is running the job
+        return self.status == self.RUNNING and self.owner != owner and self.leaseUntil > now
+
+    @classmethod
+    def get_partition_key(cls) -> str:
+        return cls.PARTITION_KEY
@@ -0,0 +1,47 @@
+from typing import Any, ClassVar, Dict, Type
+from .BaseEntity import BaseEntity
+
+
+class LeaderboardEntity(BaseEntity):
+    # Chunk columns vary per row, so this entity encodes itself instead of declaring FIELDS
+    __slots__ = ('guildId', 'snapshot')
+
+    PARTITION_KEY: ClassVar[str] = "LeaderboardCache"
+    # Azure caps binary properties at 64 KiB, so snapshots are split across several columns
+    CHUNK_SIZE: ClassVar[int] = 64 * 1024
+    MAX_CHUNKS: ClassVar[int] = 15
+    guildId: int
+    snapshot: bytes
+
+    def __init__(self, guildId: int, snapshot: bytes = b""):
+        super().__init__(self.PARTITION_KEY, str(guildId))
+        self.guildId = guildId
+        self.snapshot = snapshot
+
+    def is_storable(self) -> bool:
+        return len(self.snapshot) <= self.CHUNK_SIZE * self.MAX_CHUNKS
+
+    def to_entity(self) -> Dict[str, Any]:
+        chunks = [self.snapshot[start:start + self.CHUNK_SIZE]
+                  for start in range(0, len(self.snapshot), self.CHUNK_SIZE)]
+        if not self.is_storable():
+            raise ValueError(f'Leaderboard snapshot for guild [{self.guildId}] is too large to store.')
+
+        entity = {
+            "PartitionKey": self.PartitionKey,
+            "RowKey": self.RowKey,
+            "chunkCount": len(chunks),
+        }
+        for index, chunk in enumerate(chunks):
+            entity[f'chunk{index}'] = chunk
+        return entity
+
+    @classmethod
+    def from_entity(cls: Type['LeaderboardEntity'], entity: Dict[str, Any]) -> 'LeaderboardEntity':
+        chunkCount = int(entity.get('chunkCount', 0))
+        snapshot = b"".join(bytes(entity[f'chunk{index}']) for index in range(chunkCount))
+        return cls(int(entity['RowKey']), snapshot)
+
+    @classmethod
+    def get_partition_key(cls) -> str:
+        return cls.PARTITION_KEY
@@ -0,0 +1,59 @@
+import datetime
+from typing import ClassVar, Type, Dict, Any
+from .BaseEntity import BaseEntity
+from .EntitySchema import Field, STR, FLOAT, BOOL, REQUIRED_DATE
+
+
+class QuestionEntity(BaseEntity):
+    __slots__ = ('date', 'link', 'title', 'titleSlug', 'difficulty', 'acRate', 'frontendQuestionId', 'paidOnly')
+
+    PARTITION_KEY: ClassVar[str] = "QuestionCache"
+    KEY_FIELD = Field('date', REQUIRED_DATE)
+    FIELDS = (
+        Field('link', STR, ""),
+        Field('title', STR, ""),
+        Field('titleSlug', STR, ""),
+        Field('difficulty', STR, ""),
+        Field('acRate', FLOAT, 0.0),
+        Field('frontendQuestionId', STR, ""),
+        Field('paidOnly', BOOL, False),
+    )
+
+    date: datetime.date
+    link: str
+    title: str
+    titleSlug: str
+    difficulty: str
+    acRate: float
+    frontendQuestionId: str
+    paidOnly: bool
+
+    def __init__(self, date: datetime.date):
+        super().__init__(self.PARTITION_KEY, date.isoformat())
+        self.date = date
+        self.link = ""
+        self.title = ""
+        self.titleSlug = ""
+        self.difficulty = ""
+        self.acRate = 0.0
+        self.frontendQuestionId = ""
+        self.paidOnly = False
+
+    @classmethod
+    def from_query(cls: Type['QuestionEntity'], result: Dict[str, Any]) -> 'QuestionEntity':
+        dailyQuestion = result['activeDailyCodingChallengeQuestion']
+        question = dailyQuestion['question']
+
+        obj = cls(datetime.date.fromisoformat(dailyQuestion['date']))
+        obj.link = dailyQuestion['link']
+        obj.title = question['title']
+        obj.titleSlug = question['titleSlug']
+        obj.difficulty = question['difficulty']
+        obj.acRate = float(question['acRate'])
+        obj.frontendQuestionId = str(question['frontendQuestionId'])
+        obj.paidOnly = bool(question['paidOnly'])
+        return obj
+
+    @classmethod
+    def get_partition_key(cls) -> str:
+        return cls.PARTITION_KEY
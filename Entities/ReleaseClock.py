@@ -0,0 +1,34 @@
+import datetime
+from typing import Optional
+
+RELEASE_TIME = datetime.time(hour=11, minute=00, tzinfo=datetime.timezone.utc)
+
+
+def latest_release(now: Optional[datetime.datetime] = None,
+                   releaseTime: datetime.time = RELEASE_TIME) -> datetime.datetime:
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+    release = datetime.datetime.combine(now.date(), releaseTime)
+    if now < release:
+        # Before the release time, use yesterday as latest release
+        release = release - datetime.timedelta(days=1)
+
+    return release
+
+
+def next_release(now: Optional[datetime.datetime] = None,
+                 releaseTime: datetime.time = RELEASE_TIME) -> datetime.datetime:
+    return latest_release(now, releaseTime) + datetime.timedelta(days=1)
+
+
+def latest_release_date(now: Optional[datetime.datetime] = None,
+                        releaseTime: datetime.time = RELEASE_TIME) -> datetime.date:
+    return latest_release(now, releaseTime).date()
+
+
+def oldest_open_release_date(now: Optional[datetime.datetime] = None) -> datetime.date:
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+    # Guilds post at their own time of day, so a guild posting late in the day still has yesterday's release open
+    return now.date() - datetime.timedelta(days=1)
@@ -0,0 +1,40 @@
+import datetime
+from typing import ClassVar, Tuple
+from .BaseEntity import BaseEntity
+from .EntitySchema import Field, ID, REQUIRED_DATE
+
+
+class SentMarkerEntity(BaseEntity):
+    __slots__ = ('releaseDate', 'guildId', 'messageId')
+
+    PARTITION_KEY: ClassVar[str] = "SentMarkerCache"
+    FIELDS = (
+        Field('releaseDate', REQUIRED_DATE),
+        Field('guildId', ID, 0),
+        # Daily LC message posted for the release
+        Field('messageId', ID, 0),
+    )
+
+    releaseDate: datetime.date
+    guildId: int
+    messageId: int
+
+    def __init__(self, releaseDate: datetime.date, guildId: int, messageId: int = 0):
+        super().__init__(self.PARTITION_KEY, self.make_row_key(releaseDate, guildId))
+        self.releaseDate = releaseDate
+        self.guildId = guildId
+        self.messageId = messageId
+
+    @staticmethod
+    def make_row_key(releaseDate: datetime.date, guildId: int) -> str:
+        # Keyed by release date first, so one release's markers are a single key range
+        return f'{releaseDate.isoformat()}_{guildId}'
+
+    @staticmethod
+    def key_range(releaseDate: datetime.date) -> Tuple[str, str]:
+        # '`' sorts right after '_', so the range holds exactly the release's rows
+        return f'{releaseDate.isoformat()}_', f'{releaseDate.isoformat()}`'
+
+    @classmethod
+    def get_partition_key(cls) -> str:
+        return cls.PARTITION_KEY
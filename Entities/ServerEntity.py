@@ -1,28 +1,29 @@
-from azure.data.tables import TableEntity
-from typing import ClassVar, Type
+import datetime
+from typing import ClassVar, Optional
 from .BaseEntity import BaseEntity
+from .EntitySchema import Field, ID, TIME
 
 
 class ServerEntity(BaseEntity):
+    __slots__ = ('guildId', 'channelId', 'postTime')
+
     PARTITION_KEY: ClassVar[str] = "ChannelCache"
+    KEY_FIELD = Field('guildId', ID)
+    FIELDS = (
+        Field('channelId', ID, 0, column='ChannelId'),
+        # UTC time of day the daily question is posted, None uses the default release time
+        Field('postTime', TIME, column='PostTime'),
+    )
+
+    guildId: int
     channelId: int
+    postTime: Optional[datetime.time]
 
-    def __init__(self, guildId: int, channelId: int = 0):
+    def __init__(self, guildId: int, channelId: int = 0, postTime: Optional[datetime.time] = None):
         super().__init__(self.PARTITION_KEY, str(guildId))
+        self.guildId = guildId
         self.channelId = channelId
-
-    def to_entity(self) -> dict:
-        return {
-            "PartitionKey": self.PartitionKey,
-            "RowKey": self.RowKey,
-            "ChannelId": str(self.channelId),
-        }
-
-    @classmethod
-    def from_entity(cls: Type['ServerEntity'], entity: TableEntity) -> 'ServerEntity':
-        obj = cls(int(entity.get('RowKey', "0")))
-        obj.channelId = int(entity.get('ChannelId', "0"))
-        return obj
+        self.postTime = postTime
 
     @classmethod
     def get_partition_key(cls) -> str:
@@ -1,18 +1,61 @@
 import datetime
-from azure.data.tables import TableEntity
-from typing import ClassVar, Type, Optional
+from typing import Any, ClassVar, Dict, Optional, Tuple
 from .BaseEntity import BaseEntity
+from .EntitySchema import Field, INT, STR, DATE
+from . import ReleaseClock
+
+
+def is_streak_alive(currStreakStartDate: Optional[datetime.date],
+                    lastCompletedDate: Optional[datetime.date],
+                    releaseDate: datetime.date) -> bool:
+    # A streak survives until the user misses a full release
+    return (currStreakStartDate is not None
+            and lastCompletedDate is not None
+            and lastCompletedDate >= releaseDate - datetime.timedelta(days=1))
+
+
+def current_streak(currStreakStartDate: Optional[datetime.date],
+                   lastCompletedDate: Optional[datetime.date],
+                   releaseDate: datetime.date) -> int:
+    if (currStreakStartDate is None or lastCompletedDate is None
+            or not is_streak_alive(currStreakStartDate, lastCompletedDate, releaseDate)):
+        return 0
+    return (lastCompletedDate - currStreakStartDate).days + 1
 
 
 class UserEntity(BaseEntity):
+    __slots__ = ('id', 'numEasy', 'numMedium', 'numHard', 'longestStreak', 'currStreakStartDate',
+                 'lastCompletedDate', 'leetcodeUsername', 'needsMigration')
+
     PARTITION_KEY: ClassVar[str] = "UserCache"
-    userId: int
+    # Version 1 rows kept a completedToday flag instead of lastCompletedDate
+    SCHEMA_VERSION: ClassVar[int] = 2
+    KEY_FIELD = Field('id', STR)
+    FIELDS = (
+        Field('numEasy', INT, 0),
+        Field('numMedium', INT, 0),
+        Field('numHard', INT, 0),
+        Field('longestStreak', INT, 0),
+        Field('currStreakStartDate', DATE),
+        Field('lastCompletedDate', DATE),
+        # Set with /link, completions are verified against this account's submissions
+        Field('leetcodeUsername', STR, ""),
+    )
+    # Read by projected loads too, so legacy rows can still be migrated
+    UPGRADE_COLUMNS: ClassVar[Tuple[str, ...]] = ('completedToday',)
+    # Fields the streak housekeeping pass reads and writes
+    STREAK_FIELDS: ClassVar[Tuple[str, ...]] = ('currStreakStartDate', 'lastCompletedDate')
+
+    id: str
     numEasy: int
     numMedium: int
     numHard: int
     longestStreak: int
-    currStreakStartDate: Optional[datetime.date] = None
-    completedToday: bool
+    currStreakStartDate: Optional[datetime.date]
+    lastCompletedDate: Optional[datetime.date]
+    leetcodeUsername: str
+    # Set when the row was read in the legacy completedToday format and still needs to be rewritten
+    needsMigration: bool
 
     def __init__(self, userId: str):
         super().__init__(self.PARTITION_KEY, str(userId))
@@ -22,67 +65,62 @@ class UserEntity(BaseEntity):
         self.numHard = 0
         self.longestStreak = 0
         self.currStreakStartDate = None
-        self.completedToday = False
-
-    def to_entity(self) -> dict:
-        currStreakStartDataStr = (self.currStreakStartDate.isoformat() if self.currStreakStartDate else "None")
-
-        return {
-            "PartitionKey": self.PartitionKey,
-            "RowKey": str(self.RowKey),
-            "numEasy": self.numEasy,
-            "numMedium": self.numMedium,
-            "numHard": self.numHard,
-            "longestStreak": self.longestStreak,
-            "currStreakStartDate": currStreakStartDataStr,  # ISO format for datetime
-            "completedToday": self.completedToday
-        }
+        self.lastCompletedDate = None
+        self.leetcodeUsername = ""
+        self.needsMigration = False
 
-    @classmethod
-    def from_entity(cls: Type['UserEntity'], entity: TableEntity) -> 'UserEntity':
-        user_id = entity['RowKey']
-        obj = cls(user_id)
-        obj.numEasy = int(entity.get('numEasy', 0))
-        obj.numMedium = int(entity.get('numMedium', 0))
-        obj.numHard = int(entity.get('numHard', 0))
-        obj.longestStreak = int(entity.get('longestStreak', 0))
-        obj.completedToday = entity.get('completedToday', False)
-
-        currStreakStartDateData = entity['currStreakStartDate']
-        if currStreakStartDateData == "None":
-            currStreakStartDate = None
-        else:
-            try:
-                currStreakStartDate = datetime.date.fromisoformat(currStreakStartDateData)
-            except ValueError:
-                try:
-                    currStreakStartDate = datetime.datetime.fromisoformat(currStreakStartDateData).date()
-                except ValueError:
-                    currStreakStartDate = datetime.datetime.now().date()
-            finally:
-                obj.currStreakStartDate = currStreakStartDate
-        return obj
+    def upgrade(self, entity: Dict[str, Any], version: int):
+        self.needsMigration = False
+        if version < 2 and entity.get('lastCompletedDate') is None:
+            self.migrate_legacy_streak(entity.get('completedToday', False))
 
     @classmethod
     def get_partition_key(cls) -> str:
         return cls.PARTITION_KEY
 
-    def get_current_streak(self) -> int:
-        if (self.currStreakStartDate is None):
-            return 0
+    def migrate_legacy_streak(self, completedToday: bool, releaseDate: Optional[datetime.date] = None):
+        # Legacy rows relied on the nightly job to reset completedToday and clear broken streaks
+        if releaseDate is None:
+            releaseDate = ReleaseClock.latest_release_date()
+
+        if completedToday:
+            self.lastCompletedDate = releaseDate
+        elif self.currStreakStartDate is not None:
+            self.lastCompletedDate = releaseDate - datetime.timedelta(days=1)
+        else:
+            self.lastCompletedDate = None
+        self.needsMigration = True
+
+    @property
+    def completedToday(self) -> bool:
+        return self.has_completed(ReleaseClock.latest_release_date())
+
+    def has_completed(self, releaseDate: datetime.date) -> bool:
+        # A later release completed in a guild that posts earlier in the day covers this one too
+        return self.lastCompletedDate is not None and self.lastCompletedDate >= releaseDate
 
-        utc = datetime.timezone.utc
-        now = datetime.datetime.now(utc)
-        time = datetime.time(hour=11, minute=00, tzinfo=utc)
+    def is_streak_alive(self, releaseDate: datetime.date) -> bool:
+        return is_streak_alive(self.currStreakStartDate, self.lastCompletedDate, releaseDate)
 
-        nextRelease = datetime.datetime.combine(now.date(), time)
+    def get_current_streak(self, releaseDate: Optional[datetime.date] = None) -> int:
+        if releaseDate is None:
+            releaseDate = ReleaseClock.latest_release_date()
 
-        if now > nextRelease:
-            # Before 11 AM UTC, use yesterday as latest release
-            nextRelease = nextRelease + datetime.timedelta(days=1)
+        return current_streak(self.currStreakStartDate, self.lastCompletedDate, releaseDate)
 
-        latestRelease = nextRelease - datetime.timedelta(days=1)
+    def complete(self, releaseDate: datetime.date) -> bool:
+        if not self.is_streak_alive(releaseDate):
+            self.currStreakStartDate = releaseDate
+        self.lastCompletedDate = releaseDate
 
-        todayBonus = (0 if self.completedToday else -1)
+        currentStreak = self.get_current_streak(releaseDate)
+        if currentStreak > self.longestStreak:
+            self.longestStreak = currentStreak
+            return True
+        return False
 
-        return (latestRelease.date() - self.currStreakStartDate).days + 1 + todayBonus
+    def clear_broken_streak(self, releaseDate: datetime.date) -> bool:
+        if self.currStreakStartDate is None or self.is_streak_alive(releaseDate):
+            return False
+        self.currStreakStartDate = None
+        return True
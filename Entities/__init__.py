@@ -1,3 +1,9 @@
 from .BaseEntity import BaseEntity
 from .ServerEntity import ServerEntity
 from .UserEntity import UserEntity
+from .QuestionEntity import QuestionEntity
+from .DailyMessageEntity import DailyMessageEntity
+from . import ReleaseClock
+from .LeaderboardEntity import LeaderboardEntity
+from .JobEntity import JobEntity
+from .SentMarkerEntity import SentMarkerEntity
@@ -1,9 +1,16 @@
+import asyncio
 import datetime
+import functools
 import logging
+import os
+import time
+from typing import Optional, Dict, List, Set, Tuple, Collection
+import aiohttp
 import discord
 from discord.ext import commands, tasks
-from Utils import LeetQuery, TableCache
-from Entities import ServerEntity
+from Utils import (LeetQuery, TableCache, StorageSession, FanOut, FanOutReport, ShardPlan, Job, JobScheduler,
+                   ReleaseSchedule, TimingWheel, Metrics, LogPipeline)
+from Entities import ServerEntity, QuestionEntity, DailyMessageEntity, SentMarkerEntity, ReleaseClock
 
 difficultColor = {
         'easy': discord.Color.green(),
@@ -12,69 +19,288 @@ difficultColor = {
         }
 
 
+def is_retryable_send_error(error: Exception) -> bool:
+    # Sends are not idempotent, a timed out or 5xx send may still have been posted, so only
+    # rate limits and connections that failed before the request went out are retried
+    if isinstance(error, discord.HTTPException):
+        return error.status == 429
+    return isinstance(error, aiohttp.ClientConnectorError)
+
+
 class DailyLC(commands.Cog):
+    # Number of past release days whose Daily LC messages stay in the index
+    MESSAGE_INDEX_DAYS = 7
+    # Guilds posted to between checkpoints of a daily question run
+    SEND_CHUNK_SIZE = 250
+    # Longest the release loop sleeps without checking the wheel
+    MAX_RELEASE_SLEEP = 3600
+
     bot: commands.Bot
     logger: logging.Logger
     serverCache: TableCache
+    questionCache: TableCache
+    dailyMessageCache: TableCache
+    sentMarkerCache: TableCache
+    dailyMessages: Dict[int, DailyMessageEntity]
+    sentReleaseDates: Dict[int, datetime.date]
+    tableSession: StorageSession
+    shardPlan: ShardPlan
+    jobScheduler: Optional[JobScheduler]
+    releaseSchedule: ReleaseSchedule
+    releaseWheel: TimingWheel
+    releaseWakeup: asyncio.Event
+    releaseTask: Optional[asyncio.Task]
+    leetQuery: LeetQuery
+    ownsLeetQuery: bool
+    questionLock: asyncio.Lock
+    fanOut: FanOut
 
-    def __init__(self, bot: commands.Bot, connectionString: str):
+    def __init__(self, bot: commands.Bot, tableSession: StorageSession, shardPlan: Optional[ShardPlan] = None,
+                 jobScheduler: Optional[JobScheduler] = None, releaseSchedule: Optional[ReleaseSchedule] = None,
+                 leetQuery: Optional[LeetQuery] = None):
         self.bot = bot
-        self.daily_question_loop.start()
+        self.prefetch_question_loop.start()
         self.logger = logging.getLogger('discord.DailyLC')
 
-        self.serverCache = TableCache(ServerEntity)
-        self.serverCache.initialize_table(connectionString)
+        self.tableSession = tableSession
+        self.shardPlan = shardPlan if shardPlan is not None else ShardPlan()
+        self.jobScheduler = jobScheduler
+        self.releaseSchedule = releaseSchedule if releaseSchedule is not None else ReleaseSchedule()
+        self.releaseWheel = TimingWheel()
+        self.releaseWakeup = asyncio.Event()
+        self.releaseTask = None
+        # Server configs can be changed from any instance, so poll for their changes when configured
+        self.serverCache = TableCache(ServerEntity, pollInterval=float(os.getenv('CACHE_POLL_INTERVAL', 0)),
+                                      onChange=self.apply_server_changes)
+        self.questionCache = TableCache(QuestionEntity)
+        self.dailyMessageCache = TableCache(DailyMessageEntity)
+        self.sentMarkerCache = TableCache(SentMarkerEntity)
+        self.dailyMessages = {}
+        self.sentReleaseDates = {}
+
+        # Shared with the other cog when injected, so there is one session and one circuit breaker to leetcode.com
+        self.ownsLeetQuery = leetQuery is None
+        self.leetQuery = leetQuery if leetQuery is not None else LeetQuery()
+        self.questionLock = asyncio.Lock()
+
+        concurrency = int(os.getenv('FANOUT_CONCURRENCY', FanOut.CONCURRENCY))
+        self.fanOut = FanOut(concurrency=concurrency, isRetryable=is_retryable_send_error)
+
+    async def cog_load(self):
+        await self.serverCache.initialize_table(self.tableSession)
+        await self.questionCache.initialize_table(self.tableSession)
+        await self.dailyMessageCache.initialize_table(self.tableSession)
+        await self.sentMarkerCache.initialize_table(self.tableSession)
+        await self.load_daily_messages()
+        await self.load_release_schedule()
+
+        if self.jobScheduler is not None:
+            # Without a scheduler to checkpoint the runs, the question is only sent on demand
+            self.releaseTask = asyncio.create_task(self.release_loop())
 
-    def cog_unload(self):
-        self.daily_question_loop.cancel()
+    async def cog_unload(self):
+        if self.releaseTask is not None:
+            self.releaseTask.cancel()
+        self.prefetch_question_loop.cancel()
+        await self.serverCache.close()
+        await self.questionCache.close()
+        await self.dailyMessageCache.close()
+        await self.sentMarkerCache.close()
+        if self.ownsLeetQuery:
+            await self.leetQuery.close()
 
-    @tasks.loop(time=datetime.time(hour=11, minute=00, tzinfo=datetime.timezone.utc))
-    async def daily_question_loop(self):
-        self.logger.debug("Preparing to send daily question.")
+    @tasks.loop(time=datetime.time(hour=10, minute=55, tzinfo=datetime.timezone.utc))
+    async def prefetch_question_loop(self):
+        self.logger.debug("Prefetching daily question.")
         try:
-            await self.send_daily_question()
-            self.logger.info("Successfully sent daily LC message.")
+            question = await self.get_daily_question()
+            if question is not None:
+                self.logger.info('Prefetched daily question [%s] for [%s].', question.titleSlug, question.date)
         except Exception as e:
-            self.logger.error(f"Error in daily_question_loop: {e}", exc_info=True)
+            self.logger.error('Error in prefetch_question_loop: %s', e, exc_info=True)
 
-    @daily_question_loop.error
-    async def daily_question_loop_error(self, error):
-        self.logger.error(f"Unhandled error in daily_question_loop: {error}", exc_info=True)
-        if not self.daily_question_loop.is_running():
-            self.logger.info("Restarting daily_question_loop.")
-            self.daily_question_loop.restart()
+    async def load_release_schedule(self):
+        try:
+            servers = await self.serverCache.load_partition()
+            ownedServers = [server for server in servers.values() if self.shardPlan.owns_guild(server.guildId)]
+            for server in ownedServers:
+                self.releaseSchedule.set_post_time(server.guildId, server.postTime)
+                if server.channelId > 0:
+                    self.schedule_release(server.guildId)
+            self.logger.info('Scheduled releases for [%s] servers.', len(self.releaseWheel))
+        except Exception as e:
+            self.logger.error('Failed to load release schedule: %s', e, exc_info=True)
 
-    async def send_daily_question(self):
-        message = await self.get_daily_question_message()
+    def apply_server_changes(self, servers: Dict[str, ServerEntity]):
+        # Channels and post times set on other instances move this instance's wheel too
+        for server in servers.values():
+            if not self.shardPlan.owns_guild(server.guildId):
+                continue
+            self.releaseSchedule.set_post_time(server.guildId, server.postTime)
+            if server.channelId > 0:
+                self.schedule_release(server.guildId)
+
+    def schedule_release(self, guildId: int):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        release = self.releaseSchedule.latest_release(guildId, now)
+        # A release missed while the bot was down is posted on the next tick, as long as its question is still
+        # LeetCode's daily question, otherwise the guild would get the same question again at its next post
+        if self.sentReleaseDates.get(guildId, datetime.date.min) >= release.date() or release.date() != now.date():
+            release = self.releaseSchedule.next_release(guildId, now)
+        self.releaseWheel.schedule(guildId, release.timestamp())
+        self.releaseWakeup.set()
 
-        for guild in self.bot.guilds:
+    async def release_loop(self):
+        while True:
+            self.releaseWakeup.clear()
+            guildIds = self.releaseWheel.advance(time.time())
+            if guildIds:
+                await self.release_guilds(guildIds)
+
+            nextDue = self.releaseWheel.next_due()
+            delay = self.MAX_RELEASE_SLEEP if nextDue is None else nextDue - time.time()
             try:
-                channelId = self.load_channel_cache(guild.id)
-                if (channelId > 0):
-                    self.logger.info(f'Channel [{channelId}] was returned from the cache.')
-                    channel = self.bot.get_channel(int(channelId))
-                    if (channel is not None):
-                        await channel.send(embed=message)
-                        self.logger.info(f'Successfully sent daily question to server [{guild.id}].')
-                    else:
-                        self.logger.info(f'Failed to get channel object for server [{guild.id}].')
+                await asyncio.wait_for(self.releaseWakeup.wait(), timeout=min(self.MAX_RELEASE_SLEEP, max(0.05, delay)))
+            except asyncio.TimeoutError:
+                pass
+
+    async def release_guilds(self, guildIds: List[int]):
+        # Post times can be changed from any instance, so they are re-read before the guilds are released
+        servers = await asyncio.gather(*(self.serverCache.load_entity(guildId) for guildId in guildIds),
+                                       return_exceptions=True)
+        for guildId, server in zip(guildIds, servers):
+            if isinstance(server, ServerEntity):
+                self.releaseSchedule.set_post_time(guildId, server.postTime)
+
+        # Guilds in one slot usually share a release, each release is sent as its own checkpointed run
+        batches: Dict[datetime.datetime, List[int]] = {}
+        for guildId in guildIds:
+            batches.setdefault(self.releaseSchedule.latest_release(guildId), []).append(guildId)
+
+        for release, batchIds in batches.items():
+            releaseDate = release.date()
+            attempted: Set[int] = set()
+            done = await self.run_release(f'send_daily_question_{release:%H%M}', release, batchIds, attempted)
+            if done and not attempted.issuperset(batchIds):
+                # The slot's run may have been claimed by an instance whose wheel did not hold every guild here, e.g. one
+                # configured elsewhere or after the run finished. Those get a run of their own instead of waiting a day
+                unsentGuilds = await self.load_unsent_guilds(releaseDate, batchIds)
+                for guildKey in sorted(set(unsentGuilds) - {str(guildId) for guildId in attempted}):
+                    done &= await self.run_release(f'send_daily_question_{release:%H%M}_{guildKey}', release,
+                                                   [int(guildKey)], attempted)
+
+            for guildId in batchIds:
+                # Guilds whose sends failed for good wait for their next release, like a single failed send did before
+                when = (self.releaseSchedule.next_release(guildId).timestamp() if done
+                        else time.time() + JobScheduler.RETRY_DELAY)
+                self.releaseWheel.schedule(guildId, when)
+
+    async def run_release(self, name: str, release: datetime.datetime, guildIds: List[int], attempted: Set[int]) -> bool:
+        releaseDate = release.date()
+
+        async def send_chunk(releaseDate: datetime.date, guilds: List[Tuple[str, discord.Guild]]):
+            attempted.update(guild.id for _, guild in guilds)
+            await self.send_daily_question_chunk(releaseDate, guilds)
+
+        job = Job(name, release - datetime.datetime.combine(releaseDate, ReleaseClock.RELEASE_TIME),
+                  functools.partial(self.load_unsent_guilds, guildIds=guildIds), send_chunk,
+                  chunkSize=self.SEND_CHUNK_SIZE)
+        try:
+            return await self.jobScheduler.run_job(job, releaseDate)
+        except Exception as e:
+            self.logger.error('Failed to run [%s] for [%s]: %s', job.name, releaseDate, e, exc_info=True)
+            return False
+
+    async def load_unsent_guilds(self, releaseDate: datetime.date,
+                                 guildIds: Optional[Collection[int]] = None) -> Dict[str, discord.Guild]:
+        guilds = self.bot.guilds if guildIds is None else [self.bot.get_guild(guildId) for guildId in guildIds]
+        # Guilds that already got this release's question are skipped, e.g. when a run is retried after a crash.
+        # Each send persists its marker before returning, so posts made by any instance are seen here
+        await self.load_sent_markers(releaseDate)
+        return {str(guild.id): guild for guild in guilds
+                if guild is not None and self.shardPlan.owns_guild(guild.id)
+                and self.sentReleaseDates.get(guild.id, datetime.date.min) < releaseDate}
+
+    async def send_daily_question_chunk(self, releaseDate: datetime.date, guilds: List[Tuple[str, discord.Guild]]):
+        await self.send_daily_question([guild for _, guild in guilds])
+
+    async def send_daily_question(self, guilds: Optional[List[discord.Guild]] = None) -> FanOutReport:
+        message = await self.get_daily_question_message()
+        question = await self.get_daily_question()
+
+        if guilds is None:
+            # Each shard only posts to its own guilds so no guild gets the question twice
+            guilds = [guild for guild in self.bot.guilds if self.shardPlan.owns_guild(guild.id)]
+        self.prune_daily_messages()
+        channelIds = await asyncio.gather(*(self.load_channel_cache(guild.id) for guild in guilds),
+                                          return_exceptions=True)
+
+        jobs = []
+        for guild, channelId in zip(guilds, channelIds):
+            if isinstance(channelId, Exception):
+                self.logger.error('Failed to load channel for server [%s]: %s', guild.id, channelId)
+            elif (channelId > 0):
+                channel = self.bot.get_channel(int(channelId))
+                if (channel is not None):
+                    jobs.append((guild.id, channel.id, self.make_send_job(guild.id, channel, message, question)))
                 else:
-                    self.logger.info(f'Skip sending daily question since no channel is configured for server [{guild.id}].')
-            except Exception as e:
-                # Log an error message if something goes wrong
-                self.logger.error(f"Failed to send daily question: {e}", exc_info=True)
+                    self.logger.info('Failed to get channel object for server [%s].', guild.id)
+            else:
+                self.logger.info('Skip sending daily question since no channel is configured for server [%s].', guild.id)
 
-    async def get_daily_question_message(self) -> discord.Embed:
-        self.logger.debug("Querying LeetCode for daily question.")
+        report = await self.fanOut.run(jobs)
+        self.logger.info(report.summary())
+        Metrics.FANOUT_SENDS.labels(outcome='success').inc(len(report.results))
+        Metrics.FANOUT_SENDS.labels(outcome='error').inc(len(report.errors))
+        for guildId, error in report.errors.items():
+            self.logger.error('Failed to send daily question to server [%s] after [%s] attempts: %s',
+                              guildId, report.failures.get(guildId, 0), error)
 
-        question = await LeetQuery().daily_question()
+        return report
 
-        link = question['activeDailyCodingChallengeQuestion']['link']
-        fullLink = f'https://leetcode.com{link}'
+    def make_send_job(self, guildId: int, channel: discord.abc.Messageable, message: discord.Embed,
+                      question: QuestionEntity):
+        async def send() -> discord.Message:
+            with LogPipeline.correlate(guildId=guildId):
+                sentMessage = await channel.send(embed=message)
+                self.logger.info('Successfully sent daily question to server [%s].', guildId)
+                # Indexed before the rest of the fan-out finishes, so reactions to it count right away and a resumed
+                # run skips this guild. Never raises, a failed save must not make the fan-out send again
+                await self.record_daily_message(DailyMessageEntity(sentMessage.id, guildId, sentMessage.channel.id,
+                                                                   self.releaseSchedule.latest_release_date(guildId),
+                                                                   question.difficulty, question.titleSlug))
+                return sentMessage
 
-        difficulty = question['activeDailyCodingChallengeQuestion']['question']['difficulty']
-        acRate = question['activeDailyCodingChallengeQuestion']['question']['acRate']
-        problem = question['activeDailyCodingChallengeQuestion']['question']['title']
+        return send
+
+    async def get_daily_question(self) -> Optional[QuestionEntity]:
+        # LeetCode rolls the daily question over at midnight UTC
+        questionDate = datetime.datetime.now(datetime.timezone.utc).date()
+
+        async with self.questionLock:
+            question = await self.questionCache.load_entity(questionDate.isoformat())
+            if question is not None:
+                return question
+
+            self.logger.debug("Querying LeetCode for daily question.")
+            result = await self.leetQuery.daily_question()
+            if result is None:
+                return None
+
+            question = QuestionEntity.from_query(result)
+            await self.questionCache.save_entity(question)
+            return question
+
+    async def get_daily_question_message(self) -> discord.Embed:
+        question = await self.get_daily_question()
+        if question is None:
+            raise RuntimeError("Daily question is unavailable.")
+
+        fullLink = f'https://leetcode.com{question.link}'
+
+        difficulty = question.difficulty
+        acRate = question.acRate
+        problem = question.title
 
         title = "Daily LC"
         date = datetime.datetime.now().strftime("%m-%d-%Y")
@@ -90,11 +316,69 @@ class DailyLC(commands.Cog):
 
         return embedMessage
 
+    async def load_daily_messages(self):
+        since = ReleaseClock.latest_release_date() - datetime.timedelta(days=self.MESSAGE_INDEX_DAYS)
+        try:
+            dailyMessages = await self.dailyMessageCache.load_partition("releaseDate ge @since",
+                                                                        {"since": since.isoformat()})
+            self.dailyMessages = {dailyMessage.messageId: dailyMessage for dailyMessage in dailyMessages.values()
+                                  if self.shardPlan.owns_guild(dailyMessage.guildId)}
+            for dailyMessage in self.dailyMessages.values():
+                self.mark_sent(dailyMessage.guildId, dailyMessage.releaseDate)
+            self.logger.info('Loaded [%s] Daily LC messages into the index.', len(self.dailyMessages))
+        except Exception as e:
+            self.logger.error('Failed to load Daily LC message index: %s', e, exc_info=True)
+
+    async def load_sent_markers(self, releaseDate: datetime.date):
+        # Raises rather than risk posting twice, the run is then retried.
+        # Markers are keyed by release date, so this reads one key range however many messages are stored
+        start, end = SentMarkerEntity.key_range(releaseDate)
+        markers = await self.sentMarkerCache.load_partition("RowKey ge @start and RowKey lt @end",
+                                                            {"start": start, "end": end})
+        ownedMarkers = [marker for marker in markers.values() if self.shardPlan.owns_guild(marker.guildId)]
+
+        # Messages posted by another instance are indexed too, so reactions to them are counted here
+        missingIds = [marker.messageId for marker in ownedMarkers if marker.messageId not in self.dailyMessages]
+        for dailyMessage in await asyncio.gather(*(self.dailyMessageCache.load_entity(messageId)
+                                                   for messageId in missingIds)):
+            if dailyMessage is not None:
+                self.dailyMessages.setdefault(dailyMessage.messageId, dailyMessage)
+
+        for marker in ownedMarkers:
+            self.mark_sent(marker.guildId, marker.releaseDate)
+
+    def prune_daily_messages(self):
+        since = ReleaseClock.latest_release_date() - datetime.timedelta(days=self.MESSAGE_INDEX_DAYS)
+        for messageId in [messageId for messageId, dailyMessage in self.dailyMessages.items()
+                          if dailyMessage.releaseDate < since]:
+            del self.dailyMessages[messageId]
+
+    async def record_daily_message(self, dailyMessage: DailyMessageEntity):
+        self.dailyMessages[dailyMessage.messageId] = dailyMessage
+        self.mark_sent(dailyMessage.guildId, dailyMessage.releaseDate)
+        # The marker is written last, so any instance that sees it can also read the message
+        await self.dailyMessageCache.save_entity(dailyMessage)
+        await self.sentMarkerCache.save_entity(SentMarkerEntity(dailyMessage.releaseDate, dailyMessage.guildId,
+                                                                dailyMessage.messageId))
+        self.logger.debug('Recorded Daily LC message [%s] for server [%s].', dailyMessage.messageId, dailyMessage.guildId)
+
+    def mark_sent(self, guildId: int, releaseDate: datetime.date):
+        if self.sentReleaseDates.get(guildId, datetime.date.min) < releaseDate:
+            self.sentReleaseDates[guildId] = releaseDate
+
+    def get_daily_message(self, messageId: int) -> Optional[DailyMessageEntity]:
+        return self.dailyMessages.get(messageId)
+
+    def get_open_daily_messages(self) -> List[DailyMessageEntity]:
+        # Messages whose release is still open in their guild, the only ones a reaction can complete
+        return [dailyMessage for dailyMessage in self.dailyMessages.values()
+                if dailyMessage.releaseDate >= self.releaseSchedule.latest_release_date(dailyMessage.guildId)]
+
     async def set_channel_id(self, ctx: commands.Context, channelId: int):
         channel = self.bot.get_channel(channelId)
         if channel is not None:
-            self.logger.debug(f'Saving server [{str(ctx.guild.id)}] to use channel id [{channelId}].')
-            self.save_channel_cache(ctx.guild.id, channelId)
+            self.logger.debug('Saving server [%s] to use channel id [%s].', str(ctx.guild.id), channelId)
+            await self.save_channel_cache(ctx.guild.id, channelId)
 
             message = f'Successfully set LC bot to use channel [#{channel.name}].'
             await ctx.send(message)
@@ -104,11 +388,57 @@ class DailyLC(commands.Cog):
             await ctx.send(message)
             self.logger.info(message)
 
-    def save_channel_cache(self, guildId: int, channelId: int):
-        server = ServerEntity(guildId, channelId)
-        self.serverCache.save_entity(server)
+    async def set_post_time(self, ctx: commands.Context, postTime: str):
+        if postTime.lower() == 'default':
+            parsedTime = None
+        else:
+            try:
+                parsedTime = datetime.time.fromisoformat(postTime).replace(second=0, microsecond=0)
+                if parsedTime.tzinfo is not None:
+                    # Times given with an offset, e.g. 11:00+05:00, are converted rather than read as UTC
+                    today = datetime.datetime.now(datetime.timezone.utc).date()
+                    parsedTime = datetime.datetime.combine(today, parsedTime).astimezone(datetime.timezone.utc).timetz()
+                parsedTime = parsedTime.replace(tzinfo=datetime.timezone.utc)
+            except ValueError:
+                await ctx.send(f'Could not parse post time [{postTime}], use HH:MM in UTC, HH:MM+HH:MM with an offset, or default.')
+                return
+
+        self.logger.debug('Saving server [%s] to post at [%s].', str(ctx.guild.id), parsedTime)
+        if not await self.save_post_time(ctx.guild.id, parsedTime):
+            await ctx.send('Failed to save the post time, please try again.')
+            return
+
+        message = f'Successfully set LC bot to post at [{self.releaseSchedule.post_time(ctx.guild.id):%H:%M}] UTC.'
+        await ctx.send(message)
+        self.logger.info(message)
+
+    async def save_channel_cache(self, guildId: int, channelId: int):
+        def set_channel(server: ServerEntity) -> bool:
+            server.channelId = channelId
+            return True
+
+        # Updated in place so the server's post time is kept
+        server = await self.serverCache.mutate_entity(guildId, set_channel, lambda: ServerEntity(guildId))
+        if server is not None and self.shardPlan.owns_guild(guildId):
+            self.releaseSchedule.set_post_time(guildId, server.postTime)
+            self.schedule_release(guildId)
+
+    async def save_post_time(self, guildId: int, postTime: Optional[datetime.time]) -> bool:
+        def set_post_time(server: ServerEntity) -> bool:
+            server.postTime = postTime
+            return True
+
+        server = await self.serverCache.mutate_entity(guildId, set_post_time, lambda: ServerEntity(guildId))
+        if server is None:
+            # Not stored, so the guild keeps posting at its previous time
+            return False
+
+        self.releaseSchedule.set_post_time(guildId, server.postTime)
+        if server.channelId > 0 and self.shardPlan.owns_guild(guildId):
+            self.schedule_release(guildId)
+        return True
 
-    def load_channel_cache(self, guildId: int) -> int:
-        server = self.serverCache.load_entity(guildId)
+    async def load_channel_cache(self, guildId: int) -> int:
+        server = await self.serverCache.load_entity(guildId)
 
         return 0 if server is None else server.channelId
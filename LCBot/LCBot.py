@@ -1,10 +1,15 @@
 import os
+import asyncio
 from dotenv import load_dotenv
 import discord
+from discord import app_commands
 from discord.ext import commands
 import logging.handlers
-from LCBot import DailyLC, StatsLC
-from Entities import UserEntity
+from typing import Optional
+from LCBot import DailyLC, StatsLC, ReconcileReport
+from Entities import UserEntity, DailyMessageEntity
+from Utils import (TableSession, SqliteSession, StorageSession, ShardPlan, JobScheduler, ReleaseSchedule, LeetQuery,
+                   Metrics, LogPipeline)
 
 
 def user_entity_info(userEntity: UserEntity) -> str:
@@ -16,6 +21,7 @@ def user_entity_info(userEntity: UserEntity) -> str:
         f"NumHard: {userEntity.numHard}\n"
         f"Longest Streak: {userEntity.longestStreak}\n"
         f"Current Streak Start: {userEntity.currStreakStartDate}\n"
+        f"Last Completed: {userEntity.lastCompletedDate}\n"
         f"Completed Today? {userEntity.completedToday}\n"
         f"Current Streak: {userEntity.get_current_streak()}"
     )
@@ -25,18 +31,36 @@ class LCBot:
     description: str = 'Sends a daily leet code challenge.'
     intents: discord.Intents = discord.Intents.default()
     environment: str
+    leanMemberCache: bool
     bot: commands.Bot
+    tableSession: StorageSession
+    shardPlan: ShardPlan
+    jobScheduler: Optional[JobScheduler]
+    releaseSchedule: ReleaseSchedule
+    leetQuery: LeetQuery
+    reconcileTask: Optional[asyncio.Task]
+    logListener: logging.handlers.QueueListener
     logger: logging.Logger
 
-    def __init__(self):
-        self.intents.members = True
-        self.intents.message_content = True
-        self.intents.reactions = True
-
+    def __init__(self, bot: Optional[commands.Bot] = None, shardPlan: Optional[ShardPlan] = None):
         load_dotenv()
         self.environment = os.getenv('ENVIRONMENT', 'development')
+        self.leanMemberCache = os.getenv('LEAN_MEMBER_CACHE', 'false').lower() == 'true'
+
+        # Reactions arrive as raw events with the user id, so lean mode can skip the members intent entirely
+        self.intents.members = not self.leanMemberCache
+        self.intents.message_content = True
+        self.intents.reactions = True
+        self.shardPlan = shardPlan if shardPlan is not None else ShardPlan.from_env()
+        self.jobScheduler = None
+        # Shared by both cogs, DailyLC posts on it and StatsLC scores completions against each guild's window
+        self.releaseSchedule = ReleaseSchedule.from_env()
+        # Shared by both cogs, so leetcode.com sees one session and one circuit breaker
+        self.leetQuery = LeetQuery()
+        self.reconcileTask = None
 
-        self.bot = commands.Bot(command_prefix='?', description=self.description, intents=self.intents)
+        # Simulations pass in their own bot so the events and commands run without a gateway
+        self.bot = bot if bot is not None else self.create_bot()
 
         self.setup_logging()
         self.register_events()
@@ -45,6 +69,20 @@ class LCBot:
 
         self.logger.setLevel(logging.DEBUG)
 
+    def create_bot(self) -> commands.Bot:
+        options = {}
+        if self.leanMemberCache:
+            # Skip chunking every guild at startup and only keep the bot's own member objects
+            options['chunk_guilds_at_startup'] = False
+            options['member_cache_flags'] = discord.MemberCacheFlags.none()
+
+        if not self.shardPlan.sharded:
+            return commands.Bot(command_prefix='?', description=self.description, intents=self.intents, **options)
+
+        return commands.AutoShardedBot(command_prefix='?', description=self.description, intents=self.intents,
+                                       shard_count=self.shardPlan.shardCount, shard_ids=self.shardPlan.shardIds,
+                                       **options)
+
     def setup_logging(self):
         if self.environment == 'production':
             logFilePath = '/home/LogFiles/discord.log'
@@ -55,7 +93,6 @@ class LCBot:
             loggingLevel = logging.INFO
             lcLoggingLevel = logging.DEBUG
 
-        logging.basicConfig(filename=logFilePath, level=loggingLevel)
         logger = logging.getLogger('discord')
         logger.setLevel(logging.INFO)
         logging.getLogger('discord.http').setLevel(loggingLevel)
@@ -66,10 +103,8 @@ class LCBot:
             maxBytes=32 * 1024 * 1024,  # 32 MiB
             backupCount=5,  # Rotate through 5 files
         )
-        dt_fmt = '%Y-%m-%d %H:%M:%S'
-        formatter = logging.Formatter('[{asctime}] [{levelname:<8}] {name}: {message}', dt_fmt, style='{')
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
+        # Records are queued from the event loop and formatted as JSON and written by a background thread
+        self.logListener = LogPipeline.start(handler, loggingLevel)
 
         self.logger = logging.getLogger('discord.LCBot')
 
@@ -78,18 +113,33 @@ class LCBot:
         logging.getLogger('discord.StatsLC').setLevel(lcLoggingLevel)
         logging.getLogger('discord.TableCache').setLevel(lcLoggingLevel)
         logging.getLogger('discord.LeetQuery').setLevel(lcLoggingLevel)
+        logging.getLogger('discord.FanOut').setLevel(lcLoggingLevel)
+        logging.getLogger('discord.JobScheduler').setLevel(lcLoggingLevel)
 
     def register_events(self):
         @self.bot.event
         async def on_ready():
-            await self.bot.tree.sync()
-            print(f'Logged in as {self.bot.user} (ID: {self.bot.user.id})')
+            # Application commands are global, so only the process running shard 0 syncs them
+            if 0 in self.shardPlan.shardIds:
+                await self.bot.tree.sync()
+            print(f'Logged in as {self.bot.user} (ID: {self.bot.user.id}) on {self.shardPlan}')
             print('------')
-            CONNECTION_STRING = os.getenv('STORAGE_CONNECTION_STRING')
-            await self.bot.add_cog(DailyLC(self.bot, CONNECTION_STRING))
-            print('Added DailyLC bot')
-            await self.bot.add_cog(StatsLC(self.bot, CONNECTION_STRING))
-            print('Added StatsLC bot')
+            if self.jobScheduler is None:
+                self.jobScheduler = JobScheduler(self.tableSession, self.shardPlan.tag)
+                await self.jobScheduler.start()
+            # on_ready fires again when the gateway starts a new session, the cogs are only added once
+            if self.bot.get_cog('DailyLC') is None:
+                await self.bot.add_cog(DailyLC(self.bot, self.tableSession, self.shardPlan, self.jobScheduler,
+                                               self.releaseSchedule, self.leetQuery))
+                print('Added DailyLC bot')
+            if self.bot.get_cog('StatsLC') is None:
+                await self.bot.add_cog(StatsLC(self.bot, self.tableSession, self.shardPlan, self.jobScheduler,
+                                               self.releaseSchedule, self.leetQuery))
+                print('Added StatsLC bot')
+
+            # Reactions added while the bot was offline, or before a new session, were never dispatched
+            if self.reconcileTask is None or self.reconcileTask.done():
+                self.reconcileTask = asyncio.create_task(self.reconcile_completions())
 
         @self.bot.event
         async def on_disconnect():
@@ -97,18 +147,21 @@ class LCBot:
 
         @self.bot.event
         async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
-            channel = self.bot.get_channel(payload.channel_id)
-            message = await channel.fetch_message(payload.message_id)
-
-            if (message.author == self.bot.user
-                and payload.emoji.name == '✅'
-                and len(message.embeds) == 1
-                and message.embeds[0].title == "Daily LC"):
+            if payload.emoji.name != '✅':
+                return
 
-                self.logger.debug(f'Caught completiong reaction to DailyLC message by user [{payload.user_id}].')
-                statsLC = self.bot.get_cog('StatsLC')
-                statsLC.log_user_completion(message, payload.user_id)
-                self.logger.info(f'Logged DailyLC completion for user [{payload.user_id}].')
+            dailyLC = self.bot.get_cog('DailyLC')
+            dailyMessage = dailyLC.get_daily_message(payload.message_id) if dailyLC is not None else None
+            if dailyMessage is not None:
+                with LogPipeline.correlate(guildId=payload.guild_id, userId=payload.user_id):
+                    self.logger.debug('Caught completiong reaction to DailyLC message by user [%s].', payload.user_id)
+                    # The stats update runs on a reaction worker so the gateway handler returns right away
+                    statsLC = self.bot.get_cog('StatsLC')
+                    if statsLC is None:
+                        # DailyLC is added first, reactions in between are picked up by the startup reconciliation
+                        self.logger.debug('StatsLC is not loaded yet, skipping reaction by user [%s].', payload.user_id)
+                    elif statsLC.enqueue_completion(dailyMessage, payload.user_id):
+                        self.logger.debug('Queued DailyLC completion for user [%s].', payload.user_id)
 
     def register_commands(self):
         @self.bot.command()
@@ -117,12 +170,12 @@ class LCBot:
                 dailyLC = self.bot.get_cog('DailyLC')
 
                 # Testing cache loading
-                channelId = dailyLC.load_channel_cache(ctx.guild.id)
+                channelId = await dailyLC.load_channel_cache(ctx.guild.id)
                 await ctx.send(f'Got channelId [{channelId}] from cache.')
 
                 if (channelId > 0):
                     # Test cache saving
-                    dailyLC.save_channel_cache(ctx.guild.id, channelId)
+                    await dailyLC.save_channel_cache(ctx.guild.id, channelId)
                     await ctx.send(f'Saved server [{ctx.guild.id}] with channelId [{channelId}] to cache.')
                 else:
                     await ctx.send(f'Skipping server [{ctx.guild.id}] channelId cache saving since no channel is currently set.')
@@ -131,18 +184,23 @@ class LCBot:
                 message = await dailyLC.get_daily_question_message()
 
                 messageObject = await ctx.send(embed=message)
+                question = await dailyLC.get_daily_question()
+                dailyMessage = DailyMessageEntity(messageObject.id, ctx.guild.id, ctx.channel.id,
+                                                  dailyLC.releaseSchedule.latest_release_date(ctx.guild.id),
+                                                  question.difficulty, question.titleSlug)
+                await dailyLC.record_daily_message(dailyMessage)
 
                 statsLC = self.bot.get_cog('StatsLC')
                 load_dotenv()
                 testUser = await self.bot.fetch_user(os.getenv('TEST_USER'))
-                testUserEntity = statsLC.load_user_cache(testUser.id)
+                testUserEntity = await statsLC.load_user_cache(testUser.id)
                 await ctx.send(user_entity_info(testUserEntity))
 
-                statsLC.log_user_completion(messageObject, testUser.id)
-                testUserEntity = statsLC.load_user_cache(testUserEntity.id)
+                await statsLC.log_user_completion(dailyMessage, testUser.id)
+                testUserEntity = await statsLC.load_user_cache(testUserEntity.id)
                 await ctx.send(user_entity_info(testUserEntity))
 
-                statsEmbed = statsLC.get_user_stats(testUser)
+                statsEmbed = await statsLC.get_user_stats(testUser)
                 await ctx.send(embed=statsEmbed)
 
         @self.bot.command()
@@ -156,11 +214,35 @@ class LCBot:
             dailyLC = self.bot.get_cog('DailyLC')
             await dailyLC.send_daily_question()
 
+        @self.bot.command()
+        async def cacheStats(ctx: commands.Context):
+            dailyLC = self.bot.get_cog('DailyLC')
+            statsLC = self.bot.get_cog('StatsLC')
+
+            lines = []
+            for tableCache in (dailyLC.serverCache, statsLC.userCache):
+                stats = tableCache.get_stats()
+                table = stats.pop('table')
+                lines.append(f'[{table}] ' + ', '.join(f'{name}: {value}' for name, value in stats.items()))
+            reactionStats = statsLC.reactionQueue.get_stats()
+            lines.append('[ReactionQueue] ' + ', '.join(f'{name}: {value}' for name, value in reactionStats.items()))
+            await ctx.send('\n'.join(lines))
+
+        @self.bot.command()
+        async def reconcile(ctx: commands.Context):
+            report = await self.reconcile_completions()
+            await ctx.send(report.summary() if report is not None else 'Failed to reconcile completions.')
+
         @self.bot.command()
         async def setChannel(ctx: commands.Context, channelId: int):
             dailyLC = self.bot.get_cog('DailyLC')
             await dailyLC.set_channel_id(ctx, channelId)
 
+        @self.bot.command()
+        async def setPostTime(ctx: commands.Context, postTime: str):
+            dailyLC = self.bot.get_cog('DailyLC')
+            await dailyLC.set_post_time(ctx, postTime)
+
     def register_slash_commands(self):
         @self.bot.tree.command(
             name="stats",
@@ -168,9 +250,64 @@ class LCBot:
         )
         async def get_user_stats(interaction: discord.Interaction):
             statsLC = self.bot.get_cog('StatsLC')
-            statsEmbed = statsLC.get_user_stats(interaction.user)
+            statsEmbed = await statsLC.get_user_stats(interaction.user, interaction.guild)
             await interaction.response.send_message(embed=statsEmbed)
 
+        @self.bot.tree.command(
+            name="serverstats",
+            description="Summarize this server's completions and streaks."
+        )
+        async def get_server_stats(interaction: discord.Interaction):
+            if interaction.guild is None:
+                await interaction.response.send_message("Server stats are only available in servers.")
+                return
+
+            statsLC = self.bot.get_cog('StatsLC')
+            await interaction.response.send_message(embed=statsLC.get_server_stats(interaction.guild))
+
+        @self.bot.tree.command(
+            name="link",
+            description="Link your LeetCode account so completions can be verified."
+        )
+        @app_commands.describe(username="Your leetcode.com username.")
+        async def link_leetcode_account(interaction: discord.Interaction, username: str):
+            statsLC = self.bot.get_cog('StatsLC')
+            # The lookup can take longer than the three seconds Discord waits for a response
+            await interaction.response.defer(ephemeral=True)
+            await interaction.followup.send(await statsLC.link_leetcode_account(interaction.user, username))
+
+        @self.bot.tree.command(
+            name="leaderboard",
+            description="List out this server's top grinders."
+        )
+        @app_commands.describe(metric="What to rank users by.")
+        @app_commands.choices(metric=[
+            app_commands.Choice(name="Current Streak", value="current"),
+            app_commands.Choice(name="Longest Streak", value="longest"),
+            app_commands.Choice(name="Weighted Solves", value="solves"),
+        ])
+        async def get_leaderboard(interaction: discord.Interaction, metric: Optional[app_commands.Choice[str]] = None):
+            if interaction.guild is None:
+                await interaction.response.send_message("Leaderboards are only available in servers.")
+                return
+
+            statsLC = self.bot.get_cog('StatsLC')
+            leaderboardEmbed = statsLC.get_leaderboard(interaction.guild, interaction.user,
+                                                       metric.value if metric is not None else 'current')
+            await interaction.response.send_message(embed=leaderboardEmbed)
+
+    async def reconcile_completions(self) -> Optional[ReconcileReport]:
+        dailyLC = self.bot.get_cog('DailyLC')
+        statsLC = self.bot.get_cog('StatsLC')
+        try:
+            with LogPipeline.correlate():
+                report = await statsLC.reconcile_completions(dailyLC.get_open_daily_messages())
+                self.logger.info(report.summary())
+            return report
+        except Exception as e:
+            self.logger.error('Error reconciling completions: %s', e, exc_info=True)
+            return None
+
     def run(self):
         DISCORD_API_KEY = os.getenv('DISCORD_BOT_API_KEY')
 
@@ -179,7 +316,50 @@ class LCBot:
         else:
             try:
                 self.logger.debug("Logging in as grinder bot.")
-                self.bot.run(DISCORD_API_KEY, log_handler=None)
+                asyncio.run(self.start(DISCORD_API_KEY))
                 self.logger.info("Successfully logged in as the grinder bot.")
+            except KeyboardInterrupt:
+                self.logger.info("Grinder bot was interrupted.")
             except Exception as e:
-                self.logger.error(f"Bot crashed due to exception: {e}", exc_info=True)
+                self.logger.error('Bot crashed due to exception: %s', e, exc_info=True)
+            finally:
+                # Drains the queue so the last records reach the file
+                self.logListener.stop()
+
+    def create_storage_session(self, snapshotPath: Optional[str]) -> StorageSession:
+        storageBackend = os.getenv('STORAGE_BACKEND', 'azure').lower()
+        if storageBackend == 'sqlite':
+            return SqliteSession(os.getenv('SQLITE_STORAGE_PATH', './lcbot.db'), snapshotPath=snapshotPath)
+        if storageBackend != 'azure':
+            raise ValueError(f"Unknown storage backend [{storageBackend}].")
+
+        CONNECTION_STRING = os.getenv('STORAGE_CONNECTION_STRING')
+        return TableSession(CONNECTION_STRING, snapshotPath=snapshotPath)
+
+    async def start(self, apiKey: str):
+        snapshotPath = os.getenv('CACHE_SNAPSHOT_PATH')
+        if snapshotPath and self.shardPlan.sharded:
+            # Shard processes cache different guilds and users, so each keeps its own snapshot
+            snapshotPath = f'{snapshotPath}.{self.shardPlan.tag}'
+
+        # The table session outlives the bot so cogs can still flush to storage while unloading
+        async with self.create_storage_session(snapshotPath) as self.tableSession:
+            monitorTask = asyncio.create_task(Metrics.monitor_event_loop(self.bot))
+            try:
+                async with self.bot:
+                    try:
+                        await self.bot.start(apiKey)
+                    finally:
+                        # Stopped before the cogs unload, so it never writes to a closed cache
+                        if self.reconcileTask is not None:
+                            self.reconcileTask.cancel()
+                            await asyncio.gather(self.reconcileTask, return_exceptions=True)
+                            self.reconcileTask = None
+            finally:
+                monitorTask.cancel()
+                # Runs cut short here resume from their checkpoints on the next start
+                if self.jobScheduler is not None:
+                    await self.jobScheduler.close()
+                    self.jobScheduler = None
+                # Closed after the cogs unloaded, they share it
+                await self.leetQuery.close()
@@ -1,116 +1,513 @@
+import asyncio
 import datetime
 import logging
+import os
+import time
+from typing import Optional, Dict, List, Set, Tuple
 import discord
 from discord.ext import commands, tasks
-from Utils import TableCache
-from Entities import UserEntity
+from Utils import (TableCache, StorageSession, Leaderboard, ShardPlan, ReactionQueue, Job, JobScheduler, ReleaseSchedule,
+                   TokenBucket, LeetQuery, StatsSnapshot, Metrics)
+from Entities import UserEntity, DailyMessageEntity, LeaderboardEntity, ReleaseClock
 
 
-def parse_embed_fields(dailyLCFields: dict, fieldName: str) -> str:
-    for field in dailyLCFields:
-        if (field.name.lower() == fieldName.lower()):
-            return field.value
+class ReconcileReport:
+    duration: float
+    messages: int
+    failedMessages: int
+    # Reactions read, and of those the ones applied as completions, rejected by verification or not saved
+    reactions: int
+    completed: int
+    rejected: int
+    failed: int
+
+    def __init__(self):
+        self.duration = 0.0
+        self.messages = 0
+        self.failedMessages = 0
+        self.reactions = 0
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def summary(self) -> str:
+        return (f'Reconciled [{self.reactions}] reactions on [{self.messages}] Daily LC messages '
+                f'([{self.failedMessages}] unreadable) in [{self.duration:.2f}s], '
+                f'applied [{self.completed}] missed completions, [{self.rejected}] unverified and [{self.failed}] not saved.')
 
 
 class StatsLC(commands.Cog):
+    # Number of users listed by /leaderboard
+    LEADERBOARD_SIZE = 10
+    # Discord returns at most 100 reaction users per request
+    REACTION_PAGE_SIZE = 100
+    # Reaction pages requested per second while reconciling, well under the global limit shared with sends
+    RECONCILE_RATE = 20
+    # Messages whose reactions are paged through at once
+    RECONCILE_CONCURRENCY = 4
+    # Users whose missed completions are written at once
+    RECONCILE_WRITE_CONCURRENCY = 16
+    COMPLETION_EMOJI = '✅'
+    # Minutes between exports of the user stats behind /serverstats
+    STATS_SNAPSHOT_MINUTES = 30
+    LEADERBOARD_TITLES = {
+        'current': 'Current Streak',
+        'longest': 'Longest Streak',
+        'solves': 'Weighted Solves'
+    }
+
     bot: commands.Bot
     logger: logging.Logger
     userCache: TableCache
+    leaderboardCache: TableCache
+    leaderboard: Leaderboard
+    reactionQueue: ReactionQueue
+    reconcileBucket: TokenBucket
+    reconcileLock: asyncio.Lock
+    leetQuery: LeetQuery
+    ownsLeetQuery: bool
+    verifyCompletions: bool
+    tableSession: StorageSession
+    shardPlan: ShardPlan
+    jobScheduler: Optional[JobScheduler]
+    releaseSchedule: ReleaseSchedule
+    migrationTask: Optional[asyncio.Task]
+    statsSnapshot: Optional[StatsSnapshot]
+    statsSnapshotPath: Optional[str]
+    # Rows changed while an export is reading the partition, replayed onto the new snapshot
+    statsUpdates: Optional[Dict[int, UserEntity]]
 
-    def __init__(self, bot: commands.Bot, connectionString: str):
+    def __init__(self, bot: commands.Bot, tableSession: StorageSession, shardPlan: Optional[ShardPlan] = None,
+                 jobScheduler: Optional[JobScheduler] = None, releaseSchedule: Optional[ReleaseSchedule] = None,
+                 leetQuery: Optional[LeetQuery] = None):
         self.bot = bot
-        self.daily_stats_update.start()
+        self.leaderboard_snapshot_loop.start()
         self.logger = logging.getLogger('discord.StatsLC')
 
-        self.userCache = TableCache(UserEntity)
-        self.userCache.initialize_table(connectionString)
+        self.tableSession = tableSession
+        self.shardPlan = shardPlan if shardPlan is not None else ShardPlan()
+        self.jobScheduler = jobScheduler
+        self.releaseSchedule = releaseSchedule if releaseSchedule is not None else ReleaseSchedule()
+        # Buffered writes are flushed unconditionally, so completions only keep their ETag check without them
+        writeBehind = os.getenv('USER_CACHE_WRITE_BEHIND', 'false').lower() == 'true'
+        pollInterval = float(os.getenv('CACHE_POLL_INTERVAL', 0))
+        if writeBehind and (pollInterval > 0 or self.shardPlan.sharded):
+            # Polling means other instances write the same rows, and with shards a user's reactions arrive on
+            # whichever shard owns the guild, either way buffered writes would overwrite theirs
+            self.logger.warning('USER_CACHE_WRITE_BEHIND is ignored while CACHE_POLL_INTERVAL is set or the bot is sharded.')
+            writeBehind = False
+        self.userCache = TableCache(UserEntity, writeBehind=writeBehind, pollInterval=pollInterval)
+        self.leaderboardCache = TableCache(LeaderboardEntity)
+        self.leaderboard = Leaderboard()
+        self.reactionQueue = ReactionQueue(self.process_completion,
+                                           workers=int(os.getenv('REACTION_WORKERS', ReactionQueue.WORKERS)),
+                                           queueSize=int(os.getenv('REACTION_QUEUE_SIZE', ReactionQueue.QUEUE_SIZE)))
+        self.reconcileBucket = TokenBucket(self.RECONCILE_RATE, self.RECONCILE_RATE)
+        self.reconcileLock = asyncio.Lock()
+        # Shared with the other cog when injected, so there is one session and one circuit breaker to leetcode.com
+        self.ownsLeetQuery = leetQuery is None
+        self.leetQuery = leetQuery if leetQuery is not None else LeetQuery()
+        # Off by default, completions are then taken on trust from the reaction
+        self.verifyCompletions = os.getenv('VERIFY_COMPLETIONS', 'false').lower() == 'true'
+        self.migrationTask = None
+        self.statsSnapshot = None
+        self.statsSnapshotPath = os.getenv('STATS_SNAPSHOT_PATH')
+        self.statsUpdates = None
+
+    async def cog_load(self):
+        await self.userCache.initialize_table(self.tableSession)
+        await self.leaderboardCache.initialize_table(self.tableSession)
+        await self.load_leaderboards()
+        self.reactionQueue.start()
+        await self.load_stats_snapshot()
+        self.stats_snapshot_loop.start()
+        # Rewrite rows still stored with the legacy completedToday flag without holding up startup
+        self.migrationTask = asyncio.create_task(self.migrate_user_rows())
 
-    def cog_unload(self):
-        self.daily_stats_update.cancel()
+        # Streaks are evaluated lazily on read, so the nightly pass only compacts stored rows
+        if self.jobScheduler is not None and os.getenv('NIGHTLY_STATS_UPDATE', 'false').lower() == 'true':
+            self.jobScheduler.register(Job('daily_stats_update', datetime.timedelta(minutes=-2),
+                                           self.load_streak_rows, self.update_streak_rows,
+                                           chunkSize=TableCache.TRANSACTION_SIZE * 10))
 
-    @tasks.loop(time=datetime.time(hour=10, minute=58, tzinfo=datetime.timezone.utc))
-    async def daily_stats_update(self):
-        self.logger.debug("Preparing to update users' stats.")
+    async def cog_unload(self):
+        if self.jobScheduler is not None:
+            self.jobScheduler.unregister('daily_stats_update')
+        self.leaderboard_snapshot_loop.cancel()
+        self.stats_snapshot_loop.cancel()
+        if self.migrationTask is not None:
+            self.migrationTask.cancel()
+        # Drain queued completions before the user cache flushes
+        await self.reactionQueue.close()
+        await self.save_leaderboards()
+        await self.save_stats_snapshot()
+        await self.userCache.close()
+        await self.leaderboardCache.close()
+        if self.ownsLeetQuery:
+            await self.leetQuery.close()
+
+    async def migrate_user_rows(self):
         try:
-            seenUserIds = set()
-            for user in self.bot.get_all_members():
-                if user.id in seenUserIds:
-                    continue
-                seenUserIds.add(user.id)
-                userEntity = self.load_user_cache(user.id)
-                if not userEntity.completedToday:
-                    userEntity.currStreakStartDate = None
-                else:
-                    if userEntity.get_current_streak() > userEntity.longestStreak:
-                        userEntity.longestStreak = userEntity.get_current_streak()
-                        self.logger.info(f'User [{userEntity.id}] has a new longest streak!')
-                # Reset the daily completion flag for all users
-                userEntity.completedToday = False
-                self.save_user_cache(userEntity)
-            self.logger.info("Successfully updated users' stats")
+            await self.update_user_rows()
         except Exception as e:
-            self.logger.error(f"Error in daily_stats_update: {e}", exc_info=True)
-
-    @daily_stats_update.error
-    async def daily_stats_update_error(self, error):
-        self.logger.error(f"Unhandled error in daily_stats_update: {error}", exc_info=True)
-        if not self.daily_stats_update.is_running():
-            self.logger.info("Restarting daily_stats_update.")
-            self.daily_stats_update.restart()
-
-    def log_user_completion(self, message: discord.Message, userId: int):
-        self.logger.debug(f'Logging stats for user [{userId}].')
-        userEntity = self.load_user_cache(userId)
-        if (userEntity.completedToday):
-            # User already completed today's question
+            self.logger.error('Error migrating user rows: %s', e, exc_info=True)
+
+    async def update_user_rows(self):
+        startTime = time.perf_counter()
+        userEntities = await self.userCache.load_partition()
+
+        releaseDate = ReleaseClock.latest_release_date()
+        openReleaseDate = ReleaseClock.oldest_open_release_date()
+
+        def migrate(userEntity: UserEntity) -> bool:
+            return self.update_user_streak(userEntity, openReleaseDate)
+
+        # Rows of users owned by other shards are still read to index this shard's guild members
+        changedEntities = [userEntity for userEntity in userEntities.values()
+                           if self.shardPlan.owns_user(userEntity.id) and migrate(userEntity)]
+
+        # Reactions keep being applied while the migration runs, rows they changed since the scan are migrated again
+        savedCount = await self.userCache.update_entities(changedEntities, migrate)
+        self.index_guild_members(userEntities, releaseDate)
+        duration = time.perf_counter() - startTime
+        self.logger.info('Updated user rows. Read [%s], changed [%s], saved [%s], skipped [%s] rows in [%.2fs].',
+                         len(userEntities), len(changedEntities), savedCount, len(userEntities) - len(changedEntities), duration)
+
+    async def load_streak_rows(self, releaseDate: datetime.date) -> Dict[str, UserEntity]:
+        # The leaderboard is kept current by reactions, so the nightly pass only reads the streak columns
+        userEntities = await self.userCache.load_partition(select=UserEntity.STREAK_FIELDS)
+        return {rowKey: userEntity for rowKey, userEntity in userEntities.items() if self.shardPlan.owns_user(userEntity.id)}
+
+    async def update_streak_rows(self, releaseDate: datetime.date, userEntities: List[Tuple[str, UserEntity]]):
+        # Only streaks broken in every guild's window are cleared, wherever the user reacts from
+        openReleaseDate = ReleaseClock.oldest_open_release_date()
+
+        def clear_streak(userEntity: UserEntity) -> bool:
+            return self.update_user_streak(userEntity, openReleaseDate)
+
+        changedEntities = [userEntity for _, userEntity in userEntities if clear_streak(userEntity)]
+        # Runs around release time, rows completed since the chunk was read are re-read instead of overwritten
+        savedCount = await self.userCache.update_entities(changedEntities, clear_streak)
+        self.logger.info('Updated streaks. Read [%s], changed [%s], saved [%s] rows.',
+                         len(userEntities), len(changedEntities), savedCount)
+
+    def update_user_streak(self, userEntity: UserEntity, releaseDate: datetime.date) -> bool:
+        migrated = userEntity.needsMigration
+        userEntity.needsMigration = False
+
+        cleared = userEntity.clear_broken_streak(releaseDate)
+        return migrated or cleared
+
+    def index_guild_members(self, userEntities: Dict[str, UserEntity], releaseDate: datetime.date):
+        if not self.bot.intents.members:
+            # Without the member cache, guild membership is only known from snapshots and past reactions
+            for userId in list(self.leaderboard.userGuilds):
+                userEntity = userEntities.get(str(userId))
+                if userEntity is not None:
+                    self.leaderboard.update_user(userEntity, [], releaseDate)
             return
-        dailyLCQuestion = message.embeds[0]
 
-        self.increment_queston_difficulty(userEntity, dailyLCQuestion)
-        self.check_streak(userEntity, message)
-        self.save_user_cache(userEntity)
+        for member in self.bot.get_all_members():
+            userEntity = userEntities.get(str(member.id))
+            if userEntity is not None:
+                self.leaderboard.update_user(userEntity, [member.guild.id], releaseDate)
 
-    def increment_queston_difficulty(self, userEntity: UserEntity, dailyLCQuestion: discord.Embed):
-        difficulty = parse_embed_fields(dailyLCQuestion.fields, 'difficulty')
-        if (difficulty.lower() == 'easy'):
-            userEntity.numEasy += 1
-        elif (difficulty.lower() == 'medium'):
-            userEntity.numMedium += 1
+    @tasks.loop(minutes=10)
+    async def leaderboard_snapshot_loop(self):
+        try:
+            await self.save_leaderboards()
+        except Exception as e:
+            self.logger.error('Error in leaderboard_snapshot_loop: %s', e, exc_info=True)
+
+    @tasks.loop(minutes=STATS_SNAPSHOT_MINUTES)
+    async def stats_snapshot_loop(self):
+        # A snapshot restored at startup is reused until it is due
+        if (self.statsSnapshot is not None
+                and time.time() - self.statsSnapshot.createdAt < self.STATS_SNAPSHOT_MINUTES * 60):
+            return
+        try:
+            with Metrics.track(Metrics.JOB_SECONDS, job='stats_snapshot'):
+                await self.export_stats_snapshot()
+        except Exception as e:
+            self.logger.error('Error in stats_snapshot_loop: %s', e, exc_info=True)
+
+    async def load_stats_snapshot(self):
+        if self.statsSnapshotPath is None:
+            return
+        try:
+            self.statsSnapshot = await StatsSnapshot.load(self.statsSnapshotPath)
+            if self.statsSnapshot is not None:
+                self.logger.info('Loaded stats snapshot of [%s] users.', len(self.statsSnapshot))
+        except Exception as e:
+            self.logger.error('Failed to load stats snapshot: %s', e, exc_info=True)
+
+    async def export_stats_snapshot(self):
+        startTime = time.perf_counter()
+        self.statsUpdates = {}
+        try:
+            # Projected rows are not cached, so the export does not churn the user cache
+            userEntities = await self.userCache.load_partition(select=StatsSnapshot.FIELDS)
+            statsSnapshot = StatsSnapshot.from_entities(userEntities.values())
+            for userEntity in self.statsUpdates.values():
+                statsSnapshot.update_user(userEntity)
+        finally:
+            self.statsUpdates = None
+
+        self.statsSnapshot = statsSnapshot
+        if self.statsSnapshotPath is not None:
+            await statsSnapshot.save(self.statsSnapshotPath)
+        self.logger.info('Exported stats snapshot of [%s] users ([%s] bytes) in [%.2fs].',
+                         len(statsSnapshot), statsSnapshot.nbytes, time.perf_counter() - startTime)
+
+    async def save_stats_snapshot(self):
+        # Keeps the completions applied since the last export across a restart
+        if self.statsSnapshot is None or self.statsSnapshotPath is None:
+            return
+        try:
+            await self.statsSnapshot.save(self.statsSnapshotPath)
+        except Exception as e:
+            self.logger.error('Failed to save stats snapshot: %s', e, exc_info=True)
+
+    def update_stats_snapshot(self, userEntity: UserEntity):
+        if self.statsUpdates is not None:
+            self.statsUpdates[int(userEntity.RowKey)] = userEntity
+        if self.statsSnapshot is not None:
+            self.statsSnapshot.update_user(userEntity)
+
+    async def load_leaderboards(self):
+        try:
+            releaseDate = ReleaseClock.latest_release_date()
+            snapshots = await self.leaderboardCache.load_partition()
+            ownedSnapshots = [snapshot for snapshot in snapshots.values() if self.shardPlan.owns_guild(snapshot.guildId)]
+            for snapshot in ownedSnapshots:
+                self.leaderboard.load_snapshot(snapshot.guildId, snapshot.snapshot, releaseDate)
+            self.logger.info('Loaded [%s] leaderboard snapshots.', len(ownedSnapshots))
+        except Exception as e:
+            self.logger.error('Failed to load leaderboard snapshots: %s', e, exc_info=True)
+
+    async def save_leaderboards(self):
+        dirtyGuilds = list(self.leaderboard.dirtyGuilds)
+        if not dirtyGuilds:
+            return
+
+        # Cleared up front so guilds changed during the write are saved next time
+        self.leaderboard.dirtyGuilds.clear()
+        snapshots = [LeaderboardEntity(guildId, self.leaderboard.to_snapshot(guildId)) for guildId in dirtyGuilds]
+        failed = await self.leaderboardCache.write_batches(snapshots)
+        # Snapshots that failed to save are retried on the next pass, oversized ones only once the guild changes
+        self.leaderboard.dirtyGuilds.update(snapshot.guildId for snapshot in failed if snapshot.is_storable())
+        self.logger.info('Saved [%s] of [%s] leaderboard snapshots.', len(snapshots) - len(failed), len(snapshots))
+
+    def enqueue_completion(self, dailyMessage: DailyMessageEntity, userId: int) -> bool:
+        return self.reactionQueue.submit(userId, dailyMessage.messageId, dailyMessage)
+
+    async def process_completion(self, userId: int, dailyMessage: DailyMessageEntity) -> bool:
+        if self.verifyCompletions and await self.verify_completion(userId, dailyMessage) is False:
+            # Not remembered by the queue, so reacting again once the submission is accepted counts
+            return False
+        # Updates the user's row, then their leaderboard entries and the stats snapshot once the row is saved
+        await self.log_user_completion(dailyMessage, userId)
+        return True
+
+    async def verify_completion(self, userId: int, dailyMessage: DailyMessageEntity) -> Optional[bool]:
+        userEntity = await self.load_user_cache(userId)
+        if not userEntity.leetcodeUsername or not dailyMessage.titleSlug:
+            # Unlinked users and messages sent before verification existed are taken on trust
+            Metrics.COMPLETION_VERIFICATIONS.labels(outcome='unlinked').inc()
+            return None
+
+        # Concurrent reactions share batched requests, so a burst costs a handful of calls to leetcode.com
+        verified = await self.leetQuery.verify_completion(userEntity.leetcodeUsername, dailyMessage.titleSlug,
+                                                          self.get_question_release(dailyMessage))
+        self.record_verification(userId, userEntity.leetcodeUsername, verified)
+        return verified
+
+    def record_verification(self, userId: int, username: str, verified: Optional[bool]):
+        if verified is None:
+            # leetcode.com is down or the account is gone, the reaction is trusted rather than lost
+            Metrics.COMPLETION_VERIFICATIONS.labels(outcome='unknown').inc()
+        elif verified:
+            Metrics.COMPLETION_VERIFICATIONS.labels(outcome='verified').inc()
         else:
-            userEntity.numHard += 1
+            Metrics.COMPLETION_VERIFICATIONS.labels(outcome='rejected').inc()
+            self.leetQuery.forget(username)
+            self.logger.info('User [%s] reacted without an accepted submission from [%s].', userId, username)
+
+    def get_question_release(self, dailyMessage: DailyMessageEntity) -> datetime.datetime:
+        # leetcode.com switches its daily question at midnight UTC, whenever the guild posts it
+        return datetime.datetime.combine(dailyMessage.releaseDate, datetime.time(tzinfo=datetime.timezone.utc))
+
+    async def log_user_completion(self, dailyMessage: DailyMessageEntity, userId: int):
+        self.logger.debug('Logging stats for user [%s].', userId)
+        # A message only newer than the guild's window exists right after the guild moved its post time
+        releaseDate = self.get_completion_release_date(dailyMessage)
+
+        def complete(userEntity: UserEntity) -> bool:
+            # Re-applied to a fresh copy of the row if another instance updated it first
+            return self.apply_completion(userEntity, dailyMessage, releaseDate)
+
+        userEntity = await self.userCache.mutate_entity(userId, complete, lambda: UserEntity(userId))
+        if userEntity is None:
+            return
+
+        self.logger.info('Saved user [%s] to userCache.', userId)
+        self.leaderboard.update_user(userEntity, [dailyMessage.guildId], releaseDate)
+        self.update_stats_snapshot(userEntity)
+
+    def get_completion_release_date(self, dailyMessage: DailyMessageEntity) -> datetime.date:
+        # A message only newer than the guild's window exists right after the guild moved its post time
+        return max(dailyMessage.releaseDate, self.releaseSchedule.latest_release_date(dailyMessage.guildId))
+
+    def apply_completion(self, userEntity: UserEntity, dailyMessage: DailyMessageEntity,
+                         releaseDate: datetime.date) -> bool:
+        if (userEntity.has_completed(releaseDate)):
+            # User already completed the guild's current question
+            return False
+
+        self.increment_queston_difficulty(userEntity, dailyMessage.difficulty)
+        self.check_streak(userEntity, dailyMessage, releaseDate)
+        return True
+
+    async def reconcile_completions(self, dailyMessages: List[DailyMessageEntity]) -> ReconcileReport:
+        # Reactions added while the bot was offline never reach on_raw_reaction_add, so they are read back in bulk
+        async with self.reconcileLock:
+            with Metrics.track(Metrics.JOB_SECONDS, job='reconcile_completions'):
+                return await self.apply_missed_completions(dailyMessages)
+
+    async def apply_missed_completions(self, dailyMessages: List[DailyMessageEntity]) -> ReconcileReport:
+        report = ReconcileReport()
+        startTime = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.RECONCILE_CONCURRENCY)
+
+        async def fetch(dailyMessage: DailyMessageEntity) -> Set[int]:
+            async with semaphore:
+                try:
+                    return await self.fetch_reaction_users(dailyMessage)
+                except Exception as e:
+                    # Deleted messages or channels the bot lost access to are skipped
+                    report.failedMessages += 1
+                    self.logger.error('Failed to read reactions on message [%s] in server [%s]: %s',
+                                      dailyMessage.messageId, dailyMessage.guildId, e)
+                    return set()
+
+        reactionUsers = await asyncio.gather(*(fetch(dailyMessage) for dailyMessage in dailyMessages))
+        report.messages = len(dailyMessages)
+
+        # Like live reactions, every reactor is reconciled by the shard that owns the guild they reacted in.
+        # Only that shard indexes the guild's messages, and the updates are ETag-checked against other shards
+        userMessages: Dict[int, List[DailyMessageEntity]] = {}
+        for dailyMessage, userIds in zip(dailyMessages, reactionUsers):
+            report.reactions += len(userIds)
+            for userId in userIds:
+                userMessages.setdefault(userId, []).append(dailyMessage)
+
+        if userMessages:
+            # One scan fills the local cache, so the updates below only read rows that changed since
+            userEntities = await self.userCache.load_partition()
+            if self.verifyCompletions:
+                report.rejected = await self.drop_unverified_completions(userEntities, userMessages)
+
+            writeSemaphore = asyncio.Semaphore(self.RECONCILE_WRITE_CONCURRENCY)
+
+            async def reconcile_user(userId: int, messages: List[DailyMessageEntity]):
+                async with writeSemaphore:
+                    await self.apply_user_completions(userId, messages, report)
+
+            await asyncio.gather(*(reconcile_user(userId, messages) for userId, messages in userMessages.items()))
+
+        report.duration = time.perf_counter() - startTime
+        return report
+
+    async def apply_user_completions(self, userId: int, messages: List[DailyMessageEntity], report: ReconcileReport):
+        # Same order the live reactions would most likely have arrived in
+        messages.sort(key=lambda dailyMessage: dailyMessage.releaseDate)
+        completed: List[DailyMessageEntity] = []
+
+        def complete(userEntity: UserEntity) -> bool:
+            # Re-applied to a fresh copy of the row if a live reaction or another instance updated it first
+            completed[:] = [dailyMessage for dailyMessage in messages
+                            if self.apply_completion(userEntity, dailyMessage,
+                                                     self.get_completion_release_date(dailyMessage))]
+            return bool(completed)
+
+        userEntity = await self.userCache.mutate_entity(userId, complete, lambda: UserEntity(userId))
+        if userEntity is None:
+            # Nothing left to apply, or the row could not be saved
+            report.failed += len(completed)
+            return
 
-    def check_streak(self, userEntity: UserEntity, dailyLCMessage: discord.Message):
-        now = datetime.datetime.now(datetime.timezone.utc)
+        report.completed += len(completed)
+        self.leaderboard.update_user(userEntity, [dailyMessage.guildId for dailyMessage in completed],
+                                     self.get_completion_release_date(completed[-1]))
+        self.update_stats_snapshot(userEntity)
 
-        nextRelease = datetime.datetime.combine(now.date(), datetime.time(hour=11, minute=00, tzinfo=datetime.timezone.utc))
+    async def drop_unverified_completions(self, userEntities: Dict[str, UserEntity],
+                                          userMessages: Dict[int, List[DailyMessageEntity]]) -> int:
+        usernames = {userId: userEntities[str(userId)].leetcodeUsername for userId in userMessages
+                     if str(userId) in userEntities and userEntities[str(userId)].leetcodeUsername}
+        # Every linked user's submissions are read in batched requests, one list covers all of their messages
+        submissions = await self.leetQuery.recent_accepted_submissions(usernames.values())
 
-        if now > nextRelease:
-            # Before 11 AM UTC, use yesterday as latest release
-            nextRelease = nextRelease + datetime.timedelta(days=1)
+        rejected = 0
+        for userId, username in usernames.items():
+            verifiedMessages = []
+            userSubmissions = submissions.get(username)
+            for dailyMessage in userMessages[userId]:
+                verified = None
+                if userSubmissions is not None and dailyMessage.titleSlug:
+                    verified = LeetQuery.has_accepted(userSubmissions, dailyMessage.titleSlug,
+                                                      self.get_question_release(dailyMessage))
+                    self.record_verification(userId, username, verified)
+                if verified is False:
+                    rejected += 1
+                else:
+                    verifiedMessages.append(dailyMessage)
+            userMessages[userId] = verifiedMessages
+        return rejected
 
-        latestRelease = nextRelease - datetime.timedelta(days=1)
+    async def fetch_reaction_users(self, dailyMessage: DailyMessageEntity) -> Set[int]:
+        userIds: Set[int] = set()
+        after = None
+        while True:
+            # The HTTP client waits out 429s, the bucket keeps reconciliation from causing them
+            await self.reconcileBucket.acquire()
+            users = await self.bot.http.get_reaction_users(dailyMessage.channelId, dailyMessage.messageId,
+                                                           self.COMPLETION_EMOJI, self.REACTION_PAGE_SIZE, after=after)
+            userIds.update(int(user['id']) for user in users if not user.get('bot'))
+            if len(users) < self.REACTION_PAGE_SIZE:
+                return userIds
+            after = users[-1]['id']
 
-        completedDailyLCDate = dailyLCMessage.created_at
+    def increment_queston_difficulty(self, userEntity: UserEntity, difficulty: str):
+        if (difficulty.lower() == 'easy'):
+            userEntity.numEasy += 1
+        elif (difficulty.lower() == 'medium'):
+            userEntity.numMedium += 1
+        else:
+            userEntity.numHard += 1
 
-        if latestRelease <= completedDailyLCDate and completedDailyLCDate < nextRelease:
-            self.logger.info(f'User [{userEntity.id}] completed the Daily LC!')
-            userEntity.completedToday = True
-            if (userEntity.currStreakStartDate is None):
-                self.logger.info(f'Starting streak for user [{userEntity.id}].')
-                userEntity.currStreakStartDate = latestRelease.date()
+    def check_streak(self, userEntity: UserEntity, dailyMessage: DailyMessageEntity, releaseDate: datetime.date):
+        # Only the guild's current question counts, it stays open until the guild's next post
+        if dailyMessage.releaseDate == releaseDate:
+            self.logger.info('User [%s] completed the Daily LC!', userEntity.id)
+            if not userEntity.is_streak_alive(releaseDate):
+                self.logger.info('Starting streak for user [%s].', userEntity.id)
 
-            if (userEntity.get_current_streak() > userEntity.longestStreak):
+            if userEntity.complete(releaseDate):
                 # Check if today's completion results in a new longest streak
-                userEntity.longestStreak = userEntity.get_current_streak()
-                self.logger.info(f'User [{userEntity.id}] has a new longest streak!')
+                self.logger.info('User [%s] has a new longest streak!', userEntity.id)
 
-    def get_user_stats(self, user: discord.User) -> discord.Embed:
-        self.logger.debug(f'Getting user [{user.id}] stats.')
-        userEntity = self.load_user_cache(user.id)
-        self.logger.info(f'Successfully generated user [{user.id}] stats.')
-        return self.format_user_stats_embed(user.name, userEntity)
+    async def get_user_stats(self, user: discord.User, guild: Optional[discord.Guild] = None) -> discord.Embed:
+        self.logger.debug('Getting user [%s] stats.', user.id)
+        userEntity = await self.load_user_cache(user.id)
+        # Streaks are shown for the release window of the server asking
+        releaseDate = (self.releaseSchedule.latest_release_date(guild.id) if guild is not None
+                       else ReleaseClock.latest_release_date())
+        self.logger.info('Successfully generated user [%s] stats.', user.id)
+        return self.format_user_stats_embed(user.name, userEntity, releaseDate)
 
-    def format_user_stats_embed(self, userName: str, userEntity: UserEntity) -> discord.Embed:
+    def format_user_stats_embed(self, userName: str, userEntity: UserEntity,
+                                releaseDate: Optional[datetime.date] = None) -> discord.Embed:
         title = f'{userName}\'s Daily LC stats'
         date = datetime.datetime.now().strftime("%m-%d-%Y")
         description = f'Here are your stats as of {date}.'
@@ -121,21 +518,92 @@ class StatsLC(commands.Cog):
         embedMessage.add_field(name="Easy Solved", value=f'{userEntity.numEasy}')
         embedMessage.add_field(name="Medium Solved", value=f'{userEntity.numMedium}')
         embedMessage.add_field(name="Hard Solved", value=f'{userEntity.numHard}')
-        embedMessage.add_field(name="Current Streak", value=f'{userEntity.get_current_streak()}')
+        if releaseDate is None:
+            releaseDate = ReleaseClock.latest_release_date()
+        embedMessage.add_field(name="Current Streak", value=f'{userEntity.get_current_streak(releaseDate)}')
         embedMessage.add_field(name="Longest Streak", value=f'{userEntity.longestStreak}')
-        embedMessage.add_field(name="Completed Today's", value=f'{userEntity.completedToday}')
+        embedMessage.add_field(name="Completed Today's", value=f'{userEntity.has_completed(releaseDate)}')
+
+        return embedMessage
+
+    def get_server_stats(self, guild: discord.Guild) -> discord.Embed:
+        self.logger.debug('Getting stats for server [%s].', guild.id)
+        title = f'{guild.name} Daily LC stats'
+        if self.statsSnapshot is None:
+            return discord.Embed(title=title, description='Server stats are still being gathered, try again in a few minutes.',
+                                 color=discord.Color.blue())
+
+        releaseDate = self.releaseSchedule.latest_release_date(guild.id)
+        stats = self.statsSnapshot.server_stats(self.leaderboard.guild_members(guild.id), releaseDate,
+                                                guild.member_count or 0)
+        embedMessage = discord.Embed(title=title,
+                                     description=f'Stats of the [{stats.trackedUsers}] grinders in this server.',
+                                     color=discord.Color.blue())
+        if not stats.trackedUsers:
+            embedMessage.description = 'No completions yet.'
+            return embedMessage
 
+        embedMessage.add_field(name="Completed Today's",
+                               value=f'{stats.completedToday} ({stats.participationRate:.1%} of members)')
+        embedMessage.add_field(name="Active This Week", value=f'{stats.activeThisWeek}')
+        embedMessage.add_field(name="Longest Streak", value=f'{stats.longestStreak}')
+        solves = max(stats.solves, 1)
+        embedMessage.add_field(name="Solved by Difficulty",
+                               value=(f'Easy {stats.easy} ({stats.easy / solves:.0%})\n'
+                                      f'Medium {stats.medium} ({stats.medium / solves:.0%})\n'
+                                      f'Hard {stats.hard} ({stats.hard / solves:.0%})'))
+        embedMessage.add_field(name="Solves (p50 / p90 / p99)",
+                               value=' / '.join(f'{value:g}' for value in stats.solvePercentiles.values()))
+        embedMessage.add_field(name="Current Streak (p50 / p90 / p99)",
+                               value=' / '.join(f'{value:g}' for value in stats.streakPercentiles.values()))
+        embedMessage.add_field(name="Current Streaks",
+                               value='\n'.join(f'{label}: {count}' for label, count in stats.streakHistogram),
+                               inline=False)
+        createdAt = datetime.datetime.fromtimestamp(self.statsSnapshot.createdAt, datetime.timezone.utc)
+        embedMessage.set_footer(text=f'Totals exported {createdAt:%H:%M} UTC, updated with completions since.')
         return embedMessage
 
-    def save_user_cache(self, user: discord.User):
-        self.logger.debug(f'Saving user [{user.id}] to userCache.')
-        self.userCache.save_entity(user)
-        self.logger.info(f'Saved user [{user.id}] to userCache.')
+    async def link_leetcode_account(self, user: discord.User, username: str) -> str:
+        username = username.strip()
+        # An unknown account fails its alias rather than returning an empty list
+        if await self.leetQuery.recent_accepted(username) is None:
+            return f'Could not find LeetCode user [{username}].'
+
+        def link(userEntity: UserEntity) -> bool:
+            userEntity.leetcodeUsername = username
+            return True
+
+        userEntity = await self.userCache.mutate_entity(user.id, link, lambda: UserEntity(user.id))
+        if userEntity is None:
+            return 'Failed to link your LeetCode account, please try again.'
+
+        self.logger.info('Linked user [%s] to LeetCode user [%s].', user.id, username)
+        return f'Linked your account to LeetCode user [{username}].'
+
+    def get_leaderboard(self, guild: discord.Guild, user: discord.User, metric: str) -> discord.Embed:
+        self.logger.debug('Getting [%s] leaderboard for server [%s].', metric, guild.id)
+        self.leaderboard.refresh_current_streaks(guild.id, self.releaseSchedule.latest_release_date(guild.id))
+
+        title = f'{guild.name} Daily LC leaderboard'
+        description = f'Top grinders by {self.LEADERBOARD_TITLES[metric].lower()}.'
+        embedMessage = discord.Embed(title=title,
+                                     description=description,
+                                     color=discord.Color.blue())
+
+        topUsers = self.leaderboard.top(guild.id, metric, self.LEADERBOARD_SIZE)
+        lines = [f'{self.leaderboard.rank(guild.id, metric, userId)}. <@{userId}> - {score}' for userId, score in topUsers]
+        embedMessage.add_field(name=self.LEADERBOARD_TITLES[metric], value='\n'.join(lines) or 'No completions yet.', inline=False)
+
+        rank = self.leaderboard.rank(guild.id, metric, user.id)
+        if rank is not None:
+            embedMessage.set_footer(text=f'Your rank: {rank} ({self.leaderboard.get_score(guild.id, metric, user.id)})')
+
+        return embedMessage
 
-    def load_user_cache(self, userId: int) -> UserEntity:
-        user = self.userCache.load_entity(userId)
+    async def load_user_cache(self, userId: int) -> UserEntity:
+        user = await self.userCache.load_entity(userId)
         if (user is None):
-            self.logger.info(f'Creating user entity for user [{userId}].')
+            self.logger.info('Creating user entity for user [%s].', userId)
             user = UserEntity(userId)
 
         return user
@@ -1,3 +1,3 @@
 from .DailyLC import DailyLC
-from .StatsLC import StatsLC
+from .StatsLC import StatsLC, ReconcileReport
 from .LCBot import LCBot
@@ -0,0 +1,175 @@
+import asyncio
+import itertools
+from typing import Any, Dict, Iterator, List, Optional
+import discord
+from discord.ext import commands
+
+# Snowflake-sized ids so anything hashing or sharding on them behaves like production
+FIRST_ID = 1 << 40
+
+
+class FakeUser:
+    id: int
+    name: str
+    bot: bool
+
+    def __init__(self, userId: int, name: str, bot: bool = False):
+        self.id = userId
+        self.name = name
+        self.bot = bot
+
+
+class FakeMessage:
+    id: int
+    channel: 'FakeChannel'
+    embeds: List[discord.Embed]
+    reactions: Dict[str, List[int]]
+
+    def __init__(self, messageId: int, channel: 'FakeChannel', embed: Optional[discord.Embed]):
+        self.id = messageId
+        self.channel = channel
+        self.embeds = [embed] if embed is not None else []
+        # User ids per emoji, in reaction order
+        self.reactions = {}
+
+    def add_reaction(self, emoji: str, userId: int):
+        users = self.reactions.setdefault(emoji, [])
+        if userId not in users:
+            users.append(userId)
+
+
+class FakeChannel:
+    id: int
+    name: str
+    guild: 'FakeGuild'
+    client: 'SimulatedBot'
+    messages: List[FakeMessage]
+
+    def __init__(self, channelId: int, guild: 'FakeGuild', client: 'SimulatedBot'):
+        self.id = channelId
+        self.name = f'daily-lc-{channelId}'
+        self.guild = guild
+        self.client = client
+        self.messages = []
+
+    async def send(self, content: Optional[str] = None, *, embed: Optional[discord.Embed] = None) -> FakeMessage:
+        self.client.sendCount += 1
+        if self.client.sendLatency > 0:
+            await asyncio.sleep(self.client.sendLatency)
+
+        message = FakeMessage(self.client.next_id(), self, embed)
+        self.messages.append(message)
+        self.client.fakeMessages[message.id] = message
+        return message
+
+
+class FakeMember(FakeUser):
+    guild: 'FakeGuild'
+
+    def __init__(self, userId: int, guild: 'FakeGuild'):
+        super().__init__(userId, f'grinder-{userId}')
+        self.guild = guild
+
+
+class FakeGuild:
+    id: int
+    name: str
+    channel: FakeChannel
+    members: List[FakeMember]
+
+    def __init__(self, guildId: int, client: 'SimulatedBot'):
+        self.id = guildId
+        self.name = f'guild-{guildId}'
+        self.channel = FakeChannel(client.next_id(), self, client)
+        self.members = []
+
+    def get_member(self, userId: int) -> Optional[FakeMember]:
+        return next((member for member in self.members if member.id == userId), None)
+
+
+class SimulatedBot(commands.Bot):
+    sendLatency: float
+    sendCount: int
+    fakeGuilds: List[FakeGuild]
+    fakeChannels: Dict[int, FakeChannel]
+    fakeMessages: Dict[int, FakeMessage]
+    reactionPageCount: int
+    fakeUser: FakeUser
+    idCounter: Iterator[int]
+
+    def __init__(self, sendLatency: float = 0.0, memberCache: bool = True):
+        intents = discord.Intents.default()
+        intents.members = memberCache
+        super().__init__(command_prefix='?', intents=intents)
+        self.sendLatency = sendLatency
+        self.sendCount = 0
+        self.fakeGuilds = []
+        self.fakeChannels = {}
+        self.fakeMessages = {}
+        self.reactionPageCount = 0
+        self.idCounter = itertools.count(FIRST_ID)
+        self.fakeUser = FakeUser(self.next_id(), 'grinder-bot', bot=True)
+        # Reaction users are read straight from the HTTP client, so that one route is answered locally
+        self.http.get_reaction_users = self.get_reaction_users
+
+    async def attach_loop(self):
+        # Binds the client to the running loop the same way login() does, without touching the network
+        await self._async_setup_hook()
+
+    def next_id(self) -> int:
+        return next(self.idCounter)
+
+    def add_guild(self, memberCount: int) -> FakeGuild:
+        guild = FakeGuild(self.next_id(), self)
+        guild.members = [FakeMember(self.next_id(), guild) for _ in range(memberCount)]
+
+        self.fakeGuilds.append(guild)
+        self.fakeChannels[guild.channel.id] = guild.channel
+        return guild
+
+    @property
+    def guilds(self) -> List[FakeGuild]:
+        return self.fakeGuilds
+
+    @property
+    def user(self) -> FakeUser:
+        return self.fakeUser
+
+    @property
+    def latency(self) -> float:
+        return 0.0
+
+    def get_channel(self, channelId: int) -> Optional[FakeChannel]:
+        return self.fakeChannels.get(channelId)
+
+    def get_guild(self, guildId: int) -> Optional[FakeGuild]:
+        return next((guild for guild in self.fakeGuilds if guild.id == guildId), None)
+
+    def get_all_members(self) -> Iterator[FakeMember]:
+        # Without the members intent the real client has no members to hand out either
+        if not self.intents.members:
+            return
+        for guild in self.fakeGuilds:
+            yield from guild.members
+
+    def record_reaction(self, messageId: int, userId: int, emoji: str = '✅'):
+        # A reaction added while the bot was not connected, so no event is dispatched
+        self.fakeMessages[messageId].add_reaction(emoji, userId)
+
+    async def get_reaction_users(self, channelId: int, messageId: int, emoji: str, limit: int,
+                                 after: Optional[int] = None) -> List[Dict[str, Any]]:
+        self.reactionPageCount += 1
+        userIds = sorted(self.fakeMessages[messageId].reactions.get(emoji, []))
+        if after is not None:
+            userIds = [userId for userId in userIds if userId > int(after)]
+        return [{'id': str(userId), 'username': f'grinder-{userId}'} for userId in userIds[:limit]]
+
+    def dispatch_reaction(self, guild: FakeGuild, messageId: int, userId: int, emoji: str = '✅'):
+        self.record_reaction(messageId, userId, emoji)
+        payload = discord.RawReactionActionEvent({
+            'message_id': messageId,
+            'channel_id': guild.channel.id,
+            'user_id': userId,
+            'guild_id': guild.id,
+        }, discord.PartialEmoji(name=emoji), 'REACTION_ADD')
+        self.dispatch('raw_reaction_add', payload)
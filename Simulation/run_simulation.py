@@ -0,0 +1,256 @@
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import resource
+import statistics
+import time
+import tracemalloc
+from typing import Any, Dict, List, Set, Tuple
+from Entities import ServerEntity, UserEntity, DailyMessageEntity, ReleaseClock
+from LCBot import LCBot, DailyLC, StatsLC
+from Benchmarks import FakeTableSession, StubLeetQuery
+from Simulation.FakeDiscord import SimulatedBot, FakeGuild
+
+
+def percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+def seed_storage(session: FakeTableSession, guilds: List[FakeGuild], existingUserRatio: float):
+    serviceClient = session.tableServiceClient
+    channelTable = serviceClient.get_table_client(ServerEntity.get_partition_key())
+    for guild in guilds:
+        channelTable.write_row(ServerEntity(guild.id, guild.channel.id).to_entity())
+
+    userTable = serviceClient.get_table_client(UserEntity.get_partition_key())
+    releaseDate = ReleaseClock.latest_release_date()
+    for guild in guilds:
+        for member in guild.members:
+            if random.random() < existingUserRatio:
+                userEntity = UserEntity(str(member.id))
+                userEntity.numEasy = random.randint(0, 50)
+                userEntity.complete(releaseDate - datetime.timedelta(days=1))
+                userTable.write_row(userEntity.to_entity())
+
+
+class CompletionTracker:
+    dispatchTimes: Dict[Tuple[int, int], float]
+    completedUsers: Set[int]
+    latencies: List[float]
+    firstDispatch: float
+    lastCompletion: float
+
+    def __init__(self):
+        self.dispatchTimes = {}
+        self.completedUsers = set()
+        self.latencies = []
+        self.firstDispatch = 0.0
+        self.lastCompletion = 0.0
+
+    def record_dispatch(self, userId: int, messageId: int):
+        now = time.perf_counter()
+        if not self.firstDispatch:
+            self.firstDispatch = now
+        # Repeat reactions are dropped by the reaction queue, so only the first one is timed
+        self.dispatchTimes.setdefault((userId, messageId), now)
+
+    def wrap(self, statsLC: StatsLC):
+        logUserCompletion = statsLC.log_user_completion
+
+        async def tracked_log_user_completion(dailyMessage: DailyMessageEntity, userId: int):
+            await logUserCompletion(dailyMessage, userId)
+            self.completedUsers.add(userId)
+            dispatchTime = self.dispatchTimes.get((userId, dailyMessage.messageId))
+            if dispatchTime is not None:
+                now = time.perf_counter()
+                self.latencies.append(now - dispatchTime)
+                self.lastCompletion = now
+
+        statsLC.log_user_completion = tracked_log_user_completion
+
+
+async def replay_reactions(bot: SimulatedBot, tracker: CompletionTracker, messageIds: Dict[int, int],
+                           reactionCount: int, duration: float):
+    guilds = [guild for guild in bot.guilds if guild.id in messageIds and guild.members]
+    offsets = sorted(random.uniform(0, duration) for _ in range(reactionCount))
+
+    startTime = time.perf_counter()
+    for offset in offsets:
+        delay = startTime + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        guild = random.choice(guilds)
+        member = random.choice(guild.members)
+        tracker.record_dispatch(member.id, messageIds[guild.id])
+        bot.dispatch_reaction(guild, messageIds[guild.id], member.id)
+
+
+def record_missed_reactions(bot: SimulatedBot, tracker: CompletionTracker, messageIds: Dict[int, int],
+                            reactionCount: int) -> int:
+    # Reactions added during an outage land on the messages without ever reaching the event handler
+    guilds = [guild for guild in bot.guilds if guild.id in messageIds and guild.members]
+    reactors = {userId for userId, _ in tracker.dispatchTimes}
+    for _ in range(reactionCount if guilds else 0):
+        guild = random.choice(guilds)
+        member = random.choice(guild.members)
+        bot.record_reaction(messageIds[guild.id], member.id)
+        reactors.add(member.id)
+    # Every message is today's question, so each reactor without a live completion is owed exactly one
+    return len(reactors - tracker.completedUsers)
+
+
+async def wait_for_completions(tracker: CompletionTracker, statsLC: StatsLC, timeout: float) -> bool:
+    deadline = time.perf_counter() + timeout
+    # Shed and failed reactions never complete
+    reactionQueue = statsLC.reactionQueue
+    while len(tracker.latencies) + reactionQueue.shed + reactionQueue.failed < len(tracker.dispatchTimes):
+        if time.perf_counter() > deadline:
+            return False
+        await asyncio.sleep(0.01)
+    return True
+
+
+async def run_simulation(args: argparse.Namespace) -> Dict[str, Any]:
+    random.seed(args.seed)
+    if args.trace_memory:
+        tracemalloc.start()
+
+    session = FakeTableSession(latency=args.storage_latency)
+    bot = SimulatedBot(sendLatency=args.send_latency, memberCache=not args.lean_member_cache)
+    await bot.attach_loop()
+    membersPerGuild = max(1, args.members // args.guilds)
+    for _ in range(args.guilds):
+        bot.add_guild(membersPerGuild)
+    seed_storage(session, bot.guilds, args.existing_users)
+
+    # Registers the real event handlers and commands on the simulated bot
+    lcBot = LCBot(bot)
+    lcBot.tableSession = session
+    callCounts = session.tableServiceClient.callCounts
+
+    startupStart = time.perf_counter()
+    dailyLC = DailyLC(bot, session)
+    dailyLC.leetQuery = StubLeetQuery()
+    await bot.add_cog(dailyLC)
+    statsLC = StatsLC(bot, session)
+    await bot.add_cog(statsLC)
+    if statsLC.migrationTask is not None:
+        await statsLC.migrationTask
+    startupDuration = time.perf_counter() - startupStart
+    startupCalls = dict(callCounts)
+    callCounts.clear()
+
+    fanOutReport = await dailyLC.send_daily_question()
+    fanOutCalls = dict(callCounts)
+    callCounts.clear()
+
+    tracker = CompletionTracker()
+    tracker.wrap(statsLC)
+    messageIds = {guildId: message.id for guildId, message in fanOutReport.results.items()}
+    await replay_reactions(bot, tracker, messageIds, args.reactions, args.duration)
+    drained = await wait_for_completions(tracker, statsLC, args.timeout)
+    queueStats = statsLC.reactionQueue.get_stats()
+    reactionCalls = dict(callCounts)
+    callCounts.clear()
+
+    missed = record_missed_reactions(bot, tracker, messageIds, args.missed_reactions)
+    reconcileReport = await lcBot.reconcile_completions()
+    reconcileCalls = dict(callCounts)
+    callCounts.clear()
+
+    shutdownStart = time.perf_counter()
+    await bot.remove_cog('StatsLC')
+    await bot.remove_cog('DailyLC')
+    shutdownDuration = time.perf_counter() - shutdownStart
+    shutdownCalls = dict(callCounts)
+
+    burstDuration = (tracker.lastCompletion - tracker.firstDispatch) if tracker.latencies else 0.0
+    report = {
+        "config": vars(args),
+        "startup": {
+            "seconds": round(startupDuration, 3),
+            "storageCalls": startupCalls,
+        },
+        "fanOut": {
+            "seconds": round(fanOutReport.duration, 3),
+            "sent": len(fanOutReport.results),
+            "failed": len(fanOutReport.errors),
+            "p50Ms": round(fanOutReport.percentile(50) * 1000, 2),
+            "p99Ms": round(fanOutReport.percentile(99) * 1000, 2),
+            "storageCalls": fanOutCalls,
+        },
+        "reactions": {
+            "dispatched": args.reactions,
+            "unique": len(tracker.dispatchTimes),
+            "completed": len(tracker.latencies),
+            "duplicates": queueStats["duplicates"],
+            "shed": queueStats["shed"],
+            "drained": drained,
+            "throughputPerSecond": round(len(tracker.latencies) / burstDuration, 1) if burstDuration else 0.0,
+            "p50Ms": round(percentile(tracker.latencies, 50) * 1000, 2),
+            "p99Ms": round(percentile(tracker.latencies, 99) * 1000, 2),
+            "maxMs": round(max(tracker.latencies, default=0.0) * 1000, 2),
+            "meanMs": round(statistics.mean(tracker.latencies) * 1000, 2) if tracker.latencies else 0.0,
+            "storageCalls": reactionCalls,
+        },
+        "reconcile": {
+            "missed": missed,
+            "seconds": round(reconcileReport.duration, 3),
+            "messages": reconcileReport.messages,
+            "reactions": reconcileReport.reactions,
+            "completed": reconcileReport.completed,
+            "failed": reconcileReport.failed,
+            "reactionPages": bot.reactionPageCount,
+            "storageCalls": reconcileCalls,
+        },
+        "shutdownSeconds": round(shutdownDuration, 3),
+        "shutdownStorageCalls": shutdownCalls,
+        # ru_maxrss is reported in KiB on Linux
+        "peakRssMiB": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+    if args.trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        report["peakTracedMiB"] = round(peak / (1024 * 1024), 1)
+        tracemalloc.stop()
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a synthetic 11:00 UTC workload against the LC bot.")
+    parser.add_argument("--guilds", type=int, default=100, help="Number of guilds with a configured channel.")
+    parser.add_argument("--members", type=int, default=5000, help="Total members spread evenly across guilds.")
+    parser.add_argument("--reactions", type=int, default=2000, help="Number of ✅ reactions in the burst.")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds the reaction burst is spread over.")
+    parser.add_argument("--missed-reactions", type=int, default=500,
+                        help="Number of ✅ reactions added while disconnected, recovered by reconciliation.")
+    parser.add_argument("--storage-latency", type=float, default=0.02, help="Seconds added to every table call.")
+    parser.add_argument("--send-latency", type=float, default=0.05, help="Seconds added to every channel send.")
+    parser.add_argument("--existing-users", type=float, default=0.3,
+                        help="Fraction of members that already have a UserCache row.")
+    parser.add_argument("--lean-member-cache", action="store_true",
+                        help="Run without the members intent, like LEAN_MEMBER_CACHE=true.")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for the burst to drain.")
+    parser.add_argument("--seed", type=int, default=11, help="Random seed for the workload.")
+    parser.add_argument("--trace-memory", action="store_true", help="Also report tracemalloc peak (slower).")
+    parser.add_argument("--output", help="Write the report as JSON to this file instead of stdout.")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_simulation(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional
+from azure.core import MatchConditions
+from azure.data.tables import UpdateMode
+from azure.data.tables.aio import TableClient
+from .TableBackend import TableBackend, ETAG_COLUMN
+
+
+def with_etag(entity: Dict[str, Any]) -> Dict[str, Any]:
+    # The SDK keeps the ETag in metadata, which does not survive being copied into a plain dict
+    metadata = getattr(entity, 'metadata', None)
+    if metadata is not None:
+        entity[ETAG_COLUMN] = metadata.get('etag')
+    return entity
+
+
+def etag_of(metadata: Optional[Mapping[str, Any]]) -> Optional[str]:
+    return metadata.get('etag') if metadata is not None else None
+
+
+class AzureTableBackend(TableBackend):
+    tableClient: TableClient
+
+    def __init__(self, tableName: str, tableClient: TableClient):
+        self.tableName = tableName
+        self.tableClient = tableClient
+
+    async def create_table(self):
+        await self.tableClient.create_table()
+
+    async def get_entity(self, partitionKey: str, rowKey: str) -> Dict[str, Any]:
+        return with_etag(await self.tableClient.get_entity(partition_key=partitionKey, row_key=rowKey))
+
+    async def upsert_entity(self, entity: Dict[str, Any]) -> Optional[str]:
+        return etag_of(await self.tableClient.upsert_entity(mode=UpdateMode.MERGE, entity=entity))
+
+    async def create_entity(self, entity: Dict[str, Any]) -> Optional[str]:
+        return etag_of(await self.tableClient.create_entity(entity=entity))
+
+    async def update_entity(self, entity: Dict[str, Any], etag: str) -> Optional[str]:
+        return etag_of(await self.tableClient.update_entity(mode=UpdateMode.MERGE, entity=entity, etag=etag,
+                                                            match_condition=MatchConditions.IfNotModified))
+
+    async def submit_batch(self, entities: List[Dict[str, Any]],
+                           etags: Optional[List[Optional[str]]] = None) -> List[Optional[str]]:
+        if etags is None:
+            operations = [("upsert", entity, {"mode": UpdateMode.MERGE}) for entity in entities]
+        else:
+            operations = [("create", entity) if etag is None else
+                          ("update", entity, {"mode": UpdateMode.MERGE, "etag": etag,
+                                              "match_condition": MatchConditions.IfNotModified})
+                          for entity, etag in zip(entities, etags)]
+        results = await self.tableClient.submit_transaction(operations)
+        return [etag_of(metadata) for metadata in results]
+
+    async def query_entities(self, queryFilter: str, parameters: Dict[str, Any], pageSize: int,
+                             select: Optional[List[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+        async for entity in self.tableClient.query_entities(query_filter=queryFilter, parameters=parameters,
+                                                            results_per_page=pageSize, select=select):
+            yield with_etag(entity)
+
+    async def close(self):
+        await self.tableClient.close()
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import os
+import pickle
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Serialized table rows, keyed by row key
+SnapshotRows = Dict[str, Dict[str, Any]]
+
+
+class CacheSnapshot:
+    # Snapshots older than this many seconds are ignored at startup
+    MAX_AGE = 24 * 3600
+
+    path: str
+    connection: Optional[sqlite3.Connection]
+    lock: asyncio.Lock
+    logger: logging.Logger
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = None
+        self.lock = asyncio.Lock()
+
+        self.logger = logging.getLogger('discord.TableCache')
+
+    async def open(self):
+        async with self.lock:
+            if self.connection is None:
+                self.connection = await asyncio.to_thread(self._open)
+                self.logger.info('Opened cache snapshot [%s].', self.path)
+
+    async def close(self):
+        async with self.lock:
+            if self.connection is not None:
+                await asyncio.to_thread(self.connection.close)
+                self.connection = None
+
+    async def load(self, tableName: str) -> Tuple[Optional[float], SnapshotRows]:
+        async with self.lock:
+            if self.connection is None:
+                return None, {}
+            return await asyncio.to_thread(self._load, self.connection, tableName)
+
+    async def save(self, tableName: str, rows: SnapshotRows):
+        # Rows written after this point are newer than the snapshot and get picked up on revalidation
+        savedAt = time.time()
+        # Pickling runs on the loop since the rows may still be mutated by handlers
+        blobs = [(tableName, rowKey, pickle.dumps(row, pickle.HIGHEST_PROTOCOL)) for rowKey, row in rows.items()]
+        async with self.lock:
+            if self.connection is not None:
+                await asyncio.to_thread(self._save, self.connection, tableName, blobs, savedAt)
+
+    def _open(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Only ever used from one worker thread at a time under the lock
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS snapshot_tables (tableName TEXT PRIMARY KEY, savedAt REAL NOT NULL)")
+        connection.execute("CREATE TABLE IF NOT EXISTS snapshot_rows (tableName TEXT NOT NULL, rowKey TEXT NOT NULL, "
+                           "data BLOB NOT NULL, PRIMARY KEY (tableName, rowKey)) WITHOUT ROWID")
+        connection.commit()
+        return connection
+
+    def _load(self, connection: sqlite3.Connection, tableName: str) -> Tuple[Optional[float], SnapshotRows]:
+        row = connection.execute("SELECT savedAt FROM snapshot_tables WHERE tableName = ?", (tableName,)).fetchone()
+        if row is None or time.time() - row[0] > self.MAX_AGE:
+            return None, {}
+
+        rows = connection.execute("SELECT rowKey, data FROM snapshot_rows WHERE tableName = ?", (tableName,))
+        return row[0], {rowKey: pickle.loads(data) for rowKey, data in rows}
+
+    def _save(self, connection: sqlite3.Connection, tableName: str, blobs: List[Tuple[str, str, bytes]],
+              savedAt: float):
+        with connection:
+            connection.execute("DELETE FROM snapshot_rows WHERE tableName = ?", (tableName,))
+            connection.executemany("INSERT INTO snapshot_rows (tableName, rowKey, data) VALUES (?, ?, ?)", blobs)
+            connection.execute("INSERT OR REPLACE INTO snapshot_tables (tableName, savedAt) VALUES (?, ?)",
+                               (tableName, savedAt))
@@ -0,0 +1,81 @@
+import logging
+import time
+from typing import Optional
+from . import Metrics
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    # Consecutive failures that open the circuit
+    FAILURE_THRESHOLD = 5
+    # Seconds the circuit stays open before a single trial call is let through
+    RESET_TIMEOUT = 60.0
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    name: str
+    failureThreshold: int
+    resetTimeout: float
+    failures: int
+    openedAt: Optional[float]
+    trialRunning: bool
+    rejected: int
+    logger: logging.Logger
+
+    def __init__(self, name: str, failureThreshold: int = FAILURE_THRESHOLD, resetTimeout: float = RESET_TIMEOUT):
+        self.name = name
+        self.failureThreshold = failureThreshold
+        self.resetTimeout = resetTimeout
+        self.failures = 0
+        self.openedAt = None
+        self.trialRunning = False
+        self.rejected = 0
+
+        self.logger = logging.getLogger('discord.CircuitBreaker')
+
+    @property
+    def state(self) -> str:
+        if self.openedAt is None:
+            return self.CLOSED
+        if time.monotonic() - self.openedAt < self.resetTimeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def before_call(self):
+        # Raises instead of waiting, callers fall back right away while the service is down
+        state = self.state
+        if state == self.CLOSED:
+            return
+        if state == self.HALF_OPEN and not self.trialRunning:
+            self.trialRunning = True
+            return
+
+        self.rejected += 1
+        raise CircuitOpenError(f'Circuit to [{self.name}] is open after [{self.failures}] consecutive failures.')
+
+    def record_success(self):
+        if self.openedAt is not None:
+            self.logger.info('Closed circuit to [%s].', self.name)
+        self.failures = 0
+        self.openedAt = None
+        self.trialRunning = False
+        Metrics.CIRCUIT_OPEN.labels(circuit=self.name).set(0)
+
+    def record_cancelled(self):
+        # A cancelled call says nothing about the service, but a cancelled trial must let the next call try
+        self.trialRunning = False
+
+    def record_failure(self):
+        self.failures += 1
+        # A failed trial reopens the circuit for another full timeout
+        if self.trialRunning or (self.openedAt is None and self.failures >= self.failureThreshold):
+            self.logger.warning('Opened circuit to [%s] for [%ss] after [%s] consecutive failures.',
+                                self.name, self.resetTimeout, self.failures)
+            self.openedAt = time.monotonic()
+            Metrics.CIRCUIT_OPEN.labels(circuit=self.name).set(1)
+        self.trialRunning = False
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+from .TokenBucket import TokenBucket
+
+# (key, routeKey, send) where routeKey picks the per-route rate limit bucket
+FanOutJob = Tuple[Hashable, Hashable, Callable[[], Awaitable[Any]]]
+
+
+class FanOutReport:
+    duration: float
+    latencies: List[float]
+    results: Dict[Hashable, Any]
+    failures: Dict[Hashable, int]
+    errors: Dict[Hashable, Exception]
+
+    def __init__(self):
+        self.duration = 0.0
+        self.latencies = []
+        self.results = {}
+        self.failures = {}
+        self.errors = {}
+
+    def percentile(self, percent: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def summary(self) -> str:
+        return (f'Fan-out sent [{len(self.results)}] and failed [{len(self.errors)}] in [{self.duration:.2f}s] '
+                f'(p50 [{self.percentile(50) * 1000:.0f}ms], p99 [{self.percentile(99) * 1000:.0f}ms], '
+                f'[{sum(self.failures.values())}] failed attempts).')
+
+
+class FanOut:
+    # Max number of sends in flight at once
+    CONCURRENCY = 50
+    # Discord allows 50 requests per second across the whole bot
+    GLOBAL_RATE = 50
+    # Message sends are limited to 5 per 5 seconds for each channel
+    ROUTE_RATE = 1
+    ROUTE_CAPACITY = 5
+    # Attempts per job before giving up, with exponential backoff in between
+    MAX_ATTEMPTS = 3
+    BASE_BACKOFF = 1.0
+
+    concurrency: int
+    maxAttempts: int
+    isRetryable: Callable[[Exception], bool]
+    globalBucket: TokenBucket
+    routeBuckets: Dict[Hashable, TokenBucket]
+    logger: logging.Logger
+
+    def __init__(self,
+                 concurrency: int = CONCURRENCY,
+                 maxAttempts: int = MAX_ATTEMPTS,
+                 isRetryable: Callable[[Exception], bool] = lambda e: True):
+        self.concurrency = concurrency
+        self.maxAttempts = maxAttempts
+        self.isRetryable = isRetryable
+        self.globalBucket = TokenBucket(self.GLOBAL_RATE, self.GLOBAL_RATE)
+        self.routeBuckets = {}
+
+        self.logger = logging.getLogger('discord.FanOut')
+
+    async def run(self, jobs: List[FanOutJob]) -> FanOutReport:
+        report = FanOutReport()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_job(key: Hashable, routeKey: Hashable, send: Callable[[], Awaitable[Any]]):
+            async with semaphore:
+                startTime = time.perf_counter()
+                try:
+                    report.results[key] = await self.send_with_retry(key, routeKey, send, report)
+                    report.latencies.append(time.perf_counter() - startTime)
+                except Exception as e:
+                    report.errors[key] = e
+
+        startTime = time.perf_counter()
+        await asyncio.gather(*(run_job(key, routeKey, send) for key, routeKey, send in jobs))
+        report.duration = time.perf_counter() - startTime
+
+        return report
+
+    async def send_with_retry(self, key: Hashable, routeKey: Hashable, send: Callable[[], Awaitable[Any]],
+                              report: FanOutReport) -> Any:
+        routeBucket = self.routeBuckets.get(routeKey)
+        if routeBucket is None:
+            routeBucket = TokenBucket(self.ROUTE_RATE, self.ROUTE_CAPACITY)
+            self.routeBuckets[routeKey] = routeBucket
+
+        attempt = 1
+        while True:
+            await routeBucket.acquire()
+            await self.globalBucket.acquire()
+            try:
+                return await send()
+            except Exception as e:
+                report.failures[key] = report.failures.get(key, 0) + 1
+                if attempt >= self.maxAttempts or not self.isRetryable(e):
+                    raise
+
+                backoff = self.BASE_BACKOFF * (2 ** (attempt - 1)) + random.uniform(0, self.BASE_BACKOFF)
+                self.logger.warning('Attempt [%s] for [%s] failed, retrying in [%.2fs]: %s', attempt, key, backoff, e)
+                await asyncio.sleep(backoff)
+                attempt += 1
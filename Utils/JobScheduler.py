@@ -0,0 +1,253 @@
+import asyncio
+import datetime
+import logging
+import os
+import socket
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from Entities import JobEntity, ReleaseClock
+from .TableBackend import StorageSession
+from .TableCache import TableCache
+from . import Metrics, LogPipeline
+
+# Work items of one run by key. Keys are processed in sorted order so the cursor can resume a run
+JobItems = Dict[str, Any]
+JobRun = Tuple[str, datetime.date]
+
+
+class JobLeaseLost(RuntimeError):
+    pass
+
+
+class Job:
+    # Number of items processed between checkpoints
+    CHUNK_SIZE = 100
+
+    name: str
+    offset: datetime.timedelta
+    load: Callable[[datetime.date], Awaitable[JobItems]]
+    process: Callable[[datetime.date, List[Tuple[str, Any]]], Awaitable[None]]
+    chunkSize: int
+
+    def __init__(self,
+                 name: str,
+                 offset: datetime.timedelta,
+                 load: Callable[[datetime.date], Awaitable[JobItems]],
+                 process: Callable[[datetime.date, List[Tuple[str, Any]]], Awaitable[None]],
+                 chunkSize: int = CHUNK_SIZE):
+        self.name = name
+        self.offset = offset
+        self.load = load
+        self.process = process
+        self.chunkSize = chunkSize
+
+    def due_at(self, releaseDate: datetime.date) -> datetime.datetime:
+        # Offsets are relative to the release, e.g. minus two minutes to run just before the question goes out
+        return datetime.datetime.combine(releaseDate, ReleaseClock.RELEASE_TIME) + self.offset
+
+
+class JobScheduler:
+    # Seconds a run is reserved for its owner, renewed at every checkpoint
+    LEASE_SECONDS = 300
+    # Seconds before a failed run, or one held by another instance, is tried again
+    RETRY_DELAY = 60
+    MAX_SLEEP = 3600
+
+    tableSession: StorageSession
+    scope: str
+    owner: str
+    jobs: Dict[str, Job]
+    jobCache: TableCache[JobEntity]
+    completed: Set[JobRun]
+    retryAt: Dict[JobRun, float]
+    activeRuns: Dict[str, asyncio.Task]
+    wakeup: asyncio.Event
+    loopTask: Optional[asyncio.Task]
+    logger: logging.Logger
+
+    def __init__(self, tableSession: StorageSession, scope: str = ""):
+        self.tableSession = tableSession
+        # Shard processes checkpoint separately since each works through its own guilds and users
+        self.scope = scope
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self.jobs = {}
+        self.jobCache = TableCache(JobEntity)
+        self.completed = set()
+        self.retryAt = {}
+        self.activeRuns = {}
+        self.wakeup = asyncio.Event()
+        self.loopTask = None
+
+        self.logger = logging.getLogger('discord.JobScheduler')
+
+    async def start(self):
+        await self.jobCache.initialize_table(self.tableSession)
+        if self.loopTask is None:
+            self.loopTask = asyncio.create_task(self.run_loop())
+
+    async def close(self):
+        if self.loopTask is not None:
+            self.loopTask.cancel()
+            self.loopTask = None
+        # Runs are separate tasks, cancelling the loop alone would leave them writing checkpoints to a closed cache
+        activeRuns = list(self.activeRuns.values())
+        for activeRun in activeRuns:
+            activeRun.cancel()
+        await asyncio.gather(*activeRuns, return_exceptions=True)
+        await self.jobCache.close()
+
+    def register(self, job: Job):
+        self.jobs[job.name] = job
+        self.wakeup.set()
+
+    def unregister(self, name: str):
+        # A run cut short here resumes from its last checkpoint
+        self.jobs.pop(name, None)
+        activeRun = self.activeRuns.get(name)
+        if activeRun is not None:
+            activeRun.cancel()
+
+    async def run_loop(self):
+        while True:
+            self.wakeup.clear()
+            try:
+                await self.run_due()
+            except Exception as e:
+                self.logger.error('Error running scheduled jobs: %s', e, exc_info=True)
+
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.next_wake_delay())
+            except asyncio.TimeoutError:
+                pass
+
+    def release_dates(self, now: datetime.datetime) -> List[datetime.date]:
+        # Jobs with a negative offset run before the next release, older releases are never caught up on
+        latestReleaseDate = ReleaseClock.latest_release_date(now)
+        return [latestReleaseDate, latestReleaseDate + datetime.timedelta(days=1)]
+
+    async def run_due(self):
+        releaseDates = self.release_dates(datetime.datetime.now(datetime.timezone.utc))
+        self.completed = {run for run in self.completed if run[1] >= releaseDates[0]}
+        self.retryAt = {run: retryAt for run, retryAt in self.retryAt.items() if run[1] >= releaseDates[0]}
+
+        for releaseDate in releaseDates:
+            for job in list(self.jobs.values()):
+                # Earlier runs in this pass may take a while, so due times are checked against the current time
+                now = datetime.datetime.now(datetime.timezone.utc)
+                run = (job.name, releaseDate)
+                if run in self.completed or job.due_at(releaseDate) > now or self.retryAt.get(run, 0) > time.time():
+                    continue
+                await self.run_job(job, releaseDate)
+
+    def next_wake_delay(self) -> float:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        wakeTimes = []
+        for releaseDate in self.release_dates(now):
+            for job in self.jobs.values():
+                run = (job.name, releaseDate)
+                if run in self.completed:
+                    continue
+                wakeTimes.append(max(job.due_at(releaseDate).timestamp(), self.retryAt.get(run, 0)))
+        # The next release's jobs become visible once the current release rolls over
+        wakeTimes.append(ReleaseClock.next_release(now).timestamp())
+        return min(self.MAX_SLEEP, max(0.05, min(wakeTimes) - now.timestamp()))
+
+    async def run_job(self, job: Job, releaseDate: datetime.date) -> bool:
+        # Also runs jobs that are not registered, returns whether the run is done
+        run = (job.name, releaseDate)
+        jobEntity = await self.claim(job, releaseDate)
+        if jobEntity is None:
+            return run in self.completed
+
+        task = asyncio.create_task(self.execute(job, releaseDate, jobEntity))
+        self.activeRuns[job.name] = task
+        try:
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            # The run stops with its caller and resumes from its checkpoint
+            task.cancel()
+            raise
+        finally:
+            self.activeRuns.pop(job.name, None)
+
+        if task.cancelled():
+            self.logger.info('Run of [%s] for [%s] was cancelled, it resumes from its checkpoint.', job.name, releaseDate)
+            return False
+        error = task.exception()
+        if error is not None:
+            self.retryAt[run] = time.time() + self.RETRY_DELAY
+            self.logger.error('Run of [%s] for [%s] failed, retrying in [%ss]: %s',
+                              job.name, releaseDate, self.RETRY_DELAY, error, exc_info=error)
+            return False
+
+        self.completed.add(run)
+        self.retryAt.pop(run, None)
+        return True
+
+    async def claim(self, job: Job, releaseDate: datetime.date) -> Optional[JobEntity]:
+        run = (job.name, releaseDate)
+        now = time.time()
+        outcome = 'failed'
+
+        def take(jobEntity: JobEntity) -> bool:
+            nonlocal outcome
+            if jobEntity.done:
+                outcome = 'done'
+                return False
+            if jobEntity.is_leased(self.owner, now):
+                outcome = 'leased'
+                return False
+            outcome = 'claimed'
+            jobEntity.status = JobEntity.RUNNING
+            jobEntity.owner = self.owner
+            jobEntity.leaseUntil = now + self.LEASE_SECONDS
+            return True
+
+        # The ETag check lets exactly one instance win the run
+        jobEntity = await self.jobCache.mutate_entity(JobEntity.make_row_key(job.name, releaseDate, self.scope), take,
+                                                      lambda: JobEntity(job.name, releaseDate, self.scope))
+        if outcome == 'claimed' and jobEntity is not None:
+            return jobEntity
+
+        if outcome == 'done':
+            self.completed.add(run)
+        else:
+            self.retryAt[run] = now + self.RETRY_DELAY
+            self.logger.info('Could not claim [%s] for [%s] (%s), retrying in [%ss].',
+                             job.name, releaseDate, outcome, self.RETRY_DELAY)
+        return None
+
+    async def execute(self, job: Job, releaseDate: datetime.date, jobEntity: JobEntity):
+        with LogPipeline.correlate(), Metrics.track(Metrics.JOB_SECONDS, job=job.name):
+            items = await job.load(releaseDate)
+            keys = sorted(key for key in items if key > jobEntity.cursor)
+            if jobEntity.cursor:
+                self.logger.info('Resuming [%s] for [%s] after [%s] processed items, [%s] left.',
+                                 job.name, releaseDate, jobEntity.processed, len(keys))
+
+            for start in range(0, len(keys), job.chunkSize):
+                chunkKeys = keys[start:start + job.chunkSize]
+                await job.process(releaseDate, [(key, items[key]) for key in chunkKeys])
+                jobEntity = await self.checkpoint(job, releaseDate, chunkKeys[-1], len(chunkKeys))
+
+            jobEntity = await self.checkpoint(job, releaseDate, jobEntity.cursor, 0, done=True)
+            self.logger.info('Completed [%s] for [%s] after [%s] items.', job.name, releaseDate, jobEntity.processed)
+
+    async def checkpoint(self, job: Job, releaseDate: datetime.date, cursor: str, count: int,
+                         done: bool = False) -> JobEntity:
+        def advance(jobEntity: JobEntity) -> bool:
+            if jobEntity.owner != self.owner or jobEntity.done:
+                raise JobLeaseLost(f'Run of [{job.name}] for [{releaseDate}] was taken over by [{jobEntity.owner}].')
+            jobEntity.cursor = cursor
+            jobEntity.processed += count
+            jobEntity.leaseUntil = time.time() + self.LEASE_SECONDS
+            if done:
+                jobEntity.status = JobEntity.DONE
+                jobEntity.completedAt = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            return True
+
+        jobEntity = await self.jobCache.mutate_entity(JobEntity.make_row_key(job.name, releaseDate, self.scope), advance,
+                                                      lambda: JobEntity(job.name, releaseDate, self.scope))
+        if jobEntity is None:
+            raise RuntimeError(f'Failed to checkpoint [{job.name}] for [{releaseDate}].')
+        return jobEntity
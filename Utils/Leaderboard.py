@@ -0,0 +1,127 @@
+import datetime
+import struct
+import zlib
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from Entities import UserEntity
+from Entities.UserEntity import current_streak
+from .SortedIndex import SortedIndex
+
+# (currStreakStartDate, lastCompletedDate, longestStreak, weightedSolves)
+LeaderboardRow = Tuple[Optional[datetime.date], Optional[datetime.date], int, int]
+
+# userId, streak start ordinal, last completed ordinal, longest streak, weighted solves
+ROW_FORMAT = struct.Struct('<QIIII')
+
+
+def to_ordinal(date: Optional[datetime.date]) -> int:
+    return date.toordinal() if date is not None else 0
+
+
+def from_ordinal(ordinal: int) -> Optional[datetime.date]:
+    return datetime.date.fromordinal(ordinal) if ordinal > 0 else None
+
+
+class Leaderboard:
+    METRICS = ('current', 'longest', 'solves')
+    # Weight of each difficulty when ranking by solves
+    SOLVE_WEIGHTS = {'easy': 1, 'medium': 2, 'hard': 3}
+
+    userRows: Dict[int, LeaderboardRow]
+    userGuilds: Dict[int, Set[int]]
+    guildIndexes: Dict[int, Dict[str, SortedIndex]]
+    dirtyGuilds: Set[int]
+    releaseDates: Dict[int, datetime.date]
+
+    def __init__(self):
+        self.userRows = {}
+        self.userGuilds = {}
+        self.guildIndexes = {}
+        self.dirtyGuilds = set()
+        # Release each guild's current streaks were computed for, guilds post at different times of day
+        self.releaseDates = {}
+
+    def update_user(self, userEntity: UserEntity, guildIds: Iterable[int], releaseDate: datetime.date):
+        userId = int(userEntity.RowKey)
+        weightedSolves = (userEntity.numEasy * self.SOLVE_WEIGHTS['easy']
+                          + userEntity.numMedium * self.SOLVE_WEIGHTS['medium']
+                          + userEntity.numHard * self.SOLVE_WEIGHTS['hard'])
+        row = (userEntity.currStreakStartDate, userEntity.lastCompletedDate, userEntity.longestStreak, weightedSolves)
+        self.userRows[userId] = row
+
+        # Stats are global, so every guild the user is ranked in has to move with them
+        userGuilds = self.userGuilds.setdefault(userId, set())
+        userGuilds.update(guildIds)
+        for guildId in userGuilds:
+            self.index_user(guildId, userId, row, releaseDate)
+
+    def index_user(self, guildId: int, userId: int, row: LeaderboardRow, releaseDate: datetime.date):
+        indexes = self.guildIndexes.get(guildId)
+        if indexes is None:
+            indexes = {metric: SortedIndex() for metric in self.METRICS}
+            self.guildIndexes[guildId] = indexes
+        releaseDate = self.releaseDates.setdefault(guildId, releaseDate)
+
+        currStreakStartDate, lastCompletedDate, longestStreak, weightedSolves = row
+        indexes['current'].update(userId, current_streak(currStreakStartDate, lastCompletedDate, releaseDate))
+        indexes['longest'].update(userId, longestStreak)
+        indexes['solves'].update(userId, weightedSolves)
+        self.dirtyGuilds.add(guildId)
+
+    def refresh_current_streaks(self, guildId: int, releaseDate: datetime.date):
+        # Streaks only break when the guild's next release goes out, so this is a no-op within its release day
+        if self.releaseDates.get(guildId) == releaseDate:
+            return
+        self.releaseDates[guildId] = releaseDate
+
+        indexes = self.guildIndexes.get(guildId)
+        if indexes is None:
+            return
+        currentIndex = indexes['current']
+        for userId in list(currentIndex.scores):
+            currStreakStartDate, lastCompletedDate, _, _ = self.userRows[userId]
+            streak = current_streak(currStreakStartDate, lastCompletedDate, releaseDate)
+            if currentIndex.get_score(userId) != streak:
+                currentIndex.update(userId, streak)
+                self.dirtyGuilds.add(guildId)
+
+    def top(self, guildId: int, metric: str, count: int) -> List[Tuple[int, int]]:
+        indexes = self.guildIndexes.get(guildId)
+        return indexes[metric].top(count) if indexes is not None else []
+
+    def rank(self, guildId: int, metric: str, userId: int) -> Optional[int]:
+        indexes = self.guildIndexes.get(guildId)
+        return indexes[metric].rank(userId) if indexes is not None else None
+
+    def get_score(self, guildId: int, metric: str, userId: int) -> Optional[int]:
+        indexes = self.guildIndexes.get(guildId)
+        return indexes[metric].get_score(userId) if indexes is not None else None
+
+    def guild_members(self, guildId: int) -> List[int]:
+        # Users ranked in the guild, i.e. members who have stats
+        indexes = self.guildIndexes.get(guildId)
+        return list(indexes['longest'].scores) if indexes is not None else []
+
+    def to_snapshot(self, guildId: int) -> bytes:
+        indexes = self.guildIndexes.get(guildId)
+        if indexes is None:
+            return b""
+
+        packed = bytearray()
+        for userId in indexes['longest'].scores:
+            currStreakStartDate, lastCompletedDate, longestStreak, weightedSolves = self.userRows[userId]
+            packed += ROW_FORMAT.pack(userId, to_ordinal(currStreakStartDate), to_ordinal(lastCompletedDate),
+                                      longestStreak, weightedSolves)
+        return zlib.compress(bytes(packed))
+
+    def load_snapshot(self, guildId: int, snapshot: bytes, releaseDate: datetime.date):
+        if not snapshot:
+            return
+
+        for userId, startOrdinal, lastOrdinal, longestStreak, weightedSolves in ROW_FORMAT.iter_unpack(zlib.decompress(snapshot)):
+            # Rows already indexed from live updates are newer than the snapshot
+            row = self.userRows.setdefault(userId, (from_ordinal(startOrdinal), from_ordinal(lastOrdinal),
+                                                    longestStreak, weightedSolves))
+            self.userGuilds.setdefault(userId, set()).add(guildId)
+            self.index_user(guildId, userId, row, releaseDate)
+
+        self.dirtyGuilds.discard(guildId)
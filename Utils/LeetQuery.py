@@ -1,19 +1,139 @@
+import asyncio
+import datetime
+import functools
+import random
 from gql import gql, Client
+from gql.client import AsyncClientSession
 from gql.transport.aiohttp import AIOHTTPTransport
-from typing import Optional, Dict, Any
+from gql.transport.exceptions import TransportQueryError
+from graphql import DocumentNode, OperationDefinitionNode
+from typing import Optional, Dict, Any, Iterable, List, Set
 import logging
+from .CircuitBreaker import CircuitBreaker
+from .LocalCache import LocalCache
+from . import Metrics
+
+# Recent accepted submissions of one user, newest first, None when the user is unknown or could not be read
+Submissions = Optional[List[Dict[str, Any]]]
+
+
+@functools.lru_cache(maxsize=None)
+def recent_ac_query(batchSize: int) -> DocumentNode:
+    # One aliased field per user, parsed once per batch size
+    variables = ', '.join(f'$u{index}: String!' for index in range(batchSize))
+    fields = '\n'.join(f'u{index}: recentAcSubmissionList(username: $u{index}, limit: $limit) {{ titleSlug timestamp }}'
+                       for index in range(batchSize))
+    return gql(f'query recentAcSubmissions({variables}, $limit: Int!) {{\n{fields}\n}}')
 
 
 class LeetQuery:
+    # Attempts per query, retries back off with full jitter so instances do not retry in lockstep
+    MAX_ATTEMPTS = 3
+    BASE_BACKOFF = 0.5
+    # Usernames aliased into one request
+    BATCH_SIZE = 50
+    # Batched requests in flight at once
+    BATCH_CONCURRENCY = 4
+    # Seconds a single lookup waits for others to share its request
+    BATCH_WINDOW = 0.05
+    # leetcode.com returns at most 20 recent accepted submissions
+    RECENT_AC_LIMIT = 20
+    # Seconds submission lists are reused, short so new submissions show up quickly
+    RESULT_TTL = 120.0
+    RESULT_CACHE_SIZE = 50000
+
     logger: logging.Logger
     client: Client
+    session: Optional[AsyncClientSession]
+    connectLock: asyncio.Lock
+    breaker: CircuitBreaker
+    resultCache: LocalCache
+    batchSemaphore: asyncio.Semaphore
+    pendingLookups: Dict[str, asyncio.Future]
+    flushTask: Optional[asyncio.Task]
+    # Flushes of full batches, kept until done so they are not collected mid-request
+    batchTasks: Set[asyncio.Task]
 
     def __init__(self, url: str = "https://leetcode.com/graphql"):
         transport = AIOHTTPTransport(url=url)
         self.client = Client(transport=transport, fetch_schema_from_transport=False)
+        self.session = None
+        self.connectLock = asyncio.Lock()
+        self.breaker = CircuitBreaker('leetcode.com')
+        self.resultCache = LocalCache(self.RESULT_CACHE_SIZE, self.RESULT_TTL, self.RESULT_TTL)
+        self.batchSemaphore = asyncio.Semaphore(self.BATCH_CONCURRENCY)
+        self.pendingLookups = {}
+        self.flushTask = None
+        self.batchTasks = set()
 
         self.logger = logging.getLogger('discord.LeetQuery')
 
+    async def connect(self) -> AsyncClientSession:
+        async with self.connectLock:
+            if self.session is None:
+                # Keeping the session open reuses the transport's connections and TLS handshake
+                self.session = await self.client.connect_async(reconnecting=False)
+                self.logger.info("Opened session to leetcode.com.")
+            return self.session
+
+    async def close(self):
+        flushTasks = [*self.batchTasks, *([self.flushTask] if self.flushTask is not None else [])]
+        for flushTask in flushTasks:
+            flushTask.cancel()
+        await asyncio.gather(*flushTasks, return_exceptions=True)
+        self.flushTask = None
+        self.resolve_lookups(self.take_lookups(), {})
+        await self.close_session()
+
+    async def execute(self, query: DocumentNode, variables: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        definition = query.definitions[0]
+        queryName = (definition.name.value if isinstance(definition, OperationDefinitionNode) and definition.name
+                     else 'anonymous')
+        for attempt in range(1, self.MAX_ATTEMPTS + 1):
+            # Raises CircuitOpenError without touching the network while leetcode.com is failing
+            self.breaker.before_call()
+            try:
+                result = await self.execute_once(query, queryName, variables)
+            except asyncio.CancelledError:
+                self.breaker.record_cancelled()
+                raise
+            except TransportQueryError:
+                # leetcode.com answered, the query itself was rejected, so retrying would not help
+                self.breaker.record_success()
+                raise
+            except Exception as e:
+                self.breaker.record_failure()
+                if attempt == self.MAX_ATTEMPTS:
+                    raise
+                delay = random.uniform(0, self.BASE_BACKOFF * 2 ** (attempt - 1))
+                self.logger.warning('Query [%s] failed on attempt [%s], retrying in [%.2fs]: %s',
+                                    queryName, attempt, delay, e)
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
+        raise RuntimeError(f'Query [{queryName}] was not attempted, MAX_ATTEMPTS is [{self.MAX_ATTEMPTS}].')
+
+    async def execute_once(self, query: DocumentNode, queryName: str,
+                           variables: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        session = await self.connect()
+        try:
+            with Metrics.track(Metrics.LEETQUERY_SECONDS, query=queryName):
+                return await session.execute(query, variable_values=variables)
+        except TransportQueryError:
+            raise
+        except Exception:
+            # Drop the session so the next query reconnects on a fresh transport
+            await self.close_session()
+            raise
+
+    async def close_session(self):
+        async with self.connectLock:
+            if self.session is not None:
+                self.session = None
+                await self.client.close_async()
+                self.logger.info("Closed session to leetcode.com.")
+
     async def daily_question(self) -> Optional[Dict[str, Any]]:
         query = gql("""
             query questionOfToday {
@@ -33,8 +153,116 @@ class LeetQuery:
         """)
 
         try:
-            result = await self.client.execute_async(query)
+            result = await self.execute(query)
             return result
         except Exception as e:
-            self.logger.error(f"Failed to query leetcode.com for daily question: {e}", exc_info=True)
+            self.logger.error('Failed to query leetcode.com for daily question: %s', e, exc_info=True)
             return None
+
+    async def recent_accepted_submissions(self, usernames: Iterable[str]) -> Dict[str, Submissions]:
+        results: Dict[str, Submissions] = {}
+        missing = []
+        for username in dict.fromkeys(usernames):
+            cached = self.resultCache.get(username)
+            if cached is LocalCache.MISSING:
+                results[username] = None
+            elif cached is not None:
+                results[username] = cached
+            else:
+                missing.append(username)
+
+        batches = [missing[start:start + self.BATCH_SIZE] for start in range(0, len(missing), self.BATCH_SIZE)]
+        for batchResults in await asyncio.gather(*(self.query_recent_accepted(batch) for batch in batches)):
+            results.update(batchResults)
+        return results
+
+    async def query_recent_accepted(self, usernames: List[str]) -> Dict[str, Submissions]:
+        variables: Dict[str, Any] = {f'u{index}': username for index, username in enumerate(usernames)}
+        variables['limit'] = self.RECENT_AC_LIMIT
+        Metrics.LEETQUERY_BATCH_SIZE.observe(len(usernames))
+        async with self.batchSemaphore:
+            try:
+                data = await self.execute(recent_ac_query(len(usernames)), variables)
+            except TransportQueryError as e:
+                # An unknown username only fails its own alias, the rest of the batch still has data
+                data = e.data or {}
+            except Exception as e:
+                # Not cached, the users are looked up again on the next call
+                self.logger.error('Failed to query recent submissions of [%s] users: %s', len(usernames), e)
+                return {username: None for username in usernames}
+
+        results: Dict[str, Submissions] = {}
+        for index, username in enumerate(usernames):
+            submissions = data.get(f'u{index}')
+            if submissions is None:
+                self.resultCache.set_missing(username)
+            else:
+                self.resultCache.set(username, submissions)
+            results[username] = submissions
+        return results
+
+    async def recent_accepted(self, username: str) -> Submissions:
+        # Lookups arriving within the batch window share one request
+        cached = self.resultCache.get(username)
+        if cached is LocalCache.MISSING:
+            return None
+        if cached is not None:
+            return cached
+
+        future = self.pendingLookups.get(username)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.pendingLookups[username] = future
+            if len(self.pendingLookups) >= self.BATCH_SIZE:
+                batchTask = asyncio.create_task(self.flush_lookups(0))
+                self.batchTasks.add(batchTask)
+                batchTask.add_done_callback(self.batchTasks.discard)
+            elif self.flushTask is None:
+                self.flushTask = asyncio.create_task(self.flush_lookups(self.BATCH_WINDOW))
+        # Shielded so one caller giving up does not cancel the lookup for the others
+        return await asyncio.shield(future)
+
+    async def flush_lookups(self, delay: float):
+        if delay:
+            await asyncio.sleep(delay)
+            self.flushTask = None
+        pending = self.take_lookups()
+        if not pending:
+            return
+
+        results: Dict[str, Submissions] = {}
+        try:
+            results = await self.recent_accepted_submissions(list(pending))
+        finally:
+            self.resolve_lookups(pending, results)
+
+    def take_lookups(self) -> Dict[str, asyncio.Future]:
+        pending, self.pendingLookups = self.pendingLookups, {}
+        return pending
+
+    def resolve_lookups(self, pending: Dict[str, asyncio.Future], results: Dict[str, Submissions]):
+        for username, future in pending.items():
+            if not future.done():
+                future.set_result(results.get(username))
+
+    @staticmethod
+    def has_accepted(submissions: List[Dict[str, Any]], titleSlug: str, since: datetime.datetime) -> bool:
+        return any(submission['titleSlug'] == titleSlug and int(submission['timestamp']) >= since.timestamp()
+                   for submission in submissions)
+
+    def forget(self, username: str):
+        # Called when a lookup came back without the expected submission, so the next check sees new ones
+        self.resultCache.invalidate(username)
+
+    async def verify_completion(self, username: str, titleSlug: str, since: datetime.datetime) -> Optional[bool]:
+        # None when leetcode.com could not tell, callers decide whether to trust the user
+        submissions = await self.recent_accepted(username)
+        if submissions is None:
+            return None
+        return self.has_accepted(submissions, titleSlug, since)
+
+    async def verify_completions(self, usernames: Iterable[str], titleSlug: str,
+                                 since: datetime.datetime) -> Dict[str, Optional[bool]]:
+        results = await self.recent_accepted_submissions(usernames)
+        return {username: self.has_accepted(submissions, titleSlug, since) if submissions is not None else None
+                for username, submissions in results.items()}
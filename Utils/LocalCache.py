@@ -0,0 +1,98 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class LocalCache:
+    # Returned by get() for keys known to be missing from the backing table
+    MISSING = object()
+
+    maxSize: int
+    ttl: float
+    negativeTtl: float
+    entries: 'OrderedDict[str, Tuple[Any, float]]'
+    hits: int
+    misses: int
+    negativeHits: int
+    evictions: int
+    expirations: int
+
+    def __init__(self, maxSize: int, ttl: float, negativeTtl: float):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.negativeTtl = negativeTtl
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.negativeHits = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expiry = entry
+        if expiry < time.monotonic():
+            del self.entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        if value is self.MISSING:
+            self.negativeHits += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any):
+        self._insert(key, value, self.ttl)
+
+    def set_missing(self, key: str):
+        self._insert(key, self.MISSING, self.negativeTtl)
+
+    def items(self) -> Dict[str, Any]:
+        # Live rows only, negative entries are cheap to rediscover
+        now = time.monotonic()
+        return {key: value for key, (value, expiry) in self.entries.items()
+                if value is not self.MISSING and expiry >= now}
+
+    def invalidate(self, key: str):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def sweep(self) -> int:
+        now = time.monotonic()
+        expiredKeys = [key for key, (_, expiry) in self.entries.items() if expiry < now]
+        for key in expiredKeys:
+            del self.entries[key]
+
+        self.expirations += len(expiredKeys)
+        return len(expiredKeys)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "negativeHits": self.negativeHits,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _insert(self, key: str, value: Any, ttl: float):
+        self.entries[key] = (value, time.monotonic() + ttl)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
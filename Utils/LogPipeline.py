@@ -0,0 +1,150 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Debug and hot path info records let through per second for each message template
+SAMPLE_RATE = 20
+# Loggers whose info lines are written per reaction, send or row. Info from every other logger, e.g. startup,
+# job and reconcile reports, is never sampled
+SAMPLED_LOGGERS = ('discord.StatsLC', 'discord.DailyLC', 'discord.TableCache', 'discord.ReactionQueue',
+                   'discord.FanOut', 'discord.http', 'discord.gateway')
+# Max records waiting for the writer thread before new ones are dropped
+QUEUE_SIZE = 10000
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+CORRELATION_ID: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('correlationId', default=None)
+GUILD_ID: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar('guildId', default=None)
+USER_ID: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar('userId', default=None)
+
+# Record attributes copied into the JSON output when set
+CONTEXT_FIELDS = ('correlationId', 'guildId', 'userId', 'suppressed')
+
+
+@contextmanager
+def correlate(guildId: Optional[int] = None, userId: Optional[int] = None) -> Iterator[str]:
+    # Tasks started inside the block inherit the ids, so every line of one request can be grepped together
+    correlationId = uuid.uuid4().hex[:12]
+    resets: List[Tuple[contextvars.ContextVar, contextvars.Token]] = [(CORRELATION_ID, CORRELATION_ID.set(correlationId))]
+    if guildId is not None:
+        resets.append((GUILD_ID, GUILD_ID.set(guildId)))
+    if userId is not None:
+        resets.append((USER_ID, USER_ID.set(userId)))
+
+    try:
+        yield correlationId
+    finally:
+        for var, token in reversed(resets):
+            var.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Filters run on the thread that logged the record, so the caller's context variables are still set
+        record.correlationId = CORRELATION_ID.get()
+        record.guildId = GUILD_ID.get()
+        record.userId = USER_ID.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    rate: int
+    loggers: Tuple[str, ...]
+    windowStart: float
+    counts: Dict[Tuple[str, Any], int]
+    suppressed: int
+    lock: threading.Lock
+
+    def __init__(self, rate: int = SAMPLE_RATE, loggers: Tuple[str, ...] = SAMPLED_LOGGERS):
+        super().__init__()
+        self.rate = rate
+        self.loggers = loggers
+        self.windowStart = 0.0
+        self.counts = {}
+        self.suppressed = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        if record.levelno >= logging.INFO and not record.name.startswith(self.loggers):
+            return True
+
+        now = time.monotonic()
+        # Keyed by the unformatted template, so lazily formatted lines from one call site share a budget
+        key = (record.name, record.msg)
+        with self.lock:
+            if now - self.windowStart >= 1.0:
+                self.windowStart = now
+                self.counts.clear()
+
+            count = self.counts.get(key, 0)
+            self.counts[key] = count + 1
+            if count >= self.rate:
+                self.suppressed += 1
+                return False
+
+            if self.suppressed:
+                record.suppressed = self.suppressed
+                self.suppressed = 0
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    dropped: int
+
+    def __init__(self, logQueue: queue.Queue):
+        super().__init__(logQueue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting is left to the writer thread, so arguments must not be mutated after logging them
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Never block the event loop on a slow disk
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def start(handler: logging.Handler, level: int) -> logging.handlers.QueueListener:
+    handler.setFormatter(JsonFormatter())
+
+    logQueue: queue.Queue = queue.Queue(QUEUE_SIZE)
+    queueHandler = DeferredQueueHandler(logQueue)
+    # Sample first so dropped records skip the context lookup
+    queueHandler.addFilter(SamplingFilter())
+    queueHandler.addFilter(ContextFilter())
+
+    rootLogger = logging.getLogger()
+    rootLogger.setLevel(level)
+    rootLogger.addHandler(queueHandler)
+
+    listener = logging.handlers.QueueListener(logQueue, handler, respect_handler_level=True)
+    listener.start()
+    return listener
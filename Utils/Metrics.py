@@ -0,0 +1,94 @@
+import asyncio
+import math
+import time
+from contextlib import contextmanager
+from typing import Iterator
+from azure.core.exceptions import ResourceNotFoundError
+from discord.ext import commands
+from prometheus_client import Counter, Gauge, Histogram
+
+# Buckets tuned for storage and HTTP round-trips, from sub-millisecond cache hits to slow retries
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Daily jobs touch every guild or user, so they need a much wider range
+JOB_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+TABLE_OPERATION_SECONDS = Histogram('lcbot_table_operation_seconds',
+                                    'Latency of table storage round-trips.',
+                                    ['table', 'operation', 'outcome'],
+                                    buckets=LATENCY_BUCKETS)
+TABLE_CACHE_LOOKUPS = Counter('lcbot_table_cache_lookups_total',
+                              'Local table cache lookups.',
+                              ['table', 'outcome'])
+LEETQUERY_SECONDS = Histogram('lcbot_leetquery_seconds',
+                              'Latency of leetcode.com GraphQL queries.',
+                              ['query', 'outcome'],
+                              buckets=LATENCY_BUCKETS)
+LEETQUERY_BATCH_SIZE = Histogram('lcbot_leetquery_batch_size',
+                                 'Usernames packed into one batched leetcode.com query.',
+                                 buckets=(1, 5, 10, 25, 50, 100))
+CIRCUIT_OPEN = Gauge('lcbot_circuit_open',
+                     'Whether the circuit breaker to an external service is open.',
+                     ['circuit'],
+                     multiprocess_mode='liveall')
+COMPLETION_VERIFICATIONS = Counter('lcbot_completion_verifications_total',
+                                   'Completions checked against the user\'s accepted LeetCode submissions, by outcome.',
+                                   ['outcome'])
+JOB_SECONDS = Histogram('lcbot_job_seconds',
+                        'Duration of the scheduled daily jobs.',
+                        ['job', 'outcome'],
+                        buckets=JOB_BUCKETS)
+FANOUT_SENDS = Counter('lcbot_fanout_sends_total',
+                       'Daily question sends by outcome.',
+                       ['outcome'])
+REACTION_SECONDS = Histogram('lcbot_reaction_seconds',
+                             'Time a reaction queue worker spends logging a completion.',
+                             ['outcome'],
+                             buckets=LATENCY_BUCKETS)
+TABLE_CONFLICTS = Counter('lcbot_table_conflicts_total',
+                          'Conditional table writes rejected because another instance changed the row first.',
+                          ['table'])
+REACTION_QUEUE_EVENTS = Counter('lcbot_reaction_queue_events_total',
+                                'Completion reactions offered to the reaction queue, by outcome.',
+                                ['outcome'])
+REACTION_QUEUE_DEPTH = Gauge('lcbot_reaction_queue_depth',
+                             'Completion reactions waiting for a worker.',
+                             multiprocess_mode='livesum')
+REACTION_QUEUE_WAIT_SECONDS = Histogram('lcbot_reaction_queue_wait_seconds',
+                                        'Time a completion reaction waits in the queue before a worker picks it up.',
+                                        buckets=LATENCY_BUCKETS)
+GATEWAY_LATENCY_SECONDS = Gauge('lcbot_gateway_latency_seconds',
+                                'Latency between a gateway heartbeat and its acknowledgement.',
+                                multiprocess_mode='liveall')
+EVENT_LOOP_LAG_SECONDS = Histogram('lcbot_event_loop_lag_seconds',
+                                   'How late the event loop wakes up a sleeping task.',
+                                   buckets=LATENCY_BUCKETS)
+
+# Seconds between event loop lag samples
+LOOP_MONITOR_INTERVAL = 1.0
+
+
+@contextmanager
+def track(histogram: Histogram, **labels: str) -> Iterator[None]:
+    startTime = time.perf_counter()
+    outcome = 'success'
+    try:
+        yield
+    except ResourceNotFoundError:
+        outcome = 'not_found'
+        raise
+    except Exception:
+        outcome = 'error'
+        raise
+    finally:
+        histogram.labels(outcome=outcome, **labels).observe(time.perf_counter() - startTime)
+
+
+async def monitor_event_loop(bot: commands.Bot, interval: float = LOOP_MONITOR_INTERVAL):
+    while True:
+        startTime = time.monotonic()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.observe(max(0.0, time.monotonic() - startTime - interval))
+
+        latency = bot.latency
+        if not math.isnan(latency) and not math.isinf(latency):
+            GATEWAY_LATENCY_SECONDS.set(latency)
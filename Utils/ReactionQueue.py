@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from . import Metrics, LogPipeline
+
+# (userId, messageId) identifies one completion reaction
+ReactionKey = Tuple[int, int]
+# Returns False when the reaction was rejected, it is then not remembered so reacting again retries it
+ReactionHandler = Callable[[int, Any], Awaitable[Optional[bool]]]
+
+
+class ReactionQueue:
+    # Number of workers draining the queue
+    WORKERS = 8
+    # Max number of reactions waiting across all workers before new ones are shed
+    QUEUE_SIZE = 2000
+    # Number of processed reactions remembered so repeat reactions are dropped
+    RECENT_SIZE = 50000
+    # Seconds close() waits for queued reactions to drain
+    DRAIN_TIMEOUT = 10.0
+
+    handle: ReactionHandler
+    queues: List[asyncio.Queue]
+    workerTasks: List[asyncio.Task]
+    pending: Set[ReactionKey]
+    recent: 'OrderedDict[ReactionKey, None]'
+    queued: int
+    duplicates: int
+    shed: int
+    processed: int
+    rejected: int
+    failed: int
+    logger: logging.Logger
+
+    def __init__(self, handle: ReactionHandler, workers: int = WORKERS, queueSize: int = QUEUE_SIZE):
+        self.handle = handle
+        self.queues = [asyncio.Queue(max(1, queueSize // workers)) for _ in range(workers)]
+        self.workerTasks = []
+        self.pending = set()
+        self.recent = OrderedDict()
+
+        self.queued = 0
+        self.duplicates = 0
+        self.shed = 0
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+
+        self.logger = logging.getLogger('discord.ReactionQueue')
+
+    def __len__(self) -> int:
+        return sum(queue.qsize() for queue in self.queues)
+
+    def start(self):
+        if not self.workerTasks:
+            self.workerTasks = [asyncio.create_task(self.work(queue)) for queue in self.queues]
+
+    async def close(self):
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self.queues)), timeout=self.DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.logger.warning('Dropped [%s] queued reactions on shutdown.', len(self))
+
+        for task in self.workerTasks:
+            task.cancel()
+        self.workerTasks = []
+
+    def submit(self, userId: int, messageId: int, item: Any) -> bool:
+        # Never awaits, so the gateway handler returns right away
+        key = (userId, messageId)
+        if key in self.pending or key in self.recent:
+            self.duplicates += 1
+            Metrics.REACTION_QUEUE_EVENTS.labels(outcome='duplicate').inc()
+            return False
+
+        # Every reaction from a user lands on the same worker, so their updates never interleave
+        queue = self.queues[hash(userId) % len(self.queues)]
+        try:
+            queue.put_nowait((key, item, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.shed += 1
+            Metrics.REACTION_QUEUE_EVENTS.labels(outcome='shed').inc()
+            self.logger.warning('Reaction queue is full, shedding reaction from user [%s] on message [%s].',
+                                userId, messageId)
+            return False
+
+        self.pending.add(key)
+        self.queued += 1
+        Metrics.REACTION_QUEUE_EVENTS.labels(outcome='queued').inc()
+        Metrics.REACTION_QUEUE_DEPTH.inc()
+        return True
+
+    async def work(self, queue: asyncio.Queue):
+        while True:
+            key, item, queuedAt = await queue.get()
+            Metrics.REACTION_QUEUE_DEPTH.dec()
+            Metrics.REACTION_QUEUE_WAIT_SECONDS.observe(time.perf_counter() - queuedAt)
+            userId, messageId = key
+            try:
+                with LogPipeline.correlate(userId=userId), Metrics.track(Metrics.REACTION_SECONDS):
+                    handled = await self.handle(userId, item)
+                if handled is False:
+                    self.rejected += 1
+                else:
+                    self.processed += 1
+                    self.remember(key)
+            except Exception as e:
+                # Failed reactions are not remembered, so reacting again retries them
+                self.failed += 1
+                self.logger.error('Failed to process reaction from user [%s] on message [%s]: %s',
+                                  userId, messageId, e, exc_info=True)
+            finally:
+                self.pending.discard(key)
+                queue.task_done()
+
+    def remember(self, key: ReactionKey):
+        self.recent[key] = None
+        if len(self.recent) > self.RECENT_SIZE:
+            self.recent.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "queueDepth": len(self),
+            "queued": self.queued,
+            "duplicates": self.duplicates,
+            "shed": self.shed,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+        }
@@ -0,0 +1,44 @@
+import datetime
+import os
+from typing import Dict, Optional
+from Entities import ReleaseClock
+
+
+class ReleaseSchedule:
+    postTimes: Dict[int, datetime.time]
+    spreadMinutes: int
+
+    def __init__(self, spreadMinutes: int = 0):
+        self.postTimes = {}
+        self.spreadMinutes = max(0, min(spreadMinutes, 24 * 60))
+
+    @classmethod
+    def from_env(cls) -> 'ReleaseSchedule':
+        return cls(int(os.getenv('RELEASE_SPREAD_MINUTES', 0)))
+
+    def set_post_time(self, guildId: int, postTime: Optional[datetime.time]):
+        if postTime is None:
+            self.postTimes.pop(guildId, None)
+        else:
+            self.postTimes[guildId] = postTime
+
+    def post_time(self, guildId: int) -> datetime.time:
+        postTime = self.postTimes.get(guildId)
+        if postTime is not None:
+            return postTime
+        if not self.spreadMinutes:
+            return ReleaseClock.RELEASE_TIME
+
+        # Guilds without a post time are spread over the minutes after the release so their sends do not all land at once
+        offset = datetime.timedelta(minutes=(int(guildId) >> 22) % self.spreadMinutes)
+        return (datetime.datetime.combine(datetime.date.min, ReleaseClock.RELEASE_TIME) + offset).timetz()
+
+    def latest_release(self, guildId: int, now: Optional[datetime.datetime] = None) -> datetime.datetime:
+        return ReleaseClock.latest_release(now, self.post_time(guildId))
+
+    def next_release(self, guildId: int, now: Optional[datetime.datetime] = None) -> datetime.datetime:
+        return ReleaseClock.next_release(now, self.post_time(guildId))
+
+    def latest_release_date(self, guildId: int, now: Optional[datetime.datetime] = None) -> datetime.date:
+        # Each guild's release stays open until that guild's next post
+        return self.latest_release(guildId, now).date()
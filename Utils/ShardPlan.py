@@ -0,0 +1,52 @@
+import os
+from typing import List, Optional
+
+
+class ShardPlan:
+    shardCount: int
+    shardIds: List[int]
+
+    def __init__(self, shardCount: int = 1, shardIds: Optional[List[int]] = None):
+        if shardCount < 1:
+            raise ValueError(f"Shard count must be positive, got [{shardCount}].")
+
+        self.shardCount = shardCount
+        self.shardIds = sorted(shardIds) if shardIds is not None else list(range(shardCount))
+        invalidIds = [shardId for shardId in self.shardIds if not 0 <= shardId < shardCount]
+        if invalidIds:
+            raise ValueError(f"Shard ids {invalidIds} are outside of [0, {shardCount}).")
+
+    @classmethod
+    def from_env(cls) -> 'ShardPlan':
+        shardCount = int(os.getenv('SHARD_COUNT', 1))
+        shardIds = os.getenv('SHARD_IDS')
+        if not shardIds:
+            return cls(shardCount)
+        return cls(shardCount, [int(shardId) for shardId in shardIds.split(',')])
+
+    @property
+    def sharded(self) -> bool:
+        return self.shardCount > 1
+
+    @property
+    def tag(self) -> str:
+        # Names per-process state such as snapshots and job checkpoints, empty when not sharded
+        return f'shards-{"-".join(str(shardId) for shardId in self.shardIds)}' if self.sharded else ''
+
+    def shard_for(self, snowflake: int) -> int:
+        # Same formula the gateway uses to route a guild's events to a shard
+        return (int(snowflake) >> 22) % self.shardCount
+
+    def owns_guild(self, guildId: int) -> bool:
+        return self.shard_for(guildId) in self.shardIds
+
+    def owns_user(self, userId: int) -> bool:
+        # Users span guilds on different shards, so each user row is maintained by exactly one shard
+        return self.shard_for(userId) in self.shardIds
+
+    def split(self, processCount: int) -> List['ShardPlan']:
+        processCount = max(1, min(processCount, len(self.shardIds)))
+        return [ShardPlan(self.shardCount, self.shardIds[index::processCount]) for index in range(processCount)]
+
+    def __repr__(self) -> str:
+        return f'ShardPlan(shardCount={self.shardCount}, shardIds={self.shardIds})'
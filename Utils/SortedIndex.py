@@ -0,0 +1,45 @@
+import bisect
+from typing import Dict, List, Optional, Tuple
+
+
+class SortedIndex:
+    # Kept ordered by (-score, userId) so the highest scores come first
+    keys: List[Tuple[int, int]]
+    scores: Dict[int, int]
+
+    def __init__(self):
+        self.keys = []
+        self.scores = {}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def update(self, userId: int, score: int):
+        oldScore = self.scores.get(userId)
+        if oldScore == score:
+            return
+
+        if oldScore is not None:
+            del self.keys[bisect.bisect_left(self.keys, (-oldScore, userId))]
+
+        bisect.insort(self.keys, (-score, userId))
+        self.scores[userId] = score
+
+    def remove(self, userId: int):
+        oldScore = self.scores.pop(userId, None)
+        if oldScore is not None:
+            del self.keys[bisect.bisect_left(self.keys, (-oldScore, userId))]
+
+    def top(self, count: int) -> List[Tuple[int, int]]:
+        return [(userId, -negScore) for negScore, userId in self.keys[:count]]
+
+    def rank(self, userId: int) -> Optional[int]:
+        score = self.scores.get(userId)
+        if score is None:
+            return None
+
+        # Users with the same score share a rank
+        return bisect.bisect_left(self.keys, (-score, -1)) + 1
+
+    def get_score(self, userId: int) -> Optional[int]:
+        return self.scores.get(userId)
@@ -0,0 +1,276 @@
+import asyncio
+import base64
+import datetime
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple, TypeVar
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from .CacheSnapshot import CacheSnapshot
+from .TableBackend import StorageSession, TableBackend, ETAG_COLUMN
+
+T = TypeVar('T')
+
+# Matches the "<column> <op> @<parameter>" clauses TableCache builds
+FILTER_CLAUSE = re.compile(r"(\w+)\s+(eq|ne|gt|ge|lt|le)\s+@(\w+)")
+FILTER_OPS = {'eq': '=', 'ne': '!=', 'gt': '>', 'ge': '>=', 'lt': '<', 'le': '<='}
+FILTER_KEYWORDS = re.compile(r"\b(and|or|not)\b")
+COLUMN_NAME = re.compile(r"\w+")
+# Columns stored outside of the JSON document
+KEY_COLUMNS = ('PartitionKey', 'RowKey', 'Timestamp')
+
+# Timestamps always move forward, so each write gets a distinct ETag even within one clock tick
+NEXT_TIMESTAMP = "max(excluded.Timestamp, entities.Timestamp + 0.000001)"
+INSERT_SQL = "INSERT INTO entities (tableName, PartitionKey, RowKey, Timestamp, data) VALUES (?, ?, ?, ?, ?) "
+UPSERT_SQL = (INSERT_SQL + "ON CONFLICT (tableName, PartitionKey, RowKey) "
+              # Merge semantics like Azure: columns missing from the update keep their stored value
+              f"DO UPDATE SET data = json_patch(data, excluded.data), Timestamp = {NEXT_TIMESTAMP} "
+              "RETURNING Timestamp")
+CREATE_SQL = INSERT_SQL + "ON CONFLICT DO NOTHING RETURNING Timestamp"
+UPDATE_SQL = ("UPDATE entities SET data = json_patch(data, ?), Timestamp = max(?, Timestamp + 0.000001) "
+              "WHERE tableName = ? AND PartitionKey = ? AND RowKey = ? AND Timestamp = ? RETURNING Timestamp")
+GET_SQL = "SELECT data, Timestamp FROM entities WHERE tableName = ? AND PartitionKey = ? AND RowKey = ?"
+EXISTS_SQL = "SELECT 1 FROM entities WHERE tableName = ? AND PartitionKey = ? AND RowKey = ?"
+
+
+def encode_value(value: Any) -> Any:
+    if isinstance(value, (bytes, bytearray)):
+        return {"$binary": base64.b64encode(value).decode('ascii')}
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def encode_etag(timestamp: float) -> str:
+    return f'W/"{timestamp!r}"'
+
+
+def decode_etag(etag: str) -> float:
+    try:
+        return float(etag[3:-1])
+    except (TypeError, ValueError):
+        # Never matches a stored row, so the update fails as modified
+        return -1.0
+
+
+def decode_object(obj: Dict[str, Any]) -> Any:
+    if len(obj) == 1 and "$binary" in obj:
+        return base64.b64decode(obj["$binary"])
+    return obj
+
+
+def encode_parameter(column: str, value: Any) -> Any:
+    if column == 'Timestamp' and isinstance(value, datetime.datetime):
+        return value.timestamp()
+    return encode_value(value)
+
+
+def translate_filter(queryFilter: str, parameters: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    sqlParameters: Dict[str, Any] = {}
+
+    def clause(match: re.Match) -> str:
+        column, op, name = match.groups()
+        if name not in parameters:
+            raise KeyError(f'Missing filter parameter [{name}].')
+        sqlParameters[name] = encode_parameter(column, parameters[name])
+        target = column if column in KEY_COLUMNS else f"json_extract(data, '$.{column}')"
+        return f'{target} {FILTER_OPS[op]} :{name}'
+
+    sql = FILTER_CLAUSE.sub(clause, queryFilter)
+    leftover = FILTER_KEYWORDS.sub('', FILTER_CLAUSE.sub('', queryFilter)).replace('(', '').replace(')', '')
+    if leftover.strip():
+        raise ValueError(f'Unsupported filter [{queryFilter}].')
+    return FILTER_KEYWORDS.sub(lambda match: match.group(1).upper(), sql), sqlParameters
+
+
+def select_sql(select: List[str]) -> str:
+    # Builds the projected document in SQL, so unselected columns are never decoded
+    columns = [column for column in select if column not in KEY_COLUMNS]
+    for column in columns:
+        if not COLUMN_NAME.fullmatch(column):
+            raise ValueError(f'Unsupported column [{column}].')
+    if not columns:
+        return "'{}'"
+    pairs = ', '.join(f"'{column}', data -> '$.{column}'" for column in columns)
+    # Columns missing from the row come back as null, which entities read as missing
+    return f"json_object({pairs})"
+
+
+class SqliteTableBackend(TableBackend):
+    session: 'SqliteSession'
+
+    def __init__(self, tableName: str, session: 'SqliteSession'):
+        self.tableName = tableName
+        self.session = session
+
+    async def create_table(self):
+        await self.session.run(self._create_table)
+
+    async def get_entity(self, partitionKey: str, rowKey: str) -> Dict[str, Any]:
+        return await self.session.run(self._get_entity, partitionKey, rowKey)
+
+    async def upsert_entity(self, entity: Dict[str, Any]) -> Optional[str]:
+        return (await self.session.run(self._upsert, [self.to_row(entity)]))[0]
+
+    async def create_entity(self, entity: Dict[str, Any]) -> Optional[str]:
+        return await self.session.run(self._create, self.to_row(entity))
+
+    async def update_entity(self, entity: Dict[str, Any], etag: str) -> Optional[str]:
+        return await self.session.run(self._update, self.to_row(entity), decode_etag(etag))
+
+    async def submit_batch(self, entities: List[Dict[str, Any]],
+                           etags: Optional[List[Optional[str]]] = None) -> List[Optional[str]]:
+        rows = [self.to_row(entity) for entity in entities]
+        if etags is None:
+            return await self.session.run(self._upsert, rows)
+        return await self.session.run(self._update_batch, rows,
+                                      [decode_etag(etag) if etag is not None else None for etag in etags])
+
+    async def query_entities(self, queryFilter: str, parameters: Dict[str, Any], pageSize: int,
+                             select: Optional[List[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+        whereSql, sqlParameters = translate_filter(queryFilter, parameters)
+        dataSql = "data" if select is None else select_sql(select)
+        # Keyset paging keeps each page a short read instead of one long-lived cursor
+        sql = (f"SELECT PartitionKey, RowKey, {dataSql}, Timestamp FROM entities "
+               f"WHERE tableName = :_table AND ({whereSql}) AND (PartitionKey, RowKey) > (:_afterPartition, :_afterRow) "
+               "ORDER BY PartitionKey, RowKey LIMIT :_limit")
+        after = ('', '')
+        while True:
+            page = await self.session.run(self._query, sql, {**sqlParameters, "_table": self.tableName,
+                                                             "_afterPartition": after[0], "_afterRow": after[1],
+                                                             "_limit": pageSize})
+            for entity in page:
+                yield entity
+            if len(page) < pageSize:
+                return
+            after = (page[-1]['PartitionKey'], page[-1]['RowKey'])
+
+    async def close(self):
+        pass
+
+    def to_row(self, entity: Dict[str, Any]) -> Tuple[str, str, str, float, str]:
+        data = {column: encode_value(value) for column, value in entity.items()
+                if column not in KEY_COLUMNS and column != ETAG_COLUMN}
+        return (self.tableName, str(entity['PartitionKey']), str(entity['RowKey']), time.time(),
+                json.dumps(data, separators=(',', ':')))
+
+    def _create_table(self, connection: sqlite3.Connection):
+        with connection:
+            if connection.execute("INSERT OR IGNORE INTO tables (tableName) VALUES (?)", (self.tableName,)).rowcount == 0:
+                raise ResourceExistsError(f'Table [{self.tableName}] already exists.')
+
+    def _get_entity(self, connection: sqlite3.Connection, partitionKey: str, rowKey: str) -> Dict[str, Any]:
+        row = connection.execute(GET_SQL, (self.tableName, partitionKey, rowKey)).fetchone()
+        if row is None:
+            raise ResourceNotFoundError(f'Row [{rowKey}] not found in [{self.tableName}].')
+        return self.from_row(partitionKey, rowKey, *row)
+
+    def _upsert(self, connection: sqlite3.Connection,
+                rows: List[Tuple[str, str, str, float, str]]) -> List[Optional[str]]:
+        with connection:
+            return [encode_etag(connection.execute(UPSERT_SQL, row).fetchone()[0]) for row in rows]
+
+    def _create(self, connection: sqlite3.Connection, row: Tuple[str, str, str, float, str]) -> str:
+        with connection:
+            created = connection.execute(CREATE_SQL, row).fetchone()
+        if created is None:
+            raise ResourceExistsError(f'Row [{row[2]}] already exists in [{self.tableName}].')
+        return encode_etag(created[0])
+
+    def _update(self, connection: sqlite3.Connection, row: Tuple[str, str, str, float, str], timestamp: float) -> str:
+        tableName, partitionKey, rowKey, now, data = row
+        with connection:
+            updated = connection.execute(UPDATE_SQL, (data, now, tableName, partitionKey, rowKey, timestamp)).fetchone()
+        if updated is not None:
+            return encode_etag(updated[0])
+        if connection.execute(EXISTS_SQL, (tableName, partitionKey, rowKey)).fetchone() is None:
+            raise ResourceNotFoundError(f'Row [{rowKey}] not found in [{self.tableName}].')
+        raise ResourceModifiedError(f'Row [{rowKey}] in [{self.tableName}] changed since it was read.')
+
+    def _update_batch(self, connection: sqlite3.Connection, rows: List[Tuple[str, str, str, float, str]],
+                      timestamps: List[Optional[float]]) -> List[Optional[str]]:
+        etags: List[Optional[str]] = []
+        # Rolled back as a whole when a row changed, like a failed Azure transaction
+        with connection:
+            for row, timestamp in zip(rows, timestamps):
+                tableName, partitionKey, rowKey, now, data = row
+                if timestamp is None:
+                    written = connection.execute(CREATE_SQL, row).fetchone()
+                else:
+                    written = connection.execute(UPDATE_SQL, (data, now, tableName, partitionKey, rowKey, timestamp)).fetchone()
+                if written is None:
+                    raise ResourceModifiedError(f'Row [{rowKey}] in [{self.tableName}] changed since it was read.')
+                etags.append(encode_etag(written[0]))
+        return etags
+
+    def _query(self, connection: sqlite3.Connection, sql: str, parameters: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [self.from_row(partitionKey, rowKey, data, timestamp)
+                for partitionKey, rowKey, data, timestamp in connection.execute(sql, parameters)]
+
+    def from_row(self, partitionKey: str, rowKey: str, data: str, timestamp: float) -> Dict[str, Any]:
+        return {"PartitionKey": partitionKey, "RowKey": rowKey, **json.loads(data, object_hook=decode_object),
+                ETAG_COLUMN: encode_etag(timestamp)}
+
+
+class SqliteSession(StorageSession):
+    # Number of compiled statements sqlite3 keeps around for reuse
+    STATEMENT_CACHE_SIZE = 256
+
+    path: str
+    connection: Optional[sqlite3.Connection]
+    lock: asyncio.Lock
+    logger: logging.Logger
+
+    def __init__(self, path: str, snapshotPath: Optional[str] = None):
+        self.path = path
+        self.connection = None
+        self.lock = asyncio.Lock()
+        self.cacheSnapshot = CacheSnapshot(snapshotPath) if snapshotPath else None
+
+        self.logger = logging.getLogger('discord.TableCache')
+
+    async def open(self):
+        self.connection = await asyncio.to_thread(self._open)
+        self.logger.info('Opened SQLite storage [%s].', self.path)
+
+        if self.cacheSnapshot is not None:
+            await self.cacheSnapshot.open()
+
+    async def close(self):
+        async with self.lock:
+            if self.connection is not None:
+                await asyncio.to_thread(self.connection.close)
+                self.connection = None
+
+        if self.cacheSnapshot is not None:
+            await self.cacheSnapshot.close()
+
+        self.logger.info('Closed SQLite storage.')
+
+    def get_table(self, tableName: str) -> SqliteTableBackend:
+        return SqliteTableBackend(tableName, self)
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        # One connection shared by every table, used from one worker thread at a time
+        async with self.lock:
+            if self.connection is None:
+                raise RuntimeError('SQLite storage is not open.')
+            return await asyncio.to_thread(func, self.connection, *args)
+
+    def _open(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        connection = sqlite3.connect(self.path, check_same_thread=False, cached_statements=self.STATEMENT_CACHE_SIZE)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS tables (tableName TEXT PRIMARY KEY)")
+        connection.execute("CREATE TABLE IF NOT EXISTS entities (tableName TEXT NOT NULL, PartitionKey TEXT NOT NULL, "
+                           "RowKey TEXT NOT NULL, Timestamp REAL NOT NULL, data TEXT NOT NULL, "
+                           "PRIMARY KEY (tableName, PartitionKey, RowKey)) WITHOUT ROWID")
+        connection.commit()
+        return connection
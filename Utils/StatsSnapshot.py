@@ -0,0 +1,197 @@
+import asyncio
+import datetime
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from Entities import UserEntity
+from .Leaderboard import to_ordinal
+
+# Lower bounds of the current streak histogram buckets
+STREAK_BUCKETS = (1, 2, 3, 7, 14, 30, 60, 100)
+PERCENTILES = (50, 90, 99)
+
+
+class ServerStats:
+    trackedUsers: int
+    memberCount: int
+    easy: int
+    medium: int
+    hard: int
+    completedToday: int
+    activeThisWeek: int
+    longestStreak: int
+    streakHistogram: List[Tuple[str, int]]
+    solvePercentiles: Dict[int, float]
+    streakPercentiles: Dict[int, float]
+
+    def __init__(self):
+        self.trackedUsers = 0
+        self.memberCount = 0
+        self.easy = 0
+        self.medium = 0
+        self.hard = 0
+        self.completedToday = 0
+        self.activeThisWeek = 0
+        self.longestStreak = 0
+        self.streakHistogram = []
+        self.solvePercentiles = {}
+        self.streakPercentiles = {}
+
+    @property
+    def solves(self) -> int:
+        return self.easy + self.medium + self.hard
+
+    @property
+    def participationRate(self) -> float:
+        # Share of the server's members who completed the current question
+        return self.completedToday / self.memberCount if self.memberCount else 0.0
+
+
+class StatsSnapshot:
+    # UserEntity fields the snapshot is exported from
+    FIELDS = ('numEasy', 'numMedium', 'numHard', 'longestStreak', 'currStreakStartDate', 'lastCompletedDate')
+    COLUMNS = ('userIds', 'numEasy', 'numMedium', 'numHard', 'longestStreak', 'streakStart', 'lastCompleted')
+
+    # Sorted, so a guild's rows are found with a binary search
+    userIds: np.ndarray
+    numEasy: np.ndarray
+    numMedium: np.ndarray
+    numHard: np.ndarray
+    longestStreak: np.ndarray
+    # Dates as proleptic ordinals, 0 when unset
+    streakStart: np.ndarray
+    lastCompleted: np.ndarray
+    createdAt: float
+    # Users first seen after the export, merged into the columns on the next read
+    newRows: Dict[int, Tuple[int, ...]]
+
+    def __init__(self, columns: Dict[str, np.ndarray], createdAt: float):
+        self.createdAt = createdAt
+        self.newRows = {}
+        self.set_columns(columns)
+
+    def set_columns(self, columns: Dict[str, np.ndarray]):
+        order = np.argsort(columns['userIds'], kind='stable')
+        self.userIds = columns['userIds'].astype(np.uint64)[order]
+        for name in self.COLUMNS[1:]:
+            setattr(self, name, columns[name].astype(np.int32)[order])
+
+    def __len__(self) -> int:
+        return len(self.userIds) + len(self.newRows)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in self.COLUMNS)
+
+    @staticmethod
+    def to_row(userEntity: UserEntity) -> Tuple[int, ...]:
+        return (int(userEntity.RowKey), userEntity.numEasy, userEntity.numMedium, userEntity.numHard,
+                userEntity.longestStreak, to_ordinal(userEntity.currStreakStartDate),
+                to_ordinal(userEntity.lastCompletedDate))
+
+    @classmethod
+    def from_entities(cls, userEntities: Iterable[UserEntity]) -> 'StatsSnapshot':
+        rows = [cls.to_row(userEntity) for userEntity in userEntities]
+        table = np.array(rows, dtype=np.int64).reshape(len(rows), len(cls.COLUMNS))
+        return cls({name: table[:, index] for index, name in enumerate(cls.COLUMNS)}, time.time())
+
+    @classmethod
+    async def load(cls, path: str) -> Optional['StatsSnapshot']:
+        if not os.path.exists(path):
+            return None
+        return await asyncio.to_thread(cls._load, path)
+
+    async def save(self, path: str):
+        self.merge_new_rows()
+        columns = {name: getattr(self, name) for name in self.COLUMNS}
+        await asyncio.to_thread(self._save, path, columns, self.createdAt)
+
+    @classmethod
+    def _load(cls, path: str) -> 'StatsSnapshot':
+        with np.load(path) as data:
+            return cls({name: data[name] for name in cls.COLUMNS}, float(data['createdAt']))
+
+    @staticmethod
+    def _save(path: str, columns: Dict[str, np.ndarray], createdAt: float):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Written aside and swapped in, so a crash never leaves a half written snapshot
+        tempPath = f'{path}.tmp'
+        arrays: Dict[str, Any] = dict(columns, createdAt=np.float64(createdAt))
+        with open(tempPath, 'wb') as file:
+            np.savez_compressed(file, **arrays)
+        os.replace(tempPath, path)
+
+    def update_user(self, userEntity: UserEntity):
+        # Keeps the snapshot current between exports, completions only touch one row
+        row = self.to_row(userEntity)
+        position = int(np.searchsorted(self.userIds, row[0]))
+        if position < len(self.userIds) and self.userIds[position] == row[0]:
+            for name, value in zip(self.COLUMNS[1:], row[1:]):
+                getattr(self, name)[position] = value
+        else:
+            self.newRows[row[0]] = row
+
+    def merge_new_rows(self):
+        if not self.newRows:
+            return
+
+        table = np.array(list(self.newRows.values()), dtype=np.int64)
+        self.set_columns({name: np.concatenate((getattr(self, name), table[:, index]))
+                          for index, name in enumerate(self.COLUMNS)})
+        self.newRows = {}
+
+    def rows_for(self, userIds: Iterable[int]) -> np.ndarray:
+        self.merge_new_rows()
+        userIds = np.fromiter(userIds, dtype=np.uint64)
+        positions = np.searchsorted(self.userIds, userIds)
+        inRange = positions < len(self.userIds)
+        positions = positions[inRange]
+        return positions[self.userIds[positions] == userIds[inRange]]
+
+    def server_stats(self, userIds: Iterable[int], releaseDate: datetime.date, memberCount: int = 0) -> ServerStats:
+        rows = self.rows_for(userIds)
+        stats = ServerStats()
+        stats.trackedUsers = len(rows)
+        stats.memberCount = memberCount
+        if not len(rows):
+            return stats
+
+        numEasy = self.numEasy[rows]
+        numMedium = self.numMedium[rows]
+        numHard = self.numHard[rows]
+        streakStart = self.streakStart[rows]
+        lastCompleted = self.lastCompleted[rows]
+        releaseOrdinal = releaseDate.toordinal()
+
+        stats.easy = int(numEasy.sum())
+        stats.medium = int(numMedium.sum())
+        stats.hard = int(numHard.sum())
+        # A later release completed in a guild that posts earlier in the day covers this one too
+        stats.completedToday = int(np.count_nonzero(lastCompleted >= releaseOrdinal))
+        stats.activeThisWeek = int(np.count_nonzero(lastCompleted >= releaseOrdinal - 6))
+        stats.longestStreak = int(self.longestStreak[rows].max())
+
+        # Same rule as UserEntity.is_streak_alive, a streak survives until a full release is missed
+        alive = (streakStart > 0) & (lastCompleted >= releaseOrdinal - 1)
+        currentStreaks = np.where(alive, lastCompleted - streakStart + 1, 0)
+        streaking = currentStreaks[currentStreaks > 0]
+        buckets = np.bincount(np.searchsorted(STREAK_BUCKETS, streaking, side='right') - 1,
+                              minlength=len(STREAK_BUCKETS))
+        stats.streakHistogram = [(self.bucket_label(index), int(count)) for index, count in enumerate(buckets)]
+
+        solves = numEasy + numMedium + numHard
+        stats.solvePercentiles = dict(zip(PERCENTILES, np.percentile(solves, PERCENTILES).tolist()))
+        stats.streakPercentiles = dict(zip(PERCENTILES, np.percentile(currentStreaks, PERCENTILES).tolist()))
+        return stats
+
+    @staticmethod
+    def bucket_label(index: int) -> str:
+        lower = STREAK_BUCKETS[index]
+        if index + 1 == len(STREAK_BUCKETS):
+            return f'{lower}+'
+        upper = STREAK_BUCKETS[index + 1] - 1
+        return f'{lower}' if upper == lower else f'{lower}-{upper}'
@@ -0,0 +1,93 @@
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Dict, List, Optional
+from .CacheSnapshot import CacheSnapshot
+
+# Rows read from storage carry their ETag under this column, which entities ignore
+ETAG_COLUMN = 'odata.etag'
+
+
+def entity_size(entity: Dict[str, Any]) -> int:
+    # Rough size of the row in a transaction's JSON payload, binary columns are sent base64 encoded with a type tag
+    size = 0
+    for column, value in entity.items():
+        if isinstance(value, (bytes, bytearray)):
+            size += len(value) * 4 // 3 + len(column) + 32
+        elif isinstance(value, str):
+            size += len(value.encode('utf-8'))
+        else:
+            size += 32
+        size += len(column) + 8
+    return size
+
+# Rows are the plain dicts produced by BaseEntity.to_entity(), so entities work unchanged on any backend
+class TableBackend(ABC):
+    tableName: str
+
+    # Raises ResourceExistsError if the table already exists
+    @abstractmethod
+    async def create_table(self):
+        pass
+
+    # Raises ResourceNotFoundError if the row does not exist
+    @abstractmethod
+    async def get_entity(self, partitionKey: str, rowKey: str) -> Dict[str, Any]:
+        pass
+
+    # Inserts the row or merges its columns into the stored row, returns the new ETag
+    @abstractmethod
+    async def upsert_entity(self, entity: Dict[str, Any]) -> Optional[str]:
+        pass
+
+    # Inserts a new row, returns its ETag. Raises ResourceExistsError if the row already exists
+    @abstractmethod
+    async def create_entity(self, entity: Dict[str, Any]) -> Optional[str]:
+        pass
+
+    # Merges columns into the row only if it still has the given ETag, returns the new ETag.
+    # Raises ResourceModifiedError if the row changed since it was read
+    @abstractmethod
+    async def update_entity(self, entity: Dict[str, Any], etag: str) -> Optional[str]:
+        pass
+
+    # Upserts rows of a single partition atomically, returns the new ETag of each row.
+    # With etags, each row is only merged if it still has its ETag, or created if its ETag is None,
+    # and the whole batch fails if any row changed since it was read
+    @abstractmethod
+    async def submit_batch(self, entities: List[Dict[str, Any]],
+                           etags: Optional[List[Optional[str]]] = None) -> List[Optional[str]]:
+        pass
+
+    # Filters are "<column> <op> @<parameter>" clauses joined with and/or, as understood by Azure Tables.
+    # select limits the columns returned, columns a row does not have come back missing or as None
+    @abstractmethod
+    def query_entities(self, queryFilter: str, parameters: Dict[str, Any], pageSize: int,
+                       select: Optional[List[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    async def close(self):
+        pass
+
+
+class StorageSession(ABC):
+    cacheSnapshot: Optional[CacheSnapshot]
+
+    async def __aenter__(self) -> 'StorageSession':
+        await self.open()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    @abstractmethod
+    async def open(self):
+        pass
+
+    @abstractmethod
+    async def close(self):
+        pass
+
+    # Handing out a table must not need a round-trip, tables are created lazily by TableCache
+    @abstractmethod
+    def get_table(self, tableName: str) -> TableBackend:
+        pass
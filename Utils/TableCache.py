@@ -1,9 +1,17 @@
+import asyncio
+import copy
+import datetime
 import logging
+import random
 import time
-from typing import Type, TypeVar, Generic, Optional, Dict, Any
-from azure.data.tables import TableServiceClient, UpdateMode, TableClient
-from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from typing import Type, TypeVar, Generic, Optional, Dict, Any, List, Callable, Iterable, Tuple
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
 from Entities import BaseEntity
+from .TableBackend import TableBackend, StorageSession, ETAG_COLUMN, entity_size
+from .LocalCache import LocalCache
+from .CacheSnapshot import CacheSnapshot
+from .WriteBehindBuffer import WriteBehindBuffer
+from . import Metrics
 
 E = TypeVar('E', bound='BaseEntity')
 
@@ -11,87 +19,423 @@ E = TypeVar('E', bound='BaseEntity')
 class TableCache(Generic[E]):
     # Cache TTL in seconds
     CACHE_TTL = 3600
+    # TTL in seconds for rows known to be missing from the table
+    NEGATIVE_CACHE_TTL = 300
+    # Max number of rows kept in the local cache before evicting the least recently used
+    CACHE_MAX_SIZE = 50000
+    # Seconds between background sweeps of expired local cache entries
+    SWEEP_INTERVAL = 300
+    # Max number of operations Azure allows in a single transaction
+    TRANSACTION_SIZE = 100
+    # Payload bytes a transaction is kept under, Azure rejects transactions over 4 MiB including the request envelope
+    TRANSACTION_BYTES = 3 * 1024 * 1024
+    # Envelope bytes each operation adds to a transaction
+    OPERATION_OVERHEAD = 512
+    # Number of rows requested per page when scanning a partition
+    PAGE_SIZE = 1000
+    # Seconds between snapshots of the local cache to disk
+    SNAPSHOT_INTERVAL = 600
+    # Seconds of clock skew tolerated between this host and storage when looking for changed rows
+    CLOCK_SKEW = 60
+    # Attempts at a conditional update before giving up on a row that keeps changing underneath us
+    MAX_CONFLICT_RETRIES = 5
+    # Max seconds of jittered backoff per attempt, so racing writers stop retrying in lockstep
+    CONFLICT_BACKOFF = 0.05
 
     tableName: str
-    tableServiceClient: Optional[TableServiceClient]
-    tableClient: Optional[TableClient]
-    localCache: Dict[str, Any]
+    table: Optional[TableBackend]
+    localCache: LocalCache
+    sweepTask: Optional[asyncio.Task]
+    cacheSnapshot: Optional[CacheSnapshot]
+    snapshotTask: Optional[asyncio.Task]
+    revalidateTask: Optional[asyncio.Task]
+    pollInterval: float
+    pollTask: Optional[asyncio.Task]
+    onChange: Optional[Callable[[Dict[str, E]], None]]
+    writeBuffer: Optional[WriteBehindBuffer[E]]
     entityType: Type[E]
     logger: logging.Logger
 
-    def __init__(self, entityType: Type[E]):
+    def __init__(self, entityType: Type[E], maxSize: int = CACHE_MAX_SIZE, writeBehind: bool = False,
+                 pollInterval: float = 0, onChange: Optional[Callable[[Dict[str, E]], None]] = None):
         self.tableName = entityType.get_partition_key()
-        self.tableServiceClient = None
-        self.tableClient = None
+        self.table = None
 
-        self.localCache = {}
+        self.localCache = LocalCache(maxSize, self.CACHE_TTL, self.NEGATIVE_CACHE_TTL)
+        self.sweepTask = None
+
+        self.cacheSnapshot = None
+        self.snapshotTask = None
+        self.revalidateTask = None
+
+        # Other instances' writes are picked up by polling for changed rows, 0 trusts the local cache for its TTL
+        self.pollInterval = pollInterval
+        self.pollTask = None
+        # Called with the rows each poll found changed, so owners can react to other instances' writes
+        self.onChange = onChange
+
+        # In write-behind mode saves only mark rows dirty and are flushed as batch transactions
+        self.writeBuffer = WriteBehindBuffer(self.tableName, self.write_batches) if writeBehind else None
 
         self.entityType = entityType
 
         self.logger = logging.getLogger('discord.TableCache')
 
-    def initialize_table(self, connectionString: str):
+    async def initialize_table(self, tableSession: StorageSession):
+        self.table = tableSession.get_table(self.tableName)
+        self.cacheSnapshot = tableSession.cacheSnapshot
+        # Created before the first read or write, which would otherwise race it on fresh storage
         try:
-            self.tableServiceClient = TableServiceClient.from_connection_string(conn_str=connectionString)
-            self.tableClient = self.tableServiceClient.create_table(table_name=self.tableName)
-            self.logger.info(f'Created [{self.tableName}] table.')
-        except ResourceExistsError:
-            self.tableClient = self.tableServiceClient.get_table_client(table_name=self.tableName)
-            self.logger.info(f'Connected to [{self.tableName}] table.')
+            await self.create_table()
         except Exception as e:
-            # Log an error message if something goes wrong
-            self.logger.error(f"Failed to initialize [{self.tableName}]: {e}", exc_info=True)
+            self.logger.error('Failed to initialize [%s]: %s', self.tableName, e, exc_info=True)
+
+        # Only revalidating the restored rows runs in the background
+        snapshotTime = await self.load_snapshot()
+        if snapshotTime is not None and self.revalidateTask is None:
+            self.revalidateTask = asyncio.create_task(self.revalidate(snapshotTime))
+
+        if self.sweepTask is None:
+            self.sweepTask = asyncio.create_task(self.sweep_local_cache())
+
+        if self.cacheSnapshot is not None and self.snapshotTask is None:
+            self.snapshotTask = asyncio.create_task(self.snapshot_loop())
+
+        if self.pollInterval > 0 and self.pollTask is None:
+            self.pollTask = asyncio.create_task(self.poll_changes())
+
+        if self.writeBuffer is not None:
+            self.writeBuffer.start()
+
+    async def close(self):
+        for task in (self.sweepTask, self.snapshotTask, self.revalidateTask, self.pollTask):
+            if task is not None:
+                task.cancel()
+        self.sweepTask = None
+        self.snapshotTask = None
+        self.revalidateTask = None
+        self.pollTask = None
+
+        if self.writeBuffer is not None:
+            await self.writeBuffer.close()
+
+        await self.save_snapshot()
+
+        if self.table is not None:
+            await self.table.close()
+            self.table = None
+
+    async def save_entity(self, obj: E):
+        if self.writeBuffer is not None:
+            self.save_to_local_cache(obj)
+            self.writeBuffer.add(obj)
+            return
 
-    def save_entity(self, obj: E):
         try:
-            self.logger.debug(f'Trying to save entity to table [{self.tableName}]')
-            self.tableClient.upsert_entity(mode=UpdateMode.MERGE, entity=obj.to_entity())
-            self.logger.info(f'Successfully saved entity to table [{self.tableName}]')
+            self.logger.debug('Trying to save entity to table [%s]', self.tableName)
+            with Metrics.track(Metrics.TABLE_OPERATION_SECONDS, table=self.tableName, operation='upsert_entity'):
+                obj.etag = await self.table.upsert_entity(obj.to_entity())
+            self.logger.debug('Successfully saved entity to table [%s]', self.tableName)
 
             self.save_to_local_cache(obj)
         except Exception as e:
-            self.logger.error(f"Error saving to table [{self.tableName}]: {e}")
+            self.logger.error('Error saving to table [%s]: %s', self.tableName, e)
+
+    async def mutate_entity(self, rowKey: Any, mutate: Callable[[E], bool],
+                            create: Optional[Callable[[], E]] = None) -> Optional[E]:
+        # Read-modify-write guarded by the row's ETag, so concurrent instances never overwrite each other.
+        # mutate edits the row in place and returns False when there is nothing to save.
+        # Without create, a missing row is left missing
+        if self.writeBuffer is not None:
+            # Buffered rows are flushed unconditionally, so this is only safe when one instance owns the row
+            obj = await self.load_entity(rowKey)
+            if obj is None and create is not None:
+                obj = create()
+            if obj is None or not mutate(obj):
+                return None
+            await self.save_entity(obj)
+            return obj
+
+        bypassCache = False
+        for attempt in range(1, self.MAX_CONFLICT_RETRIES + 1):
+            current = await self.load_entity(rowKey, bypassCache)
+            if current is not None:
+                # The cached copy is only replaced once the write succeeds
+                obj = copy.copy(current)
+            elif create is not None:
+                obj = create()
+            else:
+                return None
+            if not mutate(obj):
+                return None
+
+            try:
+                if obj.etag is None:
+                    with Metrics.track(Metrics.TABLE_OPERATION_SECONDS, table=self.tableName, operation='create_entity'):
+                        obj.etag = await self.table.create_entity(obj.to_entity())
+                else:
+                    with Metrics.track(Metrics.TABLE_OPERATION_SECONDS, table=self.tableName, operation='update_entity'):
+                        obj.etag = await self.table.update_entity(obj.to_entity(), obj.etag)
+            except (ResourceModifiedError, ResourceExistsError, ResourceNotFoundError) as e:
+                # Another instance wrote the row since we read it, re-read it from storage and apply the change again
+                Metrics.TABLE_CONFLICTS.labels(table=self.tableName).inc()
+                self.logger.info('Row [%s] in [%s] changed concurrently on attempt [%s]: %s',
+                                 rowKey, self.tableName, attempt, e)
+                bypassCache = True
+                await asyncio.sleep(random.uniform(0, self.CONFLICT_BACKOFF * attempt))
+                continue
+            except Exception as e:
+                self.logger.error('Error saving row [%s] to table [%s]: %s', rowKey, self.tableName, e)
+                return None
+
+            self.save_to_local_cache(obj)
+            return obj
+
+        self.logger.error('Gave up saving row [%s] to [%s] after [%s] conflicting writes.',
+                          rowKey, self.tableName, self.MAX_CONFLICT_RETRIES)
+        return None
+
+    async def load_entity(self, rowKey: any, bypassCache = False) -> Optional[E]:
+        if self.writeBuffer is not None:
+            # Rows waiting to be flushed are newer than anything in storage
+            pendingEntity = self.writeBuffer.get(str(rowKey))
+            if pendingEntity is not None:
+                Metrics.TABLE_CACHE_LOOKUPS.labels(table=self.tableName, outcome='pending').inc()
+                return pendingEntity
 
-    def load_entity(self, rowKey: any, bypassCache = False) -> Optional[E]:
         if not(bypassCache):
-            localEntity = self.load_from_local_cache(str(rowKey))
-            if localEntity is not None:
-                self.logger.info(f'Found row [{rowKey}] in local [{self.tableName}] cache!')
+            localEntity = self.localCache.get(str(rowKey))
+            if localEntity is LocalCache.MISSING:
+                Metrics.TABLE_CACHE_LOOKUPS.labels(table=self.tableName, outcome='negative_hit').inc()
+                self.logger.debug('Row [%s] is known to be missing from [%s].', rowKey, self.tableName)
+                return None
+            elif localEntity is not None:
+                Metrics.TABLE_CACHE_LOOKUPS.labels(table=self.tableName, outcome='hit').inc()
+                self.logger.debug('Found row [%s] in local [%s] cache!', rowKey, self.tableName)
                 return localEntity
             else:
-                self.logger.info(f'Row [{rowKey}] not found in local [{self.tableName}] cache!')
+                Metrics.TABLE_CACHE_LOOKUPS.labels(table=self.tableName, outcome='miss').inc()
+                self.logger.debug('Row [%s] not found in local [%s] cache!', rowKey, self.tableName)
 
         try:
-            self.logger.debug(f'Trying to pull from [{self.tableName}] cache.')
-            data = self.tableClient.get_entity(partition_key=self.tableName, row_key=str(rowKey))
-            self.logger.info(f'Found row [{rowKey}] in [{self.tableName}] cache!')
+            self.logger.debug('Trying to pull from [%s] cache.', self.tableName)
+            with Metrics.track(Metrics.TABLE_OPERATION_SECONDS, table=self.tableName, operation='get_entity'):
+                data = await self.table.get_entity(self.tableName, str(rowKey))
+            self.logger.info('Found row [%s] in [%s] cache!', rowKey, self.tableName)
 
-            entity = self.entityType.from_entity(data)
+            entity = self.from_row(data)
             self.save_to_local_cache(entity)
             return entity
         except ResourceNotFoundError:
-            self.logger.info(f'Row [{rowKey}] does not exit in [{self.tableName}].')
+            self.logger.info('Row [%s] does not exit in [%s].', rowKey, self.tableName)
+            self.localCache.set_missing(str(rowKey))
             return None
         except Exception as e:
             # Log an error message if something goes wrong
-            self.logger.error(f"Failed to pull [{self.tableName}] for row [{rowKey}]: {e}", exc_info=True)
+            self.logger.error('Failed to pull [%s] for row [%s]: %s', self.tableName, rowKey, e, exc_info=True)
             return None
 
-    def save_to_local_cache(self, obj: E):
-        self.logger.debug('Saving to local cache.')
-        expirationTime = time.time() + self.CACHE_TTL
-        self.localCache[str(obj.RowKey)] = {"data": obj, "expiry": expirationTime}
+    async def save_entities(self, objs: List[E]) -> int:
+        failed = await self.write_batches(objs)
+        if self.writeBuffer is not None:
+            failedKeys = {str(obj.RowKey) for obj in failed}
+            for obj in objs:
+                if str(obj.RowKey) not in failedKeys:
+                    self.writeBuffer.discard(obj)
+
+        return len(objs) - len(failed)
+
+    async def update_entities(self, objs: List[E], mutate: Callable[[E], bool]) -> int:
+        # Writes back rows already changed by mutate, only where storage still has the version they were read at.
+        # Rows that changed meanwhile, e.g. through a live reaction, get mutate applied again to a fresh copy
+        if self.writeBuffer is not None:
+            # Rows are only written by this instance, and the buffer holds the copies reactions edit
+            return await self.save_entities(objs)
+
+        failed = await self.write_batches(objs, conditional=True)
+        if failed:
+            self.logger.info('Re-applying [%s] rows of [%s] that changed since they were read.', len(failed), self.tableName)
+        savedCount = len(objs) - len(failed)
+        for obj in failed:
+            # The cached copy may be the one mutate already edited
+            self.localCache.invalidate(str(obj.RowKey))
+            if await self.mutate_entity(obj.RowKey, mutate) is not None:
+                savedCount += 1
+        return savedCount
+
+    async def write_batches(self, objs: List[E], conditional: bool = False) -> List[E]:
+        # Conditional batches only touch rows still at the ETag they were read with
+        # Transactions are scoped to one partition and may only touch each row once
+        partitions: Dict[str, Dict[str, E]] = {}
+        for obj in objs:
+            partitions.setdefault(obj.PartitionKey, {})[str(obj.RowKey)] = obj
 
-    def load_from_local_cache(self, rowKey: str) -> Optional[E]:
-        self.logger.debug('Loading from local cache.')
-        localEntity = self.localCache.get(rowKey, None)
+        failed: List[E] = []
+        for partitionKey, rows in partitions.items():
+            for batch, entities in self.split_batches(list(rows.values()), failed):
+                try:
+                    self.logger.debug('Trying to save batch of [%s] entities to table [%s]', len(batch), self.tableName)
+                    with Metrics.track(Metrics.TABLE_OPERATION_SECONDS, table=self.tableName, operation='submit_transaction'):
+                        etags = await self.table.submit_batch(entities, [obj.etag for obj in batch] if conditional else None)
+                    self.logger.info('Successfully saved batch of [%s] entities to table [%s]', len(batch), self.tableName)
 
-        if localEntity is None:
+                    for obj, etag in zip(batch, etags):
+                        obj.etag = etag
+                        if obj.selectedColumns is None:
+                            self.save_to_local_cache(obj)
+                        else:
+                            # The cached full row no longer matches storage
+                            self.localCache.invalidate(str(obj.RowKey))
+                except Exception as e:
+                    self.logger.error('Error saving batch to table [%s] partition [%s]: %s', self.tableName, partitionKey, e)
+                    failed.extend(batch)
+
+        return failed
+
+    def split_batches(self, objs: List[E], failed: List[E]) -> List[Tuple[List[E], List[Dict[str, Any]]]]:
+        # Batches are cut by operation count and by payload size, whichever limit is reached first
+        batches: List[Tuple[List[E], List[Dict[str, Any]]]] = []
+        batch: List[E] = []
+        entities: List[Dict[str, Any]] = []
+        batchBytes = 0
+        for obj in objs:
+            try:
+                entity = obj.to_entity()
+            except Exception as e:
+                # Only the row that cannot be stored fails, the rest of its batch is still written
+                self.logger.error('Error serializing row [%s] for table [%s]: %s', obj.RowKey, self.tableName, e)
+                failed.append(obj)
+                continue
+
+            size = entity_size(entity) + self.OPERATION_OVERHEAD
+            if batch and (len(batch) == self.TRANSACTION_SIZE or batchBytes + size > self.TRANSACTION_BYTES):
+                batches.append((batch, entities))
+                batch, entities, batchBytes = [], [], 0
+            batch.append(obj)
+            entities.append(entity)
+            batchBytes += size
+
+        if batch:
+            batches.append((batch, entities))
+        return batches
+
+    async def load_partition(self, queryFilter: Optional[str] = None,
+                             parameters: Optional[Dict[str, Any]] = None,
+                             select: Optional[Iterable[str]] = None) -> Dict[str, E]:
+        # select names the fields to read. Projected rows are not cached and only write back those fields
+        self.logger.debug('Trying to scan [%s] partition.', self.tableName)
+        entities: Dict[str, E] = {}
+        columns = self.entityType.get_columns(*select) if select is not None else None
+
+        partitionFilter = "PartitionKey eq @partitionKey"
+        if queryFilter is not None:
+            partitionFilter = f'{partitionFilter} and ({queryFilter})'
+        pages = self.table.query_entities(partitionFilter, {"partitionKey": self.tableName, **(parameters or {})},
+                                          self.PAGE_SIZE, sorted(columns) if columns is not None else None)
+        with Metrics.track(Metrics.TABLE_OPERATION_SECONDS, table=self.tableName, operation='query_entities'):
+            async for data in pages:
+                entity = self.from_row(data)
+                entity.selectedColumns = columns
+                if self.writeBuffer is not None:
+                    entity = self.writeBuffer.get(str(entity.RowKey)) or entity
+                entities[str(entity.RowKey)] = entity
+                if entity.selectedColumns is None:
+                    self.save_to_local_cache(entity)
+
+        if self.writeBuffer is not None and queryFilter is None:
+            # Rows created since the last flush are not in storage yet
+            for rowKey, pendingEntity in self.writeBuffer.dirty.items():
+                entities.setdefault(rowKey, pendingEntity)
+
+        self.logger.info('Loaded [%s] rows from [%s] partition.', len(entities), self.tableName)
+        return entities
+
+    async def create_table(self):
+        try:
+            await self.table.create_table()
+            self.logger.info('Created [%s] table.', self.tableName)
+        except ResourceExistsError:
+            self.logger.info('Connected to [%s] table.', self.tableName)
+
+    async def revalidate(self, snapshotTime: float):
+        try:
+            # Rows written since the snapshot, e.g. by another instance, replace the restored copies
+            changed = await self.load_changes(snapshotTime)
+            self.logger.info('Revalidated [%s] snapshot, [%s] rows changed since it was taken.', self.tableName, len(changed))
+        except Exception as e:
+            self.logger.error('Failed to revalidate [%s]: %s', self.tableName, e, exc_info=True)
+
+    async def load_changes(self, since: float) -> Dict[str, E]:
+        # Storage stamps every write, so the partition doubles as a change feed
+        sinceTime = datetime.datetime.fromtimestamp(since - self.CLOCK_SKEW, datetime.timezone.utc)
+        return await self.load_partition("Timestamp ge @since", {"since": sinceTime})
+
+    async def poll_changes(self):
+        since = time.time()
+        while True:
+            await asyncio.sleep(self.pollInterval)
+            pollTime = time.time()
+            try:
+                changed = await self.load_changes(since)
+                since = pollTime
+                self.logger.debug('Refreshed [%s] rows of local [%s] cache changed by other instances.',
+                                  len(changed), self.tableName)
+                if changed and self.onChange is not None:
+                    self.onChange(changed)
+            except Exception as e:
+                self.logger.error('Failed to poll [%s] for changes: %s', self.tableName, e, exc_info=True)
+
+    async def load_snapshot(self) -> Optional[float]:
+        if self.cacheSnapshot is None:
             return None
 
-        if localEntity["expiry"] < time.time():
-            self.logger.debug(f'Entry [{rowKey}] is expired in the local cache.')
-            del self.localCache[rowKey]
+        try:
+            startTime = time.perf_counter()
+            snapshotTime, rows = await self.cacheSnapshot.load(self.tableName)
+            for data in rows.values():
+                self.save_to_local_cache(self.from_row(data))
+            self.logger.info('Restored [%s] rows into local [%s] cache from snapshot in [%.1fms].',
+                             len(rows), self.tableName, (time.perf_counter() - startTime) * 1000)
+            return snapshotTime
+        except Exception as e:
+            self.logger.error('Failed to restore [%s] snapshot: %s', self.tableName, e, exc_info=True)
             return None
 
-        return localEntity["data"]
+    async def save_snapshot(self):
+        if self.cacheSnapshot is None:
+            return
+
+        try:
+            rows = {rowKey: {**entity.to_entity(), ETAG_COLUMN: entity.etag}
+                    for rowKey, entity in self.localCache.items().items()}
+            await self.cacheSnapshot.save(self.tableName, rows)
+            self.logger.debug('Saved [%s] rows from local [%s] cache to snapshot.', len(rows), self.tableName)
+        except Exception as e:
+            self.logger.error('Failed to snapshot [%s]: %s', self.tableName, e, exc_info=True)
+
+    async def snapshot_loop(self):
+        while True:
+            await asyncio.sleep(self.SNAPSHOT_INTERVAL)
+            await self.save_snapshot()
+
+    def from_row(self, data: Dict[str, Any]) -> E:
+        entity = self.entityType.from_entity(data)
+        entity.etag = data.get(ETAG_COLUMN)
+        return entity
+
+    def save_to_local_cache(self, obj: E):
+        self.logger.debug('Saving to local cache.')
+        self.localCache.set(str(obj.RowKey), obj)
+
+    async def sweep_local_cache(self):
+        while True:
+            await asyncio.sleep(self.SWEEP_INTERVAL)
+            expiredCount = self.localCache.sweep()
+            if expiredCount > 0:
+                self.logger.debug('Swept [%s] expired entries from local [%s] cache.', expiredCount, self.tableName)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {"table": self.tableName, **self.localCache.get_stats()}
+        if self.writeBuffer is not None:
+            stats.update(self.writeBuffer.get_stats())
+        return stats
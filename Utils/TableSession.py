@@ -0,0 +1,59 @@
+import logging
+from typing import Optional
+import aiohttp
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.data.tables.aio import TableServiceClient
+from .CacheSnapshot import CacheSnapshot
+from .TableBackend import StorageSession
+from .AzureTableBackend import AzureTableBackend
+
+
+class TableSession(StorageSession):
+    # Max number of pooled connections shared by every table client
+    POOL_SIZE = 100
+
+    connectionString: str
+    poolSize: int
+    httpSession: Optional[aiohttp.ClientSession]
+    tableServiceClient: Optional[TableServiceClient]
+    logger: logging.Logger
+
+    def __init__(self, connectionString: str, poolSize: int = POOL_SIZE, snapshotPath: Optional[str] = None):
+        self.connectionString = connectionString
+        self.poolSize = poolSize
+        self.httpSession = None
+        self.tableServiceClient = None
+        # Table caches persist their rows here so a restart can serve from memory right away
+        self.cacheSnapshot = CacheSnapshot(snapshotPath) if snapshotPath else None
+
+        self.logger = logging.getLogger('discord.TableCache')
+
+    async def open(self):
+        connector = aiohttp.TCPConnector(limit=self.poolSize, ttl_dns_cache=300)
+        self.httpSession = aiohttp.ClientSession(connector=connector)
+
+        # Table clients created from the service client share its transport, and so this session
+        transport = AioHttpTransport(session=self.httpSession, session_owner=False)
+        self.tableServiceClient = TableServiceClient.from_connection_string(conn_str=self.connectionString,
+                                                                            transport=transport)
+        self.logger.info('Opened table session with a pool of [%s] connections.', self.poolSize)
+
+        if self.cacheSnapshot is not None:
+            await self.cacheSnapshot.open()
+
+    async def close(self):
+        if self.tableServiceClient is not None:
+            await self.tableServiceClient.close()
+            self.tableServiceClient = None
+
+        if self.httpSession is not None:
+            await self.httpSession.close()
+            self.httpSession = None
+
+        if self.cacheSnapshot is not None:
+            await self.cacheSnapshot.close()
+
+        self.logger.info('Closed table session.')
+
+    def get_table(self, tableName: str) -> AzureTableBackend:
+        return AzureTableBackend(tableName, self.tableServiceClient.get_table_client(table_name=tableName))
@@ -0,0 +1,67 @@
+import math
+import time
+from typing import Dict, Hashable, List, Optional
+
+
+class TimingWheel:
+    # One slot per minute over a day, so every daily post time lands in its own slot
+    SLOT_SECONDS = 60.0
+    SLOT_COUNT = 1440
+
+    slotSeconds: float
+    slotCount: int
+    slots: List[Dict[Hashable, int]]
+    ticks: Dict[Hashable, int]
+    currentTick: int
+
+    def __init__(self, slotSeconds: float = SLOT_SECONDS, slotCount: int = SLOT_COUNT, now: Optional[float] = None):
+        self.slotSeconds = slotSeconds
+        self.slotCount = slotCount
+        # Each slot maps its keys to the absolute tick they are due at, keys a full turn or more ahead wait for later rounds
+        self.slots = [{} for _ in range(slotCount)]
+        self.ticks = {}
+        self.currentTick = self.tick_of(now if now is not None else time.time()) - 1
+
+    def __len__(self) -> int:
+        return len(self.ticks)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.ticks
+
+    def tick_of(self, when: float) -> int:
+        return math.floor(when / self.slotSeconds)
+
+    def schedule(self, key: Hashable, when: float):
+        self.cancel(key)
+        # Times that already passed fire on the next advance
+        tick = max(self.tick_of(when), self.currentTick + 1)
+        self.slots[tick % self.slotCount][key] = tick
+        self.ticks[key] = tick
+
+    def cancel(self, key: Hashable):
+        tick = self.ticks.pop(key, None)
+        if tick is not None:
+            del self.slots[tick % self.slotCount][key]
+
+    def advance(self, now: float) -> List[Hashable]:
+        nowTick = self.tick_of(now)
+        due = []
+        # After a long pause every slot is visited once rather than once per missed turn
+        for tick in range(self.currentTick + 1, min(nowTick, self.currentTick + self.slotCount) + 1):
+            slot = self.slots[tick % self.slotCount]
+            for key in [key for key, keyTick in slot.items() if keyTick <= nowTick]:
+                del slot[key]
+                del self.ticks[key]
+                due.append(key)
+        self.currentTick = max(self.currentTick, nowTick)
+        return due
+
+    def next_due(self) -> Optional[float]:
+        if not self.ticks:
+            return None
+
+        for tick in range(self.currentTick + 1, self.currentTick + 1 + self.slotCount):
+            if tick in self.slots[tick % self.slotCount].values():
+                return tick * self.slotSeconds
+        # Every key is at least a full turn away
+        return min(self.ticks.values()) * self.slotSeconds
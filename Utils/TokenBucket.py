@@ -0,0 +1,32 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    rate: float
+    capacity: float
+    tokens: float
+    lastRefill: float
+    lock: asyncio.Lock
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.lastRefill = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Waiters queue on the lock so tokens are handed out in arrival order
+        async with self.lock:
+            while True:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.lastRefill) * self.rate)
+        self.lastRefill = now
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Generic, List, Optional, TypeVar, Any, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from Entities import BaseEntity
+
+E = TypeVar('E', bound='BaseEntity')
+
+
+class WriteBehindBuffer(Generic[E]):
+    # Seconds between flushes when the size threshold is not reached
+    FLUSH_INTERVAL = 5.0
+    # Number of dirty rows that triggers an early flush
+    FLUSH_SIZE = 100
+
+    name: str
+    writeBatch: Callable[[List[E]], Awaitable[List[E]]]
+    flushInterval: float
+    flushSize: int
+    dirty: Dict[str, E]
+    flushLock: asyncio.Lock
+    flushNeeded: asyncio.Event
+    flushTask: Optional[asyncio.Task]
+    flushCount: int
+    flushedRows: int
+    lastFlushLatency: float
+    maxFlushLatency: float
+    totalFlushLatency: float
+    logger: logging.Logger
+
+    def __init__(self,
+                 name: str,
+                 writeBatch: Callable[[List[E]], Awaitable[List[E]]],
+                 flushInterval: float = FLUSH_INTERVAL,
+                 flushSize: int = FLUSH_SIZE):
+        self.name = name
+        self.writeBatch = writeBatch
+        self.flushInterval = flushInterval
+        self.flushSize = flushSize
+        self.dirty = {}
+        self.flushLock = asyncio.Lock()
+        self.flushNeeded = asyncio.Event()
+        self.flushTask = None
+
+        self.flushCount = 0
+        self.flushedRows = 0
+        self.lastFlushLatency = 0.0
+        self.maxFlushLatency = 0.0
+        self.totalFlushLatency = 0.0
+
+        self.logger = logging.getLogger('discord.TableCache')
+
+    def __len__(self) -> int:
+        return len(self.dirty)
+
+    def start(self):
+        if self.flushTask is None:
+            self.flushTask = asyncio.create_task(self.flush_loop())
+
+    async def close(self):
+        if self.flushTask is not None:
+            self.flushTask.cancel()
+            self.flushTask = None
+        await self.flush()
+
+    def add(self, obj: E):
+        # Later writes to the same row replace the pending one
+        self.dirty[str(obj.RowKey)] = obj
+        if len(self.dirty) >= self.flushSize:
+            self.flushNeeded.set()
+
+    def get(self, rowKey: str) -> Optional[E]:
+        return self.dirty.get(rowKey)
+
+    def discard(self, obj: E):
+        if self.dirty.get(str(obj.RowKey)) is obj:
+            del self.dirty[str(obj.RowKey)]
+
+    async def flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.flushNeeded.wait(), timeout=self.flushInterval)
+            except asyncio.TimeoutError:
+                pass
+            self.flushNeeded.clear()
+
+            try:
+                await self.flush()
+            except Exception as e:
+                self.logger.error('Failed to flush write-behind buffer for [%s]: %s', self.name, e, exc_info=True)
+
+    async def flush(self):
+        async with self.flushLock:
+            if not self.dirty:
+                return
+
+            pending = list(self.dirty.values())
+            self.dirty = {}
+
+            startTime = time.perf_counter()
+            failed = await self.writeBatch(pending)
+            latency = time.perf_counter() - startTime
+
+            # Requeue failed rows unless a newer write already replaced them
+            for obj in failed:
+                self.dirty.setdefault(str(obj.RowKey), obj)
+
+            self.flushCount += 1
+            self.flushedRows += len(pending) - len(failed)
+            self.lastFlushLatency = latency
+            self.maxFlushLatency = max(self.maxFlushLatency, latency)
+            self.totalFlushLatency += latency
+            self.logger.debug('Flushed [%s] of [%s] rows to [%s] in [%.0fms].',
+                              len(pending) - len(failed), len(pending), self.name, latency * 1000)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "queueDepth": len(self.dirty),
+            "flushes": self.flushCount,
+            "flushedRows": self.flushedRows,
+            "lastFlushMs": round(self.lastFlushLatency * 1000, 1),
+            "maxFlushMs": round(self.maxFlushLatency * 1000, 1),
+            "avgFlushMs": round(self.totalFlushLatency * 1000 / self.flushCount, 1) if self.flushCount else 0.0,
+        }
@@ -1,2 +1,22 @@
+from .CircuitBreaker import CircuitBreaker, CircuitOpenError
 from .LeetQuery import LeetQuery
 from .TableCache import TableCache
+from .TableSession import TableSession
+from .CacheSnapshot import CacheSnapshot
+from .TableBackend import TableBackend, StorageSession
+from .AzureTableBackend import AzureTableBackend
+from .SqliteSession import SqliteSession, SqliteTableBackend
+from .LocalCache import LocalCache
+from .TokenBucket import TokenBucket
+from .FanOut import FanOut, FanOutReport
+from .WriteBehindBuffer import WriteBehindBuffer
+from .SortedIndex import SortedIndex
+from .Leaderboard import Leaderboard
+from .ShardPlan import ShardPlan
+from .ReactionQueue import ReactionQueue
+from .JobScheduler import Job, JobScheduler
+from .TimingWheel import TimingWheel
+from .ReleaseSchedule import ReleaseSchedule
+from .StatsSnapshot import StatsSnapshot, ServerStats
+from . import Metrics
+from . import LogPipeline
@@ -1,5 +1,10 @@
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify
+from dotenv import load_dotenv
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest, multiprocess
+from typing import Optional
 from LCBot import LCBot
+from Utils import ShardPlan
+import multiprocessing
 import threading
 import os
 
@@ -22,14 +27,41 @@ def home():
 def health_check():
     return jsonify({"status": "healthy", "version": VERSION}), 200
 
+@app.route("/metrics")
+def metrics():
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        # Shard processes each write their own metric files, merge them into one scrape
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
 def run_server():
     app.run(host='0.0.0.0', port=int(os.getenv('PORT', 8000)))
 
+def run_bot(shardPlan: Optional[ShardPlan] = None):
+    bot = LCBot(shardPlan=shardPlan)
+    bot.run()
+
 if __name__ == "__main__":
+    load_dotenv()
     environment = os.getenv('ENVIRONMENT', 'development')
+    processCount = int(os.getenv('SHARD_PROCESSES', 1))
+
+    # Start shard processes before the server thread so they do not fork a running thread
+    processes = []
+    if processCount > 1:
+        for shardPlan in ShardPlan.from_env().split(processCount):
+            process = multiprocessing.Process(target=run_bot, args=(shardPlan,), name=f'shards-{shardPlan.shardIds}')
+            process.start()
+            processes.append(process)
+
     if environment == 'production':
         threading.Thread(target=run_server).start()
 
     # Run bot
-    bot = LCBot()
-    bot.run()
+    if processes:
+        for process in processes:
+            process.join()
+    else:
+        run_bot()